@@ -6,12 +6,24 @@ classdef AndorServer < handle
         op; % Andor operations struct
         file_option = 1; % communicate via file 
         fname = '';
+        bin = []; % memory mapped reply file, see AndorServer.py
+        last_req_seq = uint32(0);
+        poll_s = 0; % pause between checks for requests
+        req_id = []; % id of the request being handled in process, see AndorServer.py
     end
 
     methods%(Access = private)
-        function self = AndorServer(url)
+        function self = AndorServer(url, bin_fname)
             if self.file_option
                 self.fname = url;
+                self.poll_s = 0.5;
+                if nargin > 1
+                    % binary_file of the file_options of AndorServer.py: 8 uint32 header then the reply data
+                    info = dir(bin_fname);
+                    self.bin = memmapfile(bin_fname, 'Writable', true, 'Repeat', 1, ...
+                        'Format', {'uint32', [1 8], 'header'; 'uint8', [1 (info.bytes - 32)], 'data'});
+                    self.poll_s = 0.01;
+                end
             else
                 [path, ~, ~] = fileparts(mfilename('fullpath'));
                 pyglob = py.dict(pyargs('mat_srcpath', path, 'url', url));
@@ -28,22 +40,45 @@ classdef AndorServer < handle
         end
         function res = check_req_from_worker(self)
             if self.file_option
+                if ~isempty(self.bin)
+                    % the yaml file is only read when the request counter changed
+                    req_seq = self.bin.Data(1).header(1);
+                    if req_seq == self.last_req_seq
+                        res = struct('request', 'None');
+                        return
+                    end
+                    self.last_req_seq = req_seq;
+                end
                 contents = yaml.loadFile(self.fname);
                 res = contents;
             else
-                res = cell(self.serv.check_req_from_worker());
+                % waits up to 0.1 s for a request
+                res = cell(self.serv.wait_req_from_worker(0.1));
                 res{1} = char(res{1});
             end
         end
         function reply(self, msg_type, rep)
-            if self.file_option
+            if self.file_option && ~isempty(self.bin)
+                if isa(rep, 'int32')
+                    bytes = typecast(rep(:)', 'uint8');
+                    dtype = 1;
+                else
+                    bytes = typecast(double(rep(:)'), 'uint8');
+                    dtype = 0;
+                end
+                self.bin.Data(1).data(1:numel(bytes)) = bytes;
+                self.bin.Data(1).header(3) = uint32(numel(rep));
+                self.bin.Data(1).header(4) = uint32(dtype);
+                % written last, tells AndorServer.py that the reply is complete
+                self.bin.Data(1).header(2) = self.last_req_seq;
+            elseif self.file_option
                 reply_struct = struct();
                 reply_struct.request = 'reply';
                 reply_struct.msg_type = msg_type;
                 reply_struct.data = rep;
                 yaml.dumpFile(self.fname, reply_struct);
             else
-                self.serv.reply(msg_type, rep)
+                self.serv.reply(msg_type, rep, self.req_id)
             end
         end
         function out = handle_msg(self)
@@ -59,6 +94,7 @@ classdef AndorServer < handle
             else
                 msg = msg_tot{1};
                 msg_data = msg_tot{2};
+                self.req_id = msg_tot{3};
             end
             if strcmp(msg, "get_image")
                 %img = AndorTakePicture(self.op);
@@ -93,7 +129,7 @@ classdef AndorServer < handle
         function run(self)
             while true
                 self.handle_msg();
-                pause(0.5);
+                pause(self.poll_s);
             end
         end
         function recreate_sock(self)
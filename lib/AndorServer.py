@@ -1,17 +1,54 @@
 import yaml
 import zmq
 import threading
+import os
+import mmap
 import numpy as np
 from enum import Enum
+from collections import OrderedDict, deque
 import time
+import CommandRegistry
+import ArrayFrames
+
+class ForwardedRequest(object):
+    # a request waiting for MATLAB, see AndorServer.forward
+    def __init__(self, req_id, addr, msg_type, data, file_data, reply_types, timeout):
+        self.req_id = req_id
+        self.addr = addr # ROUTER identity of the client
+        self.msg_type = msg_type
+        self.data = data
+        self.file_data = file_data
+        self.reply_types = reply_types
+        self.received = time.time()
+        self.deadline = None if timeout is None else self.received + timeout
+        self.forwarded = False # handed to MATLAB
 
 class AndorServer(object):
     # To save sockets, this class doubles as also the feedback server for the sequence. 
+    #
+    # Requests that need MATLAB are kept in a table by request id, with the ROUTER identity to reply to, so that the
+    # server keeps answering other clients while MATLAB works. MATLAB may answer them in any order. Requests which are
+    # not answered within their timeout (request_timeout, or request_timeouts per command, in seconds) or which are
+    # cancelled with cancel_request get an error reply.
+    #
+    # MATLAB (AndorServer.m) either runs this class in process, waiting for requests with wait_req_from_worker and
+    # answering with reply, or talks through files (file_options). Requests are then written to data_file as yaml, one
+    # at a time: the next request is only written once MATLAB answered the previous one, even if that one timed out
+    # or was cancelled (its answer is then dropped). If
+    # binary_file is set, MATLAB replies through that memory mapped file instead of the yaml file. Its layout is a
+    # header of 8 uint32 followed by the data:
+    #   0: request sequence number, incremented here after writing a request to data_file
+    #   1: reply sequence number, set by MATLAB to the request sequence number once the reply is written
+    #   2: number of elements of the reply
+    #   3: type of the reply elements, see BINARY_DTYPES
+    BINARY_DTYPES = [np.float64, np.int32]
+    BINARY_HEADER = 32 # bytes
+
+    registry = CommandRegistry.CommandRegistry()
+
     class WorkerRequest(Enum):
         NoRequest = 0
         Stop = 1
-        Pending = 2
-        Reply = 3
 
     def recreate_sock(self):
         if self.__sock is not None:
@@ -38,22 +75,36 @@ class AndorServer(object):
             # initialize file
             write_dict = dict()
             write_dict["request"] = "None"
-            with open(self.data_fname, 'w') as file:
-                yaml.dump(write_dict, file)
-        
+            self.write_data_file(write_dict)
+            self.__bin = None
+            if "binary_file" in config["file_options"]:
+                binary_size = 2**21
+                if "binary_size" in config["file_options"]:
+                    binary_size = config["file_options"]["binary_size"]
+                with open(config["file_options"]["binary_file"], 'w+b') as file:
+                    file.truncate(self.BINARY_HEADER + binary_size)
+                    self.__bin = mmap.mmap(file.fileno(), self.BINARY_HEADER + binary_size)
+                self.__bin_header = np.frombuffer(self.__bin, dtype=np.uint32, count=self.BINARY_HEADER // 4)
+                self.__bin_header[:] = 0
+        # file polling interval in ms while MATLAB has a request
+        self.file_poll_ms = 10
+        self.request_timeout = None
+        if "request_timeout" in config:
+            self.request_timeout = config["request_timeout"]
+        self.request_timeouts = dict()
+        if "request_timeouts" in config:
+            self.request_timeouts = config["request_timeouts"]
 
         # lock for worker request
         self.__worker_lock = threading.Lock()
 
-        # data transfer
-        self.__data_lock = threading.Lock()
-        self.__msg_type = None
-        self.__data = None
-
-        self.__req_from_worker_lock = threading.Lock()
-        self.__req_from_worker = None
-        self.__rep_addr = None # reply address
-        self.__req_data = None
+        # requests waiting for MATLAB by request id, oldest first, and the replies of MATLAB, which the worker sends
+        self.__req_cond = threading.Condition(threading.RLock()) # notified when a request is added
+        self.requests = OrderedDict()
+        self.n_requests = 0
+        self.__replies = deque() # (request id, data)
+        self.__file_req = None # id of the request in the data file, until MATLAB answers it
+        self.__cur_addr = None # address of the request being handled
 
         # network
         self.__url = url
@@ -61,6 +112,12 @@ class AndorServer(object):
         self.__sock = None
         self.recreate_sock()
         self.timeout = 500
+        # reply wakes up the worker through this pair instead of the worker polling for it
+        self.__wake_lock = threading.Lock()
+        self.__wake_pull = self.__ctx.socket(zmq.PULL)
+        self.__wake_pull.bind("inproc://andor_wake_" + str(id(self)))
+        self.__wake_push = self.__ctx.socket(zmq.PUSH)
+        self.__wake_push.connect("inproc://andor_wake_" + str(id(self)))
 
         # worker. This worker will handle network requests
         with self.__worker_lock:
@@ -70,6 +127,8 @@ class AndorServer(object):
 
     def __del__(self):
         self.stop_worker()
+        self.__wake_push.close()
+        self.__wake_pull.close()
         self.__sock.close()
         self.__ctx.destroy
 
@@ -94,77 +153,173 @@ class AndorServer(object):
         self.__worker = threading.Thread(target = self.__worker_func)
         self.__worker.start()
 
-    def handle_msg(self, addr,  msg_str: str) -> bool:
+    def handle_msg(self, addr, msg_str: str, frames) -> bool:
         # Method to handle different requests from external clients. We handle the ones we know. Andor handling will be limited for now.
-        if self.file_option:
-            write_dict = dict()
-        if msg_str == "get_width":
-            self.safe_send(addr, [0], [int(512).to_bytes(4, 'little')])
-            return True
-        elif msg_str == "get_height":
-            self.safe_send(addr, [0], [int(512).to_bytes(4, 'little')])
-            return True
-        elif msg_str == "get_depth":
-            self.safe_send(addr, [0], [int(16).to_bytes(4, 'little')])
-            return True
-        elif msg_str == "get_serial":
-            self.safe_send(addr, [1], ["Andor"])
-            return True
-        elif msg_str == "close":
-            self.safe_send(addr, [1], ["Andor doesn't close"])
-            return True
-        elif msg_str == "info":
-            self.safe_send(addr, [1], ["Andor"])
-            return True
-        elif msg_str == "get_exposure":
-            pass
-        elif msg_str == "set_exposure":
-            exposure = self.safe_recv()
-            exposure = np.frombuffer(exposure)
-            exposure = exposure[0]
-            with self.__req_from_worker_lock:
-                self.__req_data = exposure
-                if self.file_option:
-                    write_dict["data"] = str(exposure)
-        elif msg_str == "set_woi":
-            woi = self.safe_recv()
-            woi = np.frombuffer(woi)
-            with self.__req_from_worker_lock:
-                self.__req_data = woi
-                if self.file_option:
-                    write_dict["data"] = str(woi)
-        elif msg_str == "get_image":
-            pass
-        elif msg_str == "flush":
-            self.safe_send(addr, [1], ["ok"])
-            return True
-        elif msg_str == "id":
-            self.safe_send(addr, [1], ["MATLAB Experimental Control Server/Andor Server"])
-            return True
-        elif msg_str == "get_spot_amps":
-            scan_fname = self.safe_recv_string()
-            scan_name = self.safe_recv_string()
-            NumPerParamAvg = int.from_bytes(self.safe_recv(), 'little')
-            with self.__req_from_worker_lock:
-                self.__req_data = [scan_fname, scan_name, NumPerParamAvg]
-                if self.file_option:
-                    write_dict["data"] = [scan_fname, scan_name, NumPerParamAvg]
-            pass
-        else:
-            self.safe_send(addr, [1], [f''])
-            print("Unknown request " + msg_str)
-            return False
-        with self.__req_from_worker_lock:
-            self.__req_from_worker = msg_str
-            self.__rep_addr = addr
+        # Requests that need MATLAB are forwarded by their handler, which returns no reply. The reply is sent once MATLAB answers.
+        self.__cur_addr = addr
+        msg_type, rep = self.registry.dispatch(self, msg_str, frames)
+        if msg_type is not None:
+            self.safe_send(addr, msg_type, rep)
+        return msg_str in self.registry.commands
+
+    def forward(self, msg_str, data, file_data=None):
+        # Hand a request to MATLAB, either in process through check_req_from_worker or through the data file.
+        # The reply is sent when MATLAB answers, see reply.
+        timeout = self.request_timeouts.get(msg_str, self.request_timeout)
+        with self.__req_cond:
+            self.n_requests += 1
+            request = ForwardedRequest(self.n_requests, self.__cur_addr, msg_str, data, file_data, self.registry.commands[msg_str].reply, timeout)
+            self.requests[request.req_id] = request
             # If files are being used communicate into file.
             if self.file_option:
-                write_dict["request"] = msg_str
-                with open(self.data_fname, 'w') as file:
-                    yaml.dump(write_dict, file)
-        with self.__worker_lock:
-            self.__worker_req = self.WorkerRequest.Pending
-        return True
+                self.next_file_request()
+            self.__req_cond.notify_all()
+        return None, None
+
+    def next_file_request(self):
+        # writes the oldest request MATLAB has not seen to the data file, if the file is free
+        with self.__req_cond:
+            if self.__file_req is not None:
+                return
+            request = next((r for r in self.requests.values() if not r.forwarded), None)
+            if request is None:
+                return
+            request.forwarded = True
+            self.__file_req = request.req_id
+            write_dict = dict()
+            write_dict["request"] = request.msg_type
+            if request.file_data is not None:
+                write_dict["data"] = request.file_data
+            self.write_data_file(write_dict)
+            if self.__bin is not None:
+                self.__bin_header[0] += 1
+
+    def finish_request(self, request, msg_type, rep):
+        # replies to a request, which must already be out of the table
+        self.safe_send(request.addr, msg_type, rep)
+
+    def free_data_file(self):
+        # MATLAB answered the request in the data file, which can take the next one
+        with self.__req_cond:
+            self.__file_req = None
+            self.next_file_request()
+
+    def send_replies(self):
+        while True:
+            with self.__req_cond:
+                if len(self.__replies) == 0:
+                    return
+                req_id, data = self.__replies.popleft()
+                request = self.requests.pop(req_id, None)
+            if request is None:
+                continue
+            try:
+                msg_type, rep = self._reply(request.msg_type, data)
+            except Exception as e:
+                msg_type, rep = CommandRegistry.error_reply("bad_reply", str(e), request.reply_types)
+            self.finish_request(request, msg_type, rep)
+
+    def check_timeouts(self):
+        now = time.time()
+        with self.__req_cond:
+            expired = [r for r in self.requests.values() if r.deadline is not None and r.deadline < now]
+            for request in expired:
+                del self.requests[request.req_id]
+        for request in expired:
+            print("Request " + str(request.req_id) + " (" + request.msg_type + ") timed out")
+            msg_type, rep = CommandRegistry.error_reply("timeout", request.msg_type + " was not answered in " + str(round(now - request.received, 1)) + " s", request.reply_types)
+            self.finish_request(request, msg_type, rep)
+
+    @registry.command("list_requests")
+    def list_requests(self):
+        # requests waiting for MATLAB, separated by semicolons, as "id msg_type forwarded age_s"
+        now = time.time()
+        with self.__req_cond:
+            items = [str(r.req_id) + " " + r.msg_type + " " + str(r.forwarded) + " " + str(round(now - r.received, 1)) for r in self.requests.values()]
+        return [1], [";".join(items)]
+
+    @registry.command("cancel_request", args=[1])
+    def cancel_request(self, req_id):
+        # the request gets a cancelled error reply. A later answer of MATLAB is dropped.
+        with self.__req_cond:
+            request = self.requests.pop(int(req_id), None)
+        if request is None:
+            return [1], ["error: unknown request " + req_id]
+        msg_type, rep = CommandRegistry.error_reply("cancelled", request.msg_type + " was cancelled", request.reply_types)
+        self.finish_request(request, msg_type, rep)
+        return [1], ["ok"]
+
+    def data_file_stamp(self):
+        # The modification time alone can miss a reply written right after the request, as it only advances every
+        # ~16 ms on NTFS. Requests and replies differ in size.
+        stat = os.stat(self.data_fname)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def write_data_file(self, write_dict):
+        with open(self.data_fname, 'w') as file:
+            yaml.dump(write_dict, file)
+        # our own writes do not need to be read back, see check_data_file
+        self.__data_stamp = self.data_file_stamp()
+
+    @registry.command("list_commands")
+    def list_commands(self):
+        return [1], [self.registry.describe()]
+
+    @registry.command("get_width", reply=[0])
+    def get_width(self):
+        return [0], [int(512).to_bytes(4, 'little')]
+
+    @registry.command("get_height", reply=[0])
+    def get_height(self):
+        return [0], [int(512).to_bytes(4, 'little')]
+
+    @registry.command("get_depth", reply=[0])
+    def get_depth(self):
+        return [0], [int(16).to_bytes(4, 'little')]
+
+    @registry.command("get_serial")
+    def get_serial(self):
+        return [1], ["Andor"]
+
+    @registry.command("close")
+    def close_camera(self):
+        return [1], ["Andor doesn't close"]
+
+    @registry.command("info")
+    def info(self):
+        return [1], ["Andor"]
+
+    @registry.command("flush")
+    def flush(self):
+        return [1], ["ok"]
+
+    @registry.command("id")
+    def reply_id(self):
+        return [1], ["MATLAB Experimental Control Server/Andor Server"]
+
+    @registry.command("get_exposure", reply=[0])
+    def get_exposure(self):
+        return self.forward("get_exposure", None)
+
+    @registry.command("set_exposure", args=[0])
+    def set_exposure(self, exposure):
+        exposure = np.frombuffer(exposure)
+        exposure = exposure[0]
+        return self.forward("set_exposure", exposure, str(exposure))
+
+    @registry.command("set_woi", args=[0])
+    def set_woi(self, woi):
+        woi = np.frombuffer(woi)
+        return self.forward("set_woi", woi, str(woi))
+
+    @registry.command("get_image", reply=[1, 0])
+    def get_image(self):
+        return self.forward("get_image", None)
+
+    @registry.command("get_spot_amps", args=[1, 1, 0], reply=[0])
+    def get_spot_amps(self, scan_fname, scan_name, NumPerParamAvg):
+        NumPerParamAvg = int.from_bytes(NumPerParamAvg, 'little', signed=True)
+        return self.forward("get_spot_amps", [scan_fname, scan_name, NumPerParamAvg], [scan_fname, scan_name, NumPerParamAvg])
 
     def safe_receive(func):
         def f(self):
@@ -183,12 +338,17 @@ class AndorServer(object):
     def safe_recv_string(self):
         return self.__sock.recv_string(zmq.NOBLOCK)
 
+    def recv_frames(self):
+        # receive the remaining frames of the current message
+        frames = []
+        while self.__sock.getsockopt(zmq.RCVMORE):
+            frames.append(self.__sock.recv(zmq.NOBLOCK))
+        return frames
+
     def finish_recv(func):
         def f(self, *args, **kwargs):
             # finish receiving messages
-            msg = self.safe_recv()
-            while msg is not None:
-                msg = self.safe_recv()
+            self.recv_frames()
             func(self, *args, **kwargs)
         return f
 
@@ -205,48 +365,77 @@ class AndorServer(object):
             if msg_type[idx] == 1:
                 self.__sock.send_string(item, flag)
             else:
-                self.__sock.send(item, flag)
+                # arrays are sent in place, see ArrayFrames
+                self.__sock.send(item, flag, copy=False)
         #print("Done sending")
 
     def __check_worker_req(self):
         with self.__worker_lock:
             return self.__worker_req
 
+    def check_data_file(self):
+        # replies MATLAB wrote to the files for the request in the data file. The yaml file is only parsed when it
+        # changed.
+        req_id = self.__file_req
+        if self.__bin is not None:
+            if self.__bin_header[1] != self.__bin_header[0]:
+                return
+            count = int(self.__bin_header[2])
+            dtype = self.BINARY_DTYPES[int(self.__bin_header[3])]
+            data = np.frombuffer(self.__bin, dtype=dtype, count=count, offset=self.BINARY_HEADER).copy()
+            self.reply(None, data, req_id)
+            self.free_data_file()
+            return
+        stamp = self.data_file_stamp()
+        if stamp == self.__data_stamp:
+            return
+        self.__data_stamp = stamp
+        try:
+            with open(self.data_fname, 'r') as file:
+                data = yaml.load(file, Loader=yaml.FullLoader)
+        except Exception:
+            data = None
+        if not isinstance(data, dict) or "request" not in data or \
+                (data["request"] == "reply" and ("msg_type" not in data or "data" not in data)):
+            # read while MATLAB was writing, read again at the next poll
+            self.__data_stamp = None
+            return
+        if data["request"] == "reply":
+            data_to_send = data["data"]
+            if data["msg_type"] == "get_spot_amps":
+                data_to_send = np.array(data["data"])
+            self.reply(data["msg_type"], data_to_send, req_id)
+            write_dict = dict()
+            write_dict["request"] = "None"
+            self.write_data_file(write_dict)
+            self.free_data_file()
+
     def __worker_func(self):
-        # worker function
+        # worker function. Waits on the socket for requests and on the wake socket for replies of MATLAB.
+        poller = zmq.Poller()
+        poller.register(self.__wake_pull, zmq.POLLIN)
+        poller.register(self.__sock, zmq.POLLIN)
         while self.__check_worker_req() != self.WorkerRequest.Stop:
-            if self.file_option:
-                with open(self.data_fname, 'r') as file:
-                    data = yaml.load(file, Loader=yaml.FullLoader)
-                    if data["request"] == "reply":
-                        if data["msg_type"] == "get_spot_amps":
-                            data_to_send = np.array(data["data"])
-                        self.reply(data["msg_type"], data_to_send)
-                        with open(self.data_fname, 'w') as file2:
-                            write_dict = dict()
-                            write_dict["request"] = "None"
-                            yaml.dump(write_dict, file2)
-            if self.__check_worker_req() == self.WorkerRequest.NoRequest:
-                if self.__sock.poll(self.timeout) == 0: # in milliseconds
-                    continue
-                addr = self.safe_recv()
-                delimit = self.safe_recv_string()
-                msg_str = self.safe_recv_string()
-                if msg_str is None:
-                    self.safe_send(addr, [1], ["Send more"])
-                self.handle_msg(addr, msg_str)
-            elif self.__check_worker_req() == self.WorkerRequest.Reply:
-                with self.__req_from_worker_lock:
-                    self.__req_from_worker = None
-                    addr = self.__rep_addr
-                with self.__data_lock:
-                    rep = self.__data
-                    msg_type = self.__msg_type
-                msg_type, rep = self._reply(msg_type, rep)
-                self.safe_send(addr, msg_type, rep)
-                with self.__worker_lock:
-                    self.__worker_req = self.WorkerRequest.NoRequest
-            time.sleep(0.5)
+            if self.file_option and self.__file_req is not None:
+                self.check_data_file()
+            self.send_replies()
+            self.check_timeouts()
+            timeout = self.timeout # in milliseconds
+            if self.file_option and self.__file_req is not None:
+                timeout = self.file_poll_ms
+            events = dict(poller.poll(timeout))
+            if self.__wake_pull in events:
+                while self.__wake_pull.poll(0):
+                    self.__wake_pull.recv()
+            if self.__sock not in events:
+                continue
+            addr = self.safe_recv()
+            delimit = self.safe_recv_string()
+            msg_str = self.safe_recv_string()
+            if msg_str is None:
+                self.safe_send(addr, [1], ["Send more"])
+                continue
+            self.handle_msg(addr, msg_str, self.recv_frames())
         print("Worker finishing")
 
     def _reply(self, msg_type, data):
@@ -258,23 +447,40 @@ class AndorServer(object):
         elif msg_type == "set_woi":
             return [1], ["ok"]
         elif msg_type == "get_image":
-            return [0], [data.tobytes()]
+            # MATLAB replies with the image as one row, see get_height and get_width
+            img = np.ascontiguousarray(data).reshape(512, 512)
+            return [1, 0], [ArrayFrames.header(img), img]
         elif msg_type == "get_spot_amps":
             return [0], [data.tobytes()]
         else:
             return [1], ["unknown reply"]
     
     def check_req_from_worker(self):
-        if self.__check_worker_req() == self.WorkerRequest.Pending:
-            print('Checking for request')
-            with self.__req_from_worker_lock:
-                return (self.__req_from_worker, self.__req_data)
-        else:
-            return None, None
+        # (msg_type, data, request id) of the oldest request not handed to MATLAB yet, or Nones
+        with self.__req_cond:
+            for request in self.requests.values():
+                if not request.forwarded:
+                    print('Forwarding request ' + str(request.req_id))
+                    request.forwarded = True
+                    return (request.msg_type, request.data, request.req_id)
+        return None, None, None
 
-    def reply(self, msg_type, rep):
-        with self.__data_lock:
-            self.__msg_type = msg_type
-            self.__data = rep
-        with self.__worker_lock:
-            self.__worker_req = self.WorkerRequest.Reply
\ No newline at end of file
+    def wait_req_from_worker(self, timeout_s=0.1):
+        # As check_req_from_worker, but waits up to timeout_s for a request. MATLAB calls it in a loop with a short
+        # timeout so that it stays responsive to ctrl-c.
+        with self.__req_cond:
+            self.__req_cond.wait_for(lambda: any(not r.forwarded for r in self.requests.values()), timeout_s)
+            return self.check_req_from_worker()
+
+    def reply(self, msg_type, rep, req_id=None):
+        # Answer of MATLAB to request req_id, or without an id to the oldest request of type msg_type handed to it.
+        # Called from the MATLAB thread, the worker sends the reply.
+        with self.__req_cond:
+            if req_id is None:
+                req_id = next((r.req_id for r in self.requests.values() if r.forwarded and r.msg_type == msg_type), None)
+            if req_id is None or int(req_id) not in self.requests:
+                print("Dropping reply to " + str(msg_type) + ", the request timed out or was cancelled")
+                return
+            self.__replies.append((int(req_id), rep))
+        with self.__wake_lock:
+            self.__wake_push.send(b'')
@@ -0,0 +1,49 @@
+"""
+Sends numpy arrays over zmq without copying them. An array is two frames: a string header "dtype;shape" with the
+numpy type string and the dimensions separated by commas (e.g. "<f4;1200,1920"), followed by the raw C ordered data.
+
+The data is sent with copy=False, so zmq reads the array in place, and received with copy=False, so the array
+returned by from_frames is a view of the zmq message rather than of a copy of it.
+"""
+
+import zmq
+import numpy as np
+
+def header(arr):
+    return arr.dtype.str + ";" + ",".join(str(n) for n in arr.shape)
+
+def parse_header(header):
+    """
+    Returns:
+        (dtype, shape) described by a header.
+
+    """
+    dtype, shape = header.split(";")
+    return np.dtype(dtype), tuple(int(n) for n in shape.split(",") if n != "")
+
+def from_frames(header, data):
+    """
+    Returns the array held by a header and a data frame (bytes or zmq.Frame), without copying the data.
+
+    Raises:
+        Exception if the size of the data does not match the header.
+
+    """
+    dtype, shape = parse_header(header)
+    if len(memoryview(data).cast('B')) != dtype.itemsize * int(np.prod(shape)):
+        raise Exception("array data does not match header " + header)
+    return np.frombuffer(data, dtype=dtype).reshape(shape)
+
+def send(sock, arr, flags=0):
+    # flags apply to the data frame, e.g. zmq.SNDMORE if more frames follow
+    arr = np.asarray(arr)
+    if not arr.flags.c_contiguous:
+        # not np.ascontiguousarray alone, which turns 0-d arrays into 1-d ones
+        arr = np.ascontiguousarray(arr)
+    sock.send_string(header(arr), zmq.SNDMORE)
+    sock.send(arr, flags, copy=False)
+
+def recv(sock, flags=0):
+    header = sock.recv_string(flags)
+    data = sock.recv(flags, copy=False)
+    return from_frames(header, data)
@@ -0,0 +1,81 @@
+"""
+Calculates and saves many patterns in parallel, for building libraries of patterns (array sweeps, spacing scans) in
+one request.
+
+Each pattern runs in a worker process of a process pool, with its own FFT backend and plans. The processes have no
+camera or SLM, so targets are converted to computational space pixels (knm) and the SLM amplitude is copied by the
+server before submitting. Results are reported as they finish.
+"""
+
+import os
+import concurrent.futures
+import numpy as np
+import utils
+import FFTBackend
+
+def _init_worker(fft_name):
+    # the pool already uses every core, so each process runs single threaded FFTs
+    FFTBackend.install(FFTBackend.get_backend(fft_name, 1))
+
+def calculate_one(index, computational_shape, slm_shape, spot_knm, spot_amp, slm_amp, n_iters, save_options):
+    """
+    Calculates and saves one pattern. Runs in a worker process, so everything is passed by value.
+
+    Returns:
+        dict with the index, the config and data paths and the final efficiency and uniformity.
+
+    """
+    import slmsuite.holography.algorithms
+    hologram = slmsuite.holography.algorithms.SpotHologram(computational_shape, spot_knm, spot_amp=spot_amp, basis='knm', slm_shape=slm_shape, amp=slm_amp)
+    if spot_knm.shape[1] == 1:
+        stat_group = 'computational'
+        hologram.optimize(method="GS", maxiter=n_iters, feedback='computational_spot', stat_groups=[stat_group])
+    else:
+        stat_group = 'computational_spot'
+        hologram.optimize(method="WGS-Kim", maxiter=n_iters, feedback='computational_spot', stat_groups=[stat_group])
+    config_path, data_path = utils.save_slm_calculation(hologram, save_options)
+    result = {"index": index, "config": config_path, "data": data_path}
+    stats = hologram.stats["stats"].get(stat_group, dict())
+    for stat in ["efficiency", "uniformity"]:
+        if stat in stats and len(stats[stat]) > 0:
+            result[stat] = float(stats[stat][-1])
+    return result
+
+def calculate_batch(tasks, max_workers=None, fft_name="numpy", on_result=None, cancelled=None):
+    """
+    Runs calculate_one for every task in a process pool.
+
+    Args:
+        tasks: List of tuples of the arguments of calculate_one.
+        max_workers: Number of processes. Default is the number of cores.
+        fft_name: FFT backend of the workers, see FFTBackend.
+        on_result: Called with each result as it finishes.
+        cancelled: Function returning True to stop. Patterns which have not started are dropped.
+
+    Returns:
+        List of results in the order of tasks. Failed patterns have an error entry instead of paths.
+
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count()
+    max_workers = max(1, min(max_workers, len(tasks)))
+    results = [None for _ in tasks]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(fft_name,)) as pool:
+        futures = dict()
+        for idx, task in enumerate(tasks):
+            futures[pool.submit(calculate_one, *task)] = idx
+        for future in concurrent.futures.as_completed(futures):
+            idx = futures[future]
+            try:
+                result = future.result()
+            except concurrent.futures.CancelledError:
+                continue
+            except Exception as e:
+                result = {"index": idx, "error": str(e)}
+            results[idx] = result
+            if on_result is not None:
+                on_result(result)
+            if cancelled is not None and cancelled():
+                for other in futures:
+                    other.cancel()
+    return results
@@ -1,5 +1,6 @@
 import zmq
 import numpy as np
+import ArrayFrames
 from slmsuite.hardware.cameras.camera import Camera
 
 class CameraClient(Camera):
@@ -58,6 +59,7 @@ class CameraClient(Camera):
         self.__sock = None
         self.recreate_sock()
         self.timeout = 500
+        self.__sub = None # frames streamed by the server, see subscribe
         self.connected = True # Start off true.
         self.width = self.get_width()
         self.height = self.get_height()
@@ -75,12 +77,13 @@ class CameraClient(Camera):
 
     # decorators for polling
     # recv_type = 1 is a string receive
-    def poll_recv(recv_type = [1], timeout=1000, flag=0, default_val=None):
+    # copy=False receives binary frames as zmq.Frame, whose buffer can back an array without copying
+    def poll_recv(recv_type = [1], timeout=1000, flag=0, default_val=None, copy=True):
         def deco(func):
-            def f(self, *args): #timeout in milliseconds
+            def f(self, *args, **kwargs): #timeout in milliseconds
                 try:
                     if self.connected:
-                        func(self, *args)
+                        func(self, *args, **kwargs)
                     else:
                         return default_val
                 except Exception as e:
@@ -94,7 +97,7 @@ class CameraClient(Camera):
                         rep.append(default_val[i])
                     else:
                         if i == 0:
-                            rep.append(self.__sock.recv(flag))
+                            rep.append(self.__sock.recv(flag, copy=copy))
                         else:
                             rep.append(self.__sock.recv_string(flag))
                 return rep
@@ -129,6 +132,19 @@ class CameraClient(Camera):
             return data
         return f
 
+    def recv_array(func):
+        # header and data frames, see ArrayFrames
+        def f(*args, **kwargs):
+            rep = func(*args, **kwargs)
+            data = None
+            if rep is not None and rep[0] is not None:
+                if rep[0].startswith("error"):
+                    print(rep[0])
+                else:
+                    data = ArrayFrames.from_frames(rep[0], rep[1])
+            return data
+        return f
+
     def recv1arr(reshape_dims=None, dtype=float):
         def deco(func):
             def f(*args, **kwargs):
@@ -199,20 +215,130 @@ class CameraClient(Camera):
             
 
     def get_image(self, timeout_ms=60000):
-        @CameraClient.recv1arr((self.height, self.width), np.int32)
-        @CameraClient.poll_recv([0], timeout=timeout_ms)
+        # The image is a view of the received frame, in the dtype and shape sent by the server.
+        @CameraClient.recv_array
+        @CameraClient.poll_recv([1, 0], timeout=timeout_ms, default_val=[None, None], copy=False)
         def _get_image(self):
             self.__sock.send_string("get_image")
+        img = None
         if self.connected:
-            return _get_image(self)
-        else:
-            return np.zeros((self.height, self.width), dtype=np.int32)
+            img = _get_image(self)
+        if img is None:
+            return np.zeros((self.height, self.width), dtype=np.uint8 if self.bitdepth <= 8 else np.uint16)
+        return img
 
     @recv1
     @poll_recv([1], default_val=["Not connected"])
     def flush(self):
         self.__sock.send_string("flush")
 
+    @recv1
+    @poll_recv([1], default_val=["Not connected"])
+    def set_spot_windows(self, centers, size):
+        """
+        Sets the windows used by :meth:`get_spot_windows` and :meth:`get_spot_amps`.
+
+        Parameters
+        ----------
+        centers : numpy.ndarray
+            2 x N array of the x and y centers of the windows in camera pixels.
+        size : int or (int, int)
+            Width, or width and height, of the windows in pixels.
+        """
+        self.__sock.send_string("set_spot_windows", zmq.SNDMORE)
+        self.__sock.send(np.asarray(centers, dtype=np.float64).reshape(2, -1).tobytes(), zmq.SNDMORE)
+        self.__sock.send(np.atleast_1d(np.asarray(size, dtype=np.float64)).tobytes())
+
+    def get_spot_windows(self, timeout_ms=60000):
+        # N x height x width array of the windows of an image, cut on the server
+        @CameraClient.recv_array
+        @CameraClient.poll_recv([1, 0], timeout=timeout_ms, default_val=[None, None], copy=False)
+        def _get_spot_windows(self):
+            self.__sock.send_string("get_spot_windows")
+        if self.connected:
+            return _get_spot_windows(self)
+        return None
+
+    def get_spot_amps(self, timeout_ms=60000):
+        # sum of each window of an image, summed on the server
+        @CameraClient.recv_array
+        @CameraClient.poll_recv([1, 0], timeout=timeout_ms, default_val=[None, None], copy=False)
+        def _get_spot_amps(self):
+            self.__sock.send_string("get_spot_amps")
+        if self.connected:
+            return _get_spot_amps(self)
+        return None
+
+    @recv1
+    @poll_recv([1], default_val=["Not connected"])
+    def start_stream(self):
+        self.__sock.send_string("start_stream")
+
+    @recv1
+    @poll_recv([1], default_val=["Not connected"])
+    def stop_stream(self):
+        self.__sock.send_string("stop_stream")
+
+    @recv1
+    @poll_recv([1], default_val=["Not connected"])
+    def get_stream_status(self):
+        self.__sock.send_string("get_stream_status")
+
+    def subscribe(self, stream_url, queue_size=4):
+        """
+        Connects to the frames published by the server after :meth:`start_stream`.
+
+        Parameters
+        ----------
+        stream_url : str
+            The stream_url of the server, with its address, e.g. tcp://192.168.0.10:8852.
+        queue_size : int
+            Frames kept while not reading. Older frames are dropped.
+        """
+        self.unsubscribe()
+        self.__sub = self.__ctx.socket(zmq.SUB)
+        self.__sub.setsockopt(zmq.RCVHWM, queue_size)
+        self.__sub.setsockopt(zmq.SUBSCRIBE, b"")
+        self.__sub.connect(stream_url)
+
+    def unsubscribe(self):
+        if self.__sub is not None:
+            self.__sub.close()
+            self.__sub = None
+
+    def _recv_frame(self):
+        seq, timestamp = self.__sub.recv_string().split(";")
+        return int(seq), float(timestamp), ArrayFrames.recv(self.__sub)
+
+    def get_latest_frame(self, timeout_ms=1000):
+        """
+        Returns the most recent streamed frame, waiting for one if none arrived since the last call.
+
+        Returns
+        -------
+        (int, float, numpy.ndarray) or None
+            Sequence number, timestamp (seconds since the epoch) and image, or None after timeout_ms.
+        """
+        frame = None
+        while self.__sub.poll(0):
+            frame = self._recv_frame()
+        if frame is None and self.__sub.poll(timeout_ms):
+            frame = self._recv_frame()
+        return frame
+
+    def get_next_frames(self, n, timeout_ms=1000):
+        """
+        Returns the next n streamed frames, as in :meth:`get_latest_frame`. Frames which arrived before the call are
+        dropped. Gaps in the sequence numbers are frames dropped because the client was too slow. Fewer frames are
+        returned if one takes more than timeout_ms.
+        """
+        while self.__sub.poll(0):
+            self._recv_frame()
+        frames = []
+        while len(frames) < n and self.__sub.poll(timeout_ms):
+            frames.append(self._recv_frame())
+        return frames
+
     @recv1int
     @poll_recv([0], default_val=[int(512).to_bytes(4, 'little')])
     def get_width(self):
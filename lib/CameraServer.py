@@ -5,11 +5,15 @@ import numpy as np
 import slmsuite.hardware.cameras.camera
 from enum import Enum
 import time
-from matplotlib import pyplot as plt
 from datetime import datetime
+import CommandRegistry
+import ArrayFrames
+import SpotExtractor
 
 class CameraServer(object):
 
+    registry = CommandRegistry.CommandRegistry()
+
     class WorkerRequest(Enum):
         NoRequest = 0
         Stop = 1
@@ -36,12 +40,13 @@ class CameraServer(object):
                 self.cam = slmsuite.hardware.cameras.camera.Camera(1024, 1024)
                 self.cam_type = "virtual"
             elif camera_type == "thorcam_scientific_camera":
-                import slmsuite.hardware.cameras.thorlabs
+                # a local "import slmsuite..." would make slmsuite a local name of __init__ and break the virtual branch
+                from slmsuite.hardware.cameras import thorlabs
                 if "sn" in camera_dict:
                     serial = str(camera_dict["sn"])
                 else:
                     serial = ""
-                self.cam = slmsuite.hardware.cameras.thorlabs.ThorCam(serial)
+                self.cam = thorlabs.ThorCam(serial)
                 self.cam_type = "thorcam_scientific_camera"
             elif camera_type == "the_imaging_source":
                 import tis_camera as ts
@@ -73,8 +78,15 @@ class CameraServer(object):
         if "plot" in config:
             self.plot = config["plot"]
 
+        # windows around the spots for get_spot_windows and get_spot_amps, see set_spot_windows
+        self.spot_centers = None
+        self.spot_size = None
+        self.spot_extractor = None
+
         # lock for worker request
         self.__worker_lock = threading.Lock()
+        # the stream and the requests take turns using the camera
+        self.cam_lock = threading.Lock()
 
         # network
         self.__url = url
@@ -83,6 +95,17 @@ class CameraServer(object):
         self.recreate_sock()
         self.timeout = 500
 
+        # frames published by start_stream, as fast as the camera produces them
+        self.__pub = None
+        if "stream_url" in config:
+            self.__pub = self.__ctx.socket(zmq.PUB)
+            # drop frames for subscribers which are more than a few frames behind instead of queueing them
+            self.__pub.setsockopt(zmq.SNDHWM, 4)
+            self.__pub.bind(config["stream_url"])
+        self.__streaming = threading.Event()
+        self.__stream = None
+        self.stream_seq = 0
+
         # worker. This worker will handle network requests
         with self.__worker_lock:
             self.__worker_req = self.WorkerRequest.NoRequest
@@ -91,6 +114,9 @@ class CameraServer(object):
 
     def __del__(self):
         self.stop_worker()
+        self.stop_stream()
+        if self.__pub is not None:
+            self.__pub.close()
         self.__sock.close()
         self.__ctx.destroy
 
@@ -111,36 +137,12 @@ class CameraServer(object):
         self.__worker = threading.Thread(target = self.__worker_func)
         self.__worker.start()
 
-    def handle_msg(self, addr,  msg_str: str) -> bool:
-        # Method to handle different requests from external clients
-        if msg_str == "get_width":
-            msg_type, rep = self.get_width()
-        elif msg_str == "get_height":
-            msg_type, rep = self.get_height()
-        elif msg_str == "get_depth":
-            msg_type, rep = self.get_depth()
-        elif msg_str == "get_serial":
-            msg_type, rep = self.get_serial()
-        elif msg_str == "close":
-            msg_type, rep = self.close()
-        elif msg_str == "info":
-            msg_type, rep = self.info()
-        elif msg_str == "get_exposure":
-            msg_type, rep = self.get_exposure()
-        elif msg_str == "set_exposure":
-            msg_type, rep = self.set_exposure()
-        elif msg_str == "set_woi":
-            msg_type, rep = self.set_woi()
-        elif msg_str == "get_image":
-            msg_type, rep = self.get_image()
-        elif msg_str == "flush":
-            msg_type, rep = self.flush()
-        else:
-            self.safe_send(addr, [1], [f''])
-            print("Unknown request " + msg_str)
-            return False
-        self.safe_send(addr, msg_type, rep)
-        return True
+    def handle_msg(self, addr, msg_str: str, frames) -> bool:
+        # Method to handle different requests from external clients. See the handlers registered below.
+        msg_type, rep = self.registry.dispatch(self, msg_str, frames)
+        if msg_type is not None:
+            self.safe_send(addr, msg_type, rep)
+        return msg_str in self.registry.commands
 
     def safe_receive(func):
         def f(self):
@@ -159,12 +161,17 @@ class CameraServer(object):
     def safe_recv_string(self):
         return self.__sock.recv_string(zmq.NOBLOCK)
 
+    def recv_frames(self):
+        # receive the remaining frames of the current message
+        frames = []
+        while self.__sock.getsockopt(zmq.RCVMORE):
+            frames.append(self.__sock.recv(zmq.NOBLOCK))
+        return frames
+
     def finish_recv(func):
         def f(self, *args, **kwargs):
             # finish receiving messages
-            msg = self.safe_recv()
-            while msg is not None:
-                msg = self.safe_recv()
+            self.recv_frames()
             func(self, *args, **kwargs)
         return f
 
@@ -181,7 +188,8 @@ class CameraServer(object):
             if msg_type[idx] == 1:
                 self.__sock.send_string(item, flag)
             else:
-                self.__sock.send(item, flag)
+                # arrays are sent in place, see ArrayFrames
+                self.__sock.send(item, flag, copy=False)
         #print("Done sending")
 
     def __check_worker_req(self):
@@ -198,9 +206,15 @@ class CameraServer(object):
             msg_str = self.safe_recv_string()
             if msg_str is None:
                 self.safe_send(addr, [1], ["Send more"])
-            self.handle_msg(addr, msg_str)
+                continue
+            self.handle_msg(addr, msg_str, self.recv_frames())
         print("Worker finishing")
 
+    @registry.command("list_commands")
+    def list_commands(self):
+        return [1], [self.registry.describe()]
+
+    @registry.command("get_width", reply=[0])
     def get_width(self):
         if self.cam_type == "virtual":
             width = int(1024)
@@ -208,6 +222,7 @@ class CameraServer(object):
             width = int(self.cam.shape[1])
         return [0], [width.to_bytes(4, 'little')]
 
+    @registry.command("get_height", reply=[0])
     def get_height(self):
         if self.cam_type == "virtual":
             height = int(1024)
@@ -215,6 +230,7 @@ class CameraServer(object):
             height = int(self.cam.shape[0])
         return [0], [height.to_bytes(4, 'little')]
 
+    @registry.command("get_depth", reply=[0])
     def get_depth(self):
         if self.cam_type == "virtual":
             depth = int(8)
@@ -222,6 +238,7 @@ class CameraServer(object):
             depth = int(self.cam.bitdepth)
         return [0], [depth.to_bytes(4, 'little')]
 
+    @registry.command("get_serial")
     def get_serial(self):
         if self.cam_type == "virtual":
             name = "virtual_camera"
@@ -229,16 +246,20 @@ class CameraServer(object):
             name = self.cam.name
         return [1], [name]
 
+    @registry.command("close")
     def close(self):
         print("closing the camera")
+        self.stop_stream()
         if self.cam_type != "virtual":
             self.cam.close()
         return [1], ["ok"]
 
+    @registry.command("info")
     def info(self):
         print("info request")
         return [1], ["some_info"]
 
+    @registry.command("get_exposure", reply=[0])
     def get_exposure(self):
         if self.cam_type == "virtual":
             exposure = np.array([0.1])
@@ -246,23 +267,32 @@ class CameraServer(object):
             exposure = np.array(self.cam.get_exposure())
         return [0], [exposure.tobytes()]
 
-    def set_exposure(self):
-        exposure = self.safe_recv()
+    @registry.command("set_exposure", args=[0])
+    def set_exposure(self, exposure):
         exposure = np.frombuffer(exposure)
         exposure = exposure[0]
         print("Exposure set to " + str(exposure))
         if self.cam_type != "virtual":
-            self.cam.set_exposure(exposure)
+            with self.cam_lock:
+                self.cam.set_exposure(exposure)
         return [1], ["set"]
 
-    def set_woi(self):
-        woi = self.safe_recv()
+    @registry.command("set_woi", args=[0])
+    def set_woi(self, woi):
         woi = np.frombuffer(woi)
         print("woi set to " + str(woi))
         if self.cam_type != "virtual":
-            self.cam.set_woi(woi)
+            with self.cam_lock:
+                self.cam.set_woi(woi)
         return [1], ["woi set"]
 
+    def grab(self):
+        # one frame in the dtype of the camera
+        if self.cam_type == "virtual":
+            return np.random.randint(0, 256, (1024, 1024), dtype=np.uint8)
+        with self.cam_lock:
+            return self._get_image()
+
     def _get_image(self):
         retry_count = 10
         idx = 0
@@ -275,29 +305,112 @@ class CameraServer(object):
             print("Retry image grabbing " + str(idx))
         return img
 
+    def acquire(self):
+        # one image, averaged over self.averages frames
+        img = self.grab()
+        if self.cam_type != "virtual" and self.averages > 1:
+            # sum in a wider type, then round back to the dtype of the camera
+            dtype = img.dtype
+            acc = img.astype(np.float64 if np.issubdtype(dtype, np.floating) else np.uint32)
+            for i in range(1, int(self.averages)):
+                acc += self.grab()
+            img = acc / self.averages
+            if np.issubdtype(dtype, np.integer):
+                np.rint(img, out=img)
+            img = img.astype(dtype)
+        return img
+
+    @registry.command("get_image", reply=[1, 0])
     def get_image(self):
-        if self.cam_type == "virtual":
-            img = np.random.rand(1024, 1024)
-        else:
-            for i in range(int(self.averages)):
-                if i == 0:
-                    img = self._get_image()
-                else:
-                    img += self._get_image()
-            img = img / self.averages
-            if self.cam_type == "the_imaging_source":
-                img = img.astype(np.int32)
-            if self.cam_type == "thorcam_scientific_camera":
-                img = img.astype(np.int32)
+        # Frames are sent in the dtype of the camera (uint8 or uint16 for most), see ArrayFrames.
+        img = self.acquire()
+        if self.cam_type != "virtual":
             #now = datetime.now()
             #print(now.strftime("%Y%m%d_%H%M%S"))
             if self.plot:
+                from matplotlib import pyplot as plt # only loaded when plotting
                 plt.imshow(img, cmap='gray')
                 plt.show()
-        return [0], [img.tobytes()]
-
+        img = np.ascontiguousarray(img)
+        return [1, 0], [ArrayFrames.header(img), img]
+
+    @registry.command("set_spot_windows", args=[0, 0])
+    def set_spot_windows(self, centers, size):
+        # centers: x coordinates then y coordinates in camera pixels (a 2 x N float64 array), size: window width and
+        # optionally height in pixels
+        centers = np.frombuffer(centers).reshape(2, -1)
+        size = np.frombuffer(size)
+        if len(size) == 1:
+            size = np.array([size[0], size[0]])
+        self.spot_centers = centers
+        self.spot_size = size[:2]
+        self.spot_extractor = None
+        return [1], ["ok: " + str(centers.shape[1]) + " windows"]
+
+    def get_spot_extractor(self, shape):
+        # pixel indices of the windows, computed once per image shape
+        if self.spot_centers is None:
+            raise Exception("no spot windows, see set_spot_windows")
+        if self.spot_extractor is None or self.spot_extractor.shape != tuple(shape):
+            self.spot_extractor = SpotExtractor.SpotExtractor(self.spot_centers, self.spot_size, shape)
+        return self.spot_extractor
+
+    @registry.command("get_spot_windows", reply=[1, 0])
+    def get_spot_windows(self):
+        # the windows of an image, stacked in an N x height x width array in the dtype of the camera
+        img = self.acquire()
+        windows = self.get_spot_extractor(img.shape).windows(img)
+        return [1, 0], [ArrayFrames.header(windows), windows]
+
+    @registry.command("get_spot_amps", reply=[1, 0])
+    def get_spot_amps(self):
+        # sum of the pixels of each window of an image, as float64. Pixels outside of the image do not count.
+        img = self.acquire()
+        amps = self.get_spot_extractor(img.shape).sums(img)
+        return [1, 0], [ArrayFrames.header(amps), amps]
+
+    @registry.command("flush")
     def flush(self):
         print("flushing")
         if self.cam_type != "virtual":
-            self.cam.flush()
-        return [1], ["flushed"]
\ No newline at end of file
+            with self.cam_lock:
+                self.cam.flush()
+        return [1], ["flushed"]
+
+    @registry.command("start_stream")
+    def start_stream(self):
+        # Publishes every frame on stream_url as a string "sequence number;timestamp", then the image, see ArrayFrames.
+        if self.__pub is None:
+            return [1], ["error: no stream_url in the config"]
+        if self.__stream is None or not self.__stream.is_alive():
+            self.__streaming.set()
+            self.__stream = threading.Thread(target = self.__stream_func)
+            self.__stream.start()
+        return [1], ["ok"]
+
+    @registry.command("stop_stream")
+    def stop_stream(self):
+        self.__streaming.clear()
+        if self.__stream is not None:
+            self.__stream.join()
+            self.__stream = None
+        return [1], ["ok"]
+
+    @registry.command("get_stream_status")
+    def get_stream_status(self):
+        return [1], ["streaming: " + str(self.__streaming.is_set()) + " sequence: " + str(self.stream_seq)]
+
+    def __stream_func(self):
+        while self.__streaming.is_set():
+            try:
+                img = self.grab()
+            except Exception as e:
+                print("Streaming stopped: " + str(e))
+                self.__streaming.clear()
+                break
+            timestamp = time.time()
+            self.stream_seq += 1
+            self.__pub.send_string(str(self.stream_seq) + ";" + repr(timestamp), zmq.SNDMORE)
+            ArrayFrames.send(self.__pub, img)
+            if self.cam_type == "virtual":
+                time.sleep(0.1) # the exposure of the virtual camera
\ No newline at end of file
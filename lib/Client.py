@@ -8,10 +8,12 @@ For future: Implement parent client class, and subclients, so that common featur
 """
 
 import zmq
+import time
 from datetime import datetime
 import numpy as np
 import yaml
 import ast
+import ArrayFrames
 
 class Client(object):
     """
@@ -73,6 +75,8 @@ class Client(object):
         self.__sock = None
         self.recreate_sock()
         self.timeout = 500
+        self.commands = None
+        """ Commands understood by the server, see get_commands. None until first requested. """
         rep = self.send_id()
         print(rep)
 
@@ -97,9 +101,9 @@ class Client(object):
 
         """
         def deco(func):
-            def f(self, *args): #timeout in milliseconds
+            def f(self, *args, **kwargs): #timeout in milliseconds
                 try:
-                    func(self, *args)
+                    func(self, *args, **kwargs)
                 except Exception as e:
                     print('Error in client function: ' + str(e))
                     return None
@@ -135,6 +139,87 @@ class Client(object):
         """
         self.__sock.send_string("id") # handshake
 
+    @poll_recv([1])
+    def send_list_commands(self):
+        """
+        Request the Server for the commands it understands.
+
+        Args:
+            None
+
+        Returns:
+            List containing a string with the response. Each command is name:args:reply separated by semicolons, where args
+            and reply are the frame types (0 binary, 1 string) of the request and the reply.
+
+        Raises:
+            None
+
+        """
+        self.__sock.send_string("list_commands")
+
+    def get_commands(self):
+        """
+        Get the commands understood by the Server. The list is requested once and then cached.
+
+        Args:
+            None
+
+        Returns:
+            dict from command name to a tuple (args, reply) of lists of frame types.
+
+        Raises:
+            None
+
+        """
+        if self.commands is None:
+            rep = self.send_list_commands()
+            if rep is None or rep[0] is None or rep[0].startswith("error"):
+                return dict()
+            commands = dict()
+            for item in rep[0].split(';'):
+                name, args, reply = item.split(':')
+                # a trailing * marks commands taking any number of further binary frames
+                commands[name] = ([int(t) for t in args.rstrip('*')], [int(t) for t in reply])
+            self.commands = commands
+        return self.commands
+
+    def send_command(self, cmd, *args, timeout=-1):
+        """
+        Send any command registered on the Server, including ones this client has no send_ method for. The number of
+        frames in the reply is looked up with get_commands.
+
+        Args:
+            cmd: Name of the command.
+            args: Frames following the command. Strings are sent as string frames, numpy arrays as float64 bytes (like the
+                send_ methods do) and bytes as they are.
+            timeout: Timeout in ms for each frame of the reply. Default is -1, which is no timeout.
+
+        Returns:
+            List containing the frames of the response, as strings or bytes.
+
+        Raises:
+            None
+
+        """
+        commands = self.get_commands()
+        if cmd in commands:
+            reply = commands[cmd][1]
+        else:
+            reply = [1]
+
+        @Client.poll_recv(reply, timeout=timeout)
+        def _send_command(self):
+            frames = [cmd] + list(args)
+            for idx, frame in enumerate(frames):
+                flag = zmq.SNDMORE if idx < len(frames) - 1 else 0
+                if isinstance(frame, str):
+                    self.__sock.send_string(frame, flag)
+                elif isinstance(frame, np.ndarray):
+                    self.__sock.send(frame.astype(np.float64).tobytes(), flag)
+                else:
+                    self.__sock.send(frame, flag)
+        return _send_command(self)
+
     @poll_recv([1])
     def send_pattern(self, path_str):
         """
@@ -171,6 +256,47 @@ class Client(object):
         self.__sock.send_string("use_additional_phase", zmq.SNDMORE)
         self.__sock.send_string(path_str)
 
+    @poll_recv([1])
+    def send_pattern_data(self, phase, name="from_data"):
+        """
+        Request the Server to use a pattern held in memory, without saving it to a file. The array is sent without
+        copies, see ArrayFrames.
+
+        Args:
+            phase: Numpy array of the phase in radians, with the shape of the SLM. float32 is used by the Server as is.
+            name: String recorded as the source of the pattern.
+
+        Returns:
+            List containing a string with the response. An "ok" is expected, but an error can also be returned.
+
+        Raises:
+            None
+
+        """
+        self.__sock.send_string("use_pattern_data", zmq.SNDMORE)
+        ArrayFrames.send(self.__sock, phase, zmq.SNDMORE)
+        self.__sock.send_string(name)
+
+    @poll_recv([1])
+    def send_add_phase_data(self, phase, description="from_data"):
+        """
+        Request the Server to add a phase held in memory to the additional phase, without saving it to a file.
+
+        Args:
+            phase: Numpy array of the phase in radians, with the shape of the SLM.
+            description: String describing the phase in the additional phase log.
+
+        Returns:
+            List containing a string with the response. An "ok" is expected, but an error can also be returned.
+
+        Raises:
+            None
+
+        """
+        self.__sock.send_string("add_phase_data", zmq.SNDMORE)
+        ArrayFrames.send(self.__sock, phase, zmq.SNDMORE)
+        self.__sock.send_string(description)
+
     @poll_recv([1])
     def send_init_hologram(self, path_str):
         self.__sock.send_string("init_hologram", zmq.SNDMORE)
@@ -179,15 +305,18 @@ class Client(object):
     
     
     @poll_recv([1], timeout=-1)
-    def send_calculate(self, targets, amps, iterations, guess_path = ''):
+    def send_calculate(self, targets, amps, iterations, guess_path = '', stopping = None):
         """
         Request the Server to calculate a pattern with targets, amps and number of iterations. This request has no timeout.
 
         Args:
             targets: A 2 x ntargets numpy array where the x-coordinates are the first row and y-coordinates are the second row.
             amps: A 1 x ntargets numpy array specifying the amplitudes for each target
-            iterations: Number of iterations
+            iterations: Maximum number of iterations, 0 for the default of the Server
             phase: string for the path of an initial phase guess. Default is empty string, which is to start from a random phase.
+            stopping: dict of criteria stopping the calculation early, e.g. {"uniformity": 0.99, "max_time": 5},
+                replacing those of the Server config for this calculation. None keeps the Server's. See EarlyStopping.py
+                and send_get_calculation_info.
 
         Returns:
             List containing a string with the response. An "ok" is expected, but an error can also be returned.
@@ -201,16 +330,82 @@ class Client(object):
         #self.__sock.send(targets.tobytes(), zmq.SNDMORE)
         self.__sock.send(amps.astype(np.float64).tobytes(), zmq.SNDMORE)
         self.__sock.send(int(iterations).to_bytes(1, 'little'), zmq.SNDMORE)
-        self.__sock.send_string(guess_path)
+        if stopping is None:
+            self.__sock.send_string(guess_path)
+        else:
+            self.__sock.send_string(guess_path, zmq.SNDMORE)
+            self.__sock.send_string(yaml.dump(dict(stopping), default_flow_style=True))
+
+    @poll_recv([1])
+    def send_get_calculation_info(self):
+        """
+        Request the Server for how its last calculation stopped.
+
+        Args:
+            None
+
+        Returns:
+            List containing a yaml string with the criterion which stopped the calculation (uniformity, plateau,
+            max_time, max_iterations or callback), the number of iterations, the time in seconds and the final
+            efficiency and uniformity, e.g. {efficiency: 0.91, iterations: 14, reason: plateau, time: 2.1,
+            uniformity: 0.97}.
+
+        Raises:
+            None
+
+        """
+        self.__sock.send_string("get_calculation_info")
+
+    def _batch_frames(self, targets_list, amps_list, iterations, save_path, save_name):
+        # see send_calculate_batch
+        counts = np.array([targets.shape[1] for targets in targets_list], dtype=np.float64)
+        targets = np.concatenate([np.asarray(targets, dtype=np.float64) for targets in targets_list], axis=1)
+        amps = np.concatenate([np.asarray(amps, dtype=np.float64).ravel() for amps in amps_list])
+        return [counts, targets, amps, int(iterations).to_bytes(1, 'little'), save_path, save_name]
+
+    def send_calculate_batch(self, targets_list, amps_list, iterations, save_path, save_name):
+        """
+        Request the Server to calculate and save many patterns, in parallel on all its cores. This request has no
+        timeout. Use submit_calculate_batch to follow the patterns as they finish.
+
+        Args:
+            targets_list: List of 2 x ntargets numpy arrays, as for send_calculate. The number of targets may differ.
+            amps_list: List of amps, one for each targets.
+            iterations: Number of iterations. 0 uses the default of the Server.
+            save_path: String for the path where the patterns are saved, as for send_save.
+            save_name: Name of the patterns. Pattern i is saved as save_name_i.
+
+        Returns:
+            List containing a yaml string with a list of results, one per pattern, with the index, the config and
+            data paths and the final efficiency and uniformity, or an error.
+
+        Raises:
+            None
+
+        """
+        return self.send_command("calculate_batch", *self._batch_frames(targets_list, amps_list, iterations, save_path, save_name))
+
+    def submit_calculate_batch(self, targets_list, amps_list, iterations, save_path, save_name):
+        """
+        Like send_calculate_batch, but runs in the background. See submit_job. The progress of the job has the number
+        of finished patterns and their results.
+
+        Returns:
+            JobHandle for the job, or None if the Server did not accept it.
+
+        """
+        return self.submit_job("calculate_batch", *self._batch_frames(targets_list, amps_list, iterations, save_path, save_name))
 
     @poll_recv([1, 1], timeout=-1)
-    def send_save(self, save_path, save_name):
+    def send_save(self, save_path, save_name, save_format=''):
         """
         Request the Server to save a pattern at a particular path. The request has no timeout.
 
         Args:
             save_path: String for the path where the pattern is saved
             save_name: String for the name of the pattern
+            save_format: "npz" for a compressed archive, "npy" for a directory of uncompressed arrays which loads
+                faster. Default is empty string, which uses the format of the Server config.
 
         Returns:
             List containing a string with the response. The paths where the file is saved is expected, but an error can also be returned.
@@ -221,7 +416,11 @@ class Client(object):
         """
         self.__sock.send_string("save_calculation", zmq.SNDMORE)
         self.__sock.send_string(save_path, zmq.SNDMORE)
-        self.__sock.send_string(save_name)
+        if save_format == '':
+            self.__sock.send_string(save_name)
+        else:
+            self.__sock.send_string(save_name, zmq.SNDMORE)
+            self.__sock.send_string(save_format)
 
     @poll_recv([1, 1], timeout=-1)
     def send_save_add_phase(self, save_path, save_name):
@@ -243,6 +442,176 @@ class Client(object):
         self.__sock.send_string(save_path, zmq.SNDMORE)
         self.__sock.send_string(save_name)
 
+    @poll_recv([1], timeout=-1)
+    def send_flush_saves(self, timeout=None):
+        """
+        Request the Server to wait until the files of previous send_save and send_save_add_phase requests are
+        written. The Server writes them in the background and replies to saves with the paths right away. It also
+        waits by itself before loading a file that is being written, so this is only needed to read the files
+        directly. This request has no timeout.
+
+        Args:
+            timeout: Maximum time in seconds for the Server to wait. Default is None, which waits for all saves.
+
+        Returns:
+            List containing a string with the response. An "ok" is expected, or "pending: N" if saves are still running
+            after the timeout.
+
+        Raises:
+            None
+
+        """
+        if timeout is None:
+            self.__sock.send_string("flush_saves")
+        else:
+            self.__sock.send_string("flush_saves", zmq.SNDMORE)
+            self.__sock.send(np.array([timeout], dtype=np.float64).tobytes())
+
+    @poll_recv([1])
+    def send_save_status(self):
+        """
+        Request the Server for the state of the background saves.
+
+        Args:
+            None
+
+        Returns:
+            List containing a string with the response, of the form "pending: N saved: M errors: K" followed by the last
+            error if there is one.
+
+        Raises:
+            None
+
+        """
+        self.__sock.send_string("save_status")
+
+    @poll_recv([1], timeout=-1)
+    def send_preload_patterns(self, paths):
+        """
+        Request the Server to load patterns into its pattern cache, so that the first send_pattern of each of them is
+        as fast as the following ones. This request has no timeout.
+
+        Args:
+            paths: List of strings for the paths of the patterns, as for send_pattern.
+
+        Returns:
+            List containing a string with the response. An "ok" is expected, but an error listing the patterns which
+            could not be loaded can also be returned.
+
+        Raises:
+            None
+
+        """
+        self.__sock.send_string("preload_patterns", zmq.SNDMORE)
+        self.__sock.send_string(";".join(paths))
+
+    @poll_recv([1])
+    def send_get_pattern_cache_stats(self):
+        """
+        Request the Server for the statistics of its pattern cache.
+
+        Args:
+            None
+
+        Returns:
+            List containing a string with the response, of the form "hits: H misses: M evictions: E entries: N MB: S
+            max MB: L", or "disabled".
+
+        Raises:
+            None
+
+        """
+        self.__sock.send_string("get_pattern_cache_stats")
+
+    @poll_recv([1])
+    def send_clear_pattern_cache(self):
+        """
+        Request the Server to empty its pattern cache.
+
+        Args:
+            None
+
+        Returns:
+            List containing a string with the response. An "ok" is expected.
+
+        Raises:
+            None
+
+        """
+        self.__sock.send_string("clear_pattern_cache")
+
+    @poll_recv([1])
+    def send_set_sequence(self, paths):
+        """
+        Request the Server to use an ordered list of patterns as a sequence. The Server prepares the next patterns
+        of the sequence in the background so that send_sequence_next and send_sequence_goto only write to the SLM.
+
+        Args:
+            paths: List of strings for the paths of the patterns, as for send_pattern.
+
+        Returns:
+            List containing a string with the response. An "ok" is expected.
+
+        Raises:
+            None
+
+        """
+        self.__sock.send_string("set_sequence", zmq.SNDMORE)
+        self.__sock.send_string(";".join(paths))
+
+    @poll_recv([1])
+    def send_sequence_next(self):
+        """
+        Request the Server to project the next pattern of the sequence, wrapping around at the end.
+
+        Args:
+            None
+
+        Returns:
+            List containing a string with the index of the projected pattern.
+
+        Raises:
+            None
+
+        """
+        self.__sock.send_string("sequence_next")
+
+    @poll_recv([1])
+    def send_sequence_goto(self, index):
+        """
+        Request the Server to project a pattern of the sequence.
+
+        Args:
+            index: Index of the pattern in the sequence. Negative indices count from the end.
+
+        Returns:
+            List containing a string with the index of the projected pattern.
+
+        Raises:
+            None
+
+        """
+        self.__sock.send_string("sequence_goto", zmq.SNDMORE)
+        self.__sock.send(int(index).to_bytes(4, 'little', signed=True))
+
+    @poll_recv([1])
+    def send_get_sequence_info(self):
+        """
+        Request the Server for the state of the sequence.
+
+        Args:
+            None
+
+        Returns:
+            List containing a string with the response, of the form "index: I length: N prepared: P composed: C",
+            or "no sequence".
+
+        Raises:
+            None
+
+        """
+        self.__sock.send_string("get_sequence_info")
+
     @poll_recv([1])
     def send_correction(self, path):
         """
@@ -371,13 +740,14 @@ class Client(object):
         self.__sock.send(param2)
 
     @poll_recv([1], timeout=-1)
-    def send_use_aperture(self, aperture_size):
+    def send_use_aperture(self, aperture_size, edge_width=0):
         """
         Request the SLM to use an aperture in units of slm pixels. If the aperture_size is a single number,
         then it is a circular aperture. Otherwise, it can be length 2 and an elliptical aperture. 
 
         Args:
             aperture_size: If a single number, circular aperture of that size (units of slm pixels). Otherwise, elliptical aperture.
+            edge_width: Width in slm pixels of a soft (raised cosine) edge on the inside of the aperture. Default is 0, which is a hard edge.
 
         Returns:
             List containing a string with the response. An "ok" is expected, but an error can also be returned.
@@ -386,8 +756,11 @@ class Client(object):
             None
 
         """
-        if len(aperture_size) == 1:
-            aperture = np.array([aperture_size, aperture_size])
+        aperture = np.atleast_1d(np.asarray(aperture_size, dtype=np.float64))
+        if len(aperture) == 1:
+            aperture = np.array([aperture[0], aperture[0]])
+        if edge_width > 0:
+            aperture = np.append(aperture[:2], edge_width)
         self.__sock.send_string("use_aperture", zmq.SNDMORE)
         self.__sock.send(aperture.astype(np.float64).tobytes())
 
@@ -530,13 +903,15 @@ class Client(object):
         self.__sock.send(int(niters).to_bytes(1, 'little'))
 
     @poll_recv([1], timeout=-1)
-    def send_perform_scan_feedback(self, niters=20, NumPerParamAvg=-1):
+    def send_perform_scan_feedback(self, niters=20, NumPerParamAvg=-1, pipeline=0):
         """
         Request the Server to peform scan based feedback. This request has no timeout.
 
         Args:
             niters: Number of iterations of feedback to perform.
             NumPerParamAvg: Number of averages in scan before performing analysis.
+            pipeline: If larger than 0, the Server computes the next phase while the scan runs, using the average of
+                the last pipeline measurements, see utils.ScanFeedbackPipeline. 0 waits for each scan.
 
         Returns:
             List containing a string with the response. An "ok" is expected, but an error can also be returned.
@@ -547,7 +922,8 @@ class Client(object):
         """
         self.__sock.send_string("perform_scan_feedback", zmq.SNDMORE)
         self.__sock.send(int(niters).to_bytes(1, 'little'), zmq.SNDMORE)
-        self.__sock.send(int(NumPerParamAvg).to_bytes(4, 'little'))
+        self.__sock.send(int(NumPerParamAvg).to_bytes(4, 'little', signed=True), zmq.SNDMORE)
+        self.__sock.send(int(pipeline).to_bytes(1, 'little'))
 
     @poll_recv([1])
     def send_get_fourier_calibration(self):
@@ -601,12 +977,231 @@ class Client(object):
         """
         self.__sock.send_string("get_additional_phase")
 
-    def calculate_save_and_project(self, targets, amps, iterations, save_path, save_name, guess_phase_path = ''):
+    @poll_recv([1])
+    def send_get_write_stats(self):
+        """
+        Request the Server for how many SLM writes were requested and how many were skipped because the frame was
+        already displayed.
+
+        Args:
+            None
+
+        Returns:
+            List containing a string with the response, of the form "writes: N skipped: M".
+
+        Raises:
+            None
+
+        """
+        self.__sock.send_string("get_write_stats")
+
+    @poll_recv([1])
+    def send_get_layers(self):
+        """
+        Request the Server for the layers that make up the additional phase, including disabled ones.
+
+        Args:
+            None
+
+        Returns:
+            List containing a string with the response. The response has entries name;kind;description;enabled; for each layer.
+
+        Raises:
+            None
+
+        """
+        self.__sock.send_string("get_layers")
+
+    @poll_recv([1])
+    def send_set_layer_enabled(self, name, enabled):
+        """
+        Request the Server to enable or disable a single layer of the additional phase without removing it.
+
+        Args:
+            name: Name of the layer, as returned by send_get_layers.
+            enabled: True to add the layer to the projected phase, False to leave it out.
+
+        Returns:
+            List containing a string with the response. An "ok" is expected, but an error can also be returned.
+
+        Raises:
+            None
+
+        """
+        self.__sock.send_string("set_layer_enabled", zmq.SNDMORE)
+        self.__sock.send_string(name, zmq.SNDMORE)
+        self.__sock.send(int(bool(enabled)).to_bytes(1, 'little'))
+
+    @poll_recv([1])
+    def send_remove_layer(self, name):
+        """
+        Request the Server to remove a single layer of the additional phase.
+
+        Args:
+            name: Name of the layer, as returned by send_get_layers.
+
+        Returns:
+            List containing a string with the response. An "ok" is expected, but an error can also be returned.
+
+        Raises:
+            None
+
+        """
+        self.__sock.send_string("remove_layer", zmq.SNDMORE)
+        self.__sock.send_string(name)
+
+    def submit_job(self, cmd, *args):
+        """
+        Request the Server to run a command in the background. The Server replies right away with a job id, and keeps
+        answering other requests while the command runs. Only commands registered as jobs can be submitted
+        (calculate, calculate_batch, perform_fourier_calibration, perform_wavefront_calibration,
+        perform_camera_feedback and perform_scan_feedback). While a job other than calculate_batch runs, requests
+        which change the hologram or the phase (use_pattern, project, add_zernike_poly, ...) get a busy error reply.
+
+        Args:
+            cmd: Name of the command.
+            args: Frames following the command, see send_command.
+
+        Returns:
+            JobHandle for the job, or None if the Server did not accept it.
+
+        Raises:
+            None
+
+        """
+        commands = self.get_commands()
+        if cmd in commands:
+            reply = commands[cmd][1]
+        else:
+            reply = [1]
+        rep = self.send_command("submit_job", cmd, *args, timeout=self.timeout)
+        if rep is None or rep[0] is None or rep[0].startswith("error"):
+            print("Job not submitted: " + str(rep))
+            return None
+        return JobHandle(self, rep[0], reply)
+
+    def submit_calculate(self, targets, amps, iterations, guess_path = '', stopping = None):
+        """
+        Like send_calculate, but runs in the background. See submit_job.
+
+        Returns:
+            JobHandle for the job, or None if the Server did not accept it.
+
+        """
+        args = [targets, amps, int(iterations).to_bytes(1, 'little'), guess_path]
+        if stopping is not None:
+            args.append(yaml.dump(dict(stopping), default_flow_style=True))
+        return self.submit_job("calculate", *args)
+
+    def submit_perform_fourier_calibration(self, shape=np.array([5,5]), pitch=np.array([30,40])):
+        """
+        Like send_perform_fourier_calibration, but runs in the background. See submit_job.
+
+        Returns:
+            JobHandle for the job, or None if the Server did not accept it.
+
+        """
+        return self.submit_job("perform_fourier_calibration", shape, pitch)
+
+    def submit_perform_wavefront_calibration(self, interference_point=np.array([900,400]), field_point=np.array([0.25,0]), test_super_pixel = np.array([-1,-1])):
+        """
+        Like send_perform_wavefront_calibration, but runs in the background. See submit_job.
+
+        Returns:
+            JobHandle for the job, or None if the Server did not accept it.
+
+        """
+        return self.submit_job("perform_wavefront_calibration", interference_point, field_point, test_super_pixel)
+
+    def submit_perform_camera_feedback(self, niters=20):
+        """
+        Like send_perform_camera_feedback, but runs in the background. See submit_job.
+
+        Returns:
+            JobHandle for the job, or None if the Server did not accept it.
+
+        """
+        return self.submit_job("perform_camera_feedback", int(niters).to_bytes(1, 'little'))
+
+    def submit_perform_scan_feedback(self, niters=20, NumPerParamAvg=-1, pipeline=0):
+        """
+        Like send_perform_scan_feedback, but runs in the background. See submit_job.
+
+        Returns:
+            JobHandle for the job, or None if the Server did not accept it.
+
+        """
+        return self.submit_job("perform_scan_feedback", int(niters).to_bytes(1, 'little'), int(NumPerParamAvg).to_bytes(4, 'little', signed=True), int(pipeline).to_bytes(1, 'little'))
+
+    def send_job_status(self, job_id):
+        """
+        Request the Server for the status of a job.
+
+        Args:
+            job_id: String id of the job, as returned by submit_job.
+
+        Returns:
+            List containing the status (queued, running, done, error or cancelled) and the progress as a yaml string,
+            e.g. {efficiency: 0.8, iteration: 12, uniformity: 0.95} for an optimization.
+
+        Raises:
+            None
+
+        """
+        return self.send_command("job_status", job_id, timeout=self.timeout)
+
+    def send_job_result(self, job_id):
+        """
+        Request the Server for the result of a job.
+
+        Args:
+            job_id: String id of the job, as returned by submit_job.
+
+        Returns:
+            List containing the status of the job followed, once the job has finished, by the frames of the reply of
+            the command, as bytes. None if the Server does not reply.
+
+        Raises:
+            None
+
+        """
+        try:
+            self.__sock.send_string("job_result", zmq.SNDMORE)
+            self.__sock.send_string(job_id)
+        except Exception as e:
+            print('Error in client function: ' + str(e))
+            return None
+        if self.__sock.poll(self.timeout) == 0:
+            return None
+        rep = [self.__sock.recv_string()]
+        # the number of frames depends on whether the job has finished
+        while self.__sock.getsockopt(zmq.RCVMORE):
+            rep.append(self.__sock.recv())
+        return rep
+
+    def send_job_cancel(self, job_id):
+        """
+        Request the Server to cancel a job. Queued jobs are dropped. Running optimizations stop after the current
+        iteration, while calibrations cannot be interrupted and run to completion.
+
+        Args:
+            job_id: String id of the job, as returned by submit_job.
+
+        Returns:
+            List containing a string with the response: cancelled, cancelling, already finished or unknown job.
+
+        Raises:
+            None
+
+        """
+        return self.send_command("job_cancel", job_id, timeout=self.timeout)
+
+    def calculate_save_and_project(self, targets, amps, iterations, save_path, save_name, guess_phase_path = '', stopping = None):
         """
         Request the Server to calculate, save and project a pattern. See send_calculate, send_save and send_project.
 
         Args:
-            targets, amps, iterations: Arguments to send_calculate
+            targets, amps, iterations, stopping: Arguments to send_calculate
             save_path, save_name: Arguments to send_project
 
         Returns:
@@ -617,14 +1212,14 @@ class Client(object):
 
         """
 
-        ret = self.send_calculate(targets, amps, iterations, guess_phase_path)
+        ret = self.send_calculate(targets, amps, iterations, guess_phase_path, stopping)
         if ret[0] != "ok":
             print("Calculate not successful")
             return ret
         ret2 = self.send_save(save_path, save_name)
         config_path = ret2[0]
         pattern_path = ret2[1]
-        pattern_path_to_send = pattern_path[:-9]
+        pattern_path_to_send = pattern_path[:pattern_path.rfind("_data")] # strip _data.npz or _data
         ret3 = self.send_pattern(pattern_path_to_send)
         ret4 = self.send_project()
         return config_path, pattern_path, ret3, ret4
@@ -800,6 +1395,77 @@ class Client(object):
             self.__sock.close()
         self.__ctx.destroy
 
+class JobHandle(object):
+    """
+    A command running in the background on the Server, see Client.submit_job.
+    """
+    def __init__(self, client, job_id, reply):
+        self.client = client
+        self.job_id = job_id
+        self.reply = reply
+        """ Frame types of the reply of the command. """
+
+    def status(self):
+        """
+        Returns:
+            Tuple of the status string and the progress dict. None if the Server does not reply.
+
+        """
+        rep = self.client.send_job_status(self.job_id)
+        if rep is None or rep[0] is None:
+            return None
+        if rep[0].startswith("error"):
+            return rep[0], dict()
+        return rep[0], yaml.safe_load(rep[1])
+
+    def result(self):
+        """
+        Returns:
+            The reply of the command, decoded like the send_ methods would (strings or bytes), or None if the job
+            has not finished.
+
+        """
+        rep = self.client.send_job_result(self.job_id)
+        if rep is None or len(rep) == 1:
+            return None
+        result = []
+        for frame_type, frame in zip(self.reply, rep[1:]):
+            if frame_type == 1:
+                result.append(bytes(frame).decode('utf-8'))
+            else:
+                result.append(frame)
+        return result
+
+    def wait(self, poll_interval=0.5, timeout=None):
+        """
+        Waits for the job to finish, printing its progress.
+
+        Args:
+            poll_interval: Time in seconds between status requests.
+            timeout: Maximum time to wait in seconds, or None to wait until the job finishes.
+
+        Returns:
+            The result, see result. None if the timeout expired.
+
+        """
+        start = time.monotonic()
+        while True:
+            rep = self.status()
+            if rep is not None:
+                status, progress = rep
+                if status not in ["queued", "running"]:
+                    return self.result()
+                print("job " + self.job_id + " " + status + " " + str(progress))
+            if timeout is not None and time.monotonic() - start > timeout:
+                return None
+            time.sleep(poll_interval)
+
+    def cancel(self):
+        rep = self.client.send_job_cancel(self.job_id)
+        if rep is None:
+            return None
+        return rep[0]
+
 class FeedbackClient(object):
     def recreate_sock(self):
         if self.__sock is not None:
@@ -813,6 +1479,7 @@ class FeedbackClient(object):
         self.__ctx = zmq.Context()
         self.__sock = None
         self.recreate_sock()
+        self.__async_sock = None # measurement started by request_spot_amps
         self.timeout = 500
         self.connected = True
         rep = self.send_id()
@@ -827,10 +1494,10 @@ class FeedbackClient(object):
     # recv_type = 1 is a string receive
     def poll_recv(recv_type = [1], timeout=1000, flag=0, default_val=None):
         def deco(func):
-            def f(self, *args): #timeout in milliseconds
+            def f(self, *args, **kwargs): #timeout in milliseconds
                 try:
                     if self.connected:
-                        func(self, *args)
+                        func(self, *args, **kwargs)
                     else:
                         return default_val
                 except Exception as e:
@@ -874,4 +1541,45 @@ class FeedbackClient(object):
         self.__sock.send_string("get_spot_amps", zmq.SNDMORE)
         self.__sock.send_string(self.scan_fname, zmq.SNDMORE)
         self.__sock.send_string(self.scan_name, zmq.SNDMORE)
-        self.__sock.send(int(self.NumPerParamAvg).to_bytes(4, 'little'))
+        self.__sock.send(int(self.NumPerParamAvg).to_bytes(4, 'little', signed=True))
+
+    def request_spot_amps(self):
+        """
+        Starts a measurement of the spot amplitudes like get_spot_amps, but returns without waiting for it. The
+        measurement uses a socket of its own, so one can be outstanding while other requests are made. Its result is
+        read with collect_spot_amps.
+        """
+        if self.__async_sock is None:
+            self.__async_sock = self.__ctx.socket(zmq.REQ)
+            self.__async_sock.connect(self.__url)
+        self.__async_sock.send_string("get_spot_amps", zmq.SNDMORE)
+        self.__async_sock.send_string(self.scan_fname, zmq.SNDMORE)
+        self.__async_sock.send_string(self.scan_name, zmq.SNDMORE)
+        self.__async_sock.send(int(self.NumPerParamAvg).to_bytes(4, 'little', signed=True))
+
+    def collect_spot_amps(self, timeout=-1):
+        """
+        Waits for the measurement started by request_spot_amps.
+
+        Args:
+            timeout: Timeout in ms. Default is -1, which is no timeout.
+
+        Returns:
+            Array of the spot amplitudes, or [-1.0] if the measurement failed or timed out, or if no measurement was
+            started, like get_spot_amps.
+
+        """
+        if self.__async_sock is None:
+            print("Warning: no spot amplitudes were requested from the FeedbackClient")
+            return np.array([-1.0])
+        if self.__async_sock.poll(timeout) == 0:
+            print("Warning: no spot amplitudes from the FeedbackClient")
+            # the socket still waits for the reply, start over with a new one
+            self.__async_sock.close(0)
+            self.__async_sock = None
+            return np.array([-1.0])
+        rep = self.__async_sock.recv()
+        if rep.startswith(b"error"):
+            print(rep.decode('utf-8'))
+            return np.array([-1.0])
+        return np.frombuffer(rep)
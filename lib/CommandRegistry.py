@@ -0,0 +1,145 @@
+"""
+Registry of the commands understood by a server. Shared by Server, CameraServer and AndorServer.
+
+Handlers are registered with a decorator that declares the frames they take after the command name and the frames of
+their reply. Frame types follow the msg_type convention of safe_send: 0 is binary and 1 is a string.
+
+    class MyServer(object):
+        registry = CommandRegistry.CommandRegistry()
+
+        @registry.command("use_pattern", args=[1])
+        def use_pattern(self, fname):
+            ...
+            return [1], ["ok"]
+
+The registry looks up commands in a dict, checks the number of frames before calling the handler, decodes string
+frames and turns exceptions and unknown commands into error replies.
+
+Commands registered with state=True use state that background jobs also use (for Server, the hologram and the phase
+manager). Their handlers hold the server's state_lock while they run. A job waits for the lock, while a request
+arriving during a job gets a busy error reply instead of blocking the server.
+"""
+
+class Command(object):
+    def __init__(self, name, func, args, reply, n_optional, varargs=False, job=False, state=False):
+        self.name = name
+        self.func = func
+        self.args = list(args)
+        self.reply = list(reply)
+        self.n_optional = n_optional
+        self.varargs = varargs
+        self.job = job
+        self.state = state
+
+    def describe(self):
+        # e.g. calculate:0001:1 for a command taking three binary frames and a string and replying with a string,
+        # a trailing * marks commands which take any number of further binary frames
+        args = "".join(str(t) for t in self.args) + ("*" if self.varargs else "")
+        return self.name + ":" + args + ":" + "".join(str(t) for t in self.reply)
+
+def error_reply(kind, detail, reply=[1]):
+    """
+    Builds an error reply of the form "error: kind: detail". The error is repeated for every frame in reply, so
+    that a client waiting for that many frames receives all of them.
+    """
+    msg = "error: " + kind + ": " + detail
+    return [1 for _ in reply], [msg for _ in reply]
+
+class CommandRegistry(object):
+    def __init__(self):
+        self.commands = dict()
+
+    def command(self, name, args=[], reply=[1], n_optional=0, varargs=False, job=False, state=False):
+        """
+        Decorator registering a method as the handler of a command. The method is returned unchanged.
+
+        Args:
+            name: Command string sent by the client.
+            args: List of frame types (0 binary, 1 string) that follow the command. Binary frames are passed to the
+                handler as bytes and string frames as str, in order.
+            reply: List of frame types of the reply.
+            n_optional: Number of trailing frames in args which the client may leave out. The handler's default
+                values are used for them.
+            varargs: If True, any number of further frames may follow args. They are passed to the handler as bytes.
+            job: If True, the command may also be run in the background with submit_job, see JobQueue.
+            state: If True, the handler runs under the state_lock of the server, see above.
+
+        Returns:
+            The decorator.
+
+        Raises:
+            None
+
+        """
+        def deco(func):
+            self.commands[name] = Command(name, func, args, reply, n_optional, varargs, job, state)
+            return func
+        return deco
+
+    def parse(self, msg_str, frames):
+        """
+        Finds the command and decodes its frames.
+
+        Returns:
+            (command, args, error) where error is None on success, and otherwise a (msg_type, rep) error reply.
+
+        """
+        cmd = self.commands.get(msg_str)
+        if cmd is None:
+            print("Unknown request " + str(msg_str))
+            return None, None, error_reply("unknown_command", str(msg_str))
+        n_required = len(cmd.args) - cmd.n_optional
+        if len(frames) < n_required or (len(frames) > len(cmd.args) and not cmd.varargs):
+            if cmd.n_optional > 0:
+                expected = str(n_required) + " to " + str(len(cmd.args))
+            else:
+                expected = str(n_required) + (" or more" if cmd.varargs else "")
+            return cmd, None, error_reply("bad_frames", msg_str + " expects " + expected + " frames, got " + str(len(frames)), cmd.reply)
+        args = []
+        for frame_type, frame in zip(cmd.args, frames):
+            if frame_type == 1:
+                args.append(bytes(frame).decode('utf-8'))
+            else:
+                args.append(frame)
+        args.extend(frames[len(cmd.args):])
+        return cmd, args, None
+
+    def dispatch(self, obj, msg_str, frames):
+        """
+        Runs the handler of msg_str on obj with the already received frames.
+
+        Returns:
+            (msg_type, rep) to pass to safe_send. A handler may return (None, None) if it replies later by itself.
+
+        """
+        cmd, args, error = self.parse(msg_str, frames)
+        if error is not None:
+            return error
+        try:
+            return self.run(obj, cmd, args)
+        except Exception as e:
+            return error_reply("exception", str(e), cmd.reply)
+
+    def run(self, obj, cmd, args, wait=False):
+        """
+        Runs the handler of cmd on obj with decoded args. The handler of a state command holds obj.state_lock.
+
+        Args:
+            wait: If True, waits for the state lock. Otherwise a busy error reply is returned if it is taken.
+
+        Returns:
+            (msg_type, rep) of the handler.
+
+        """
+        if not cmd.state:
+            return cmd.func(obj, *args)
+        if not obj.state_lock.acquire(blocking=wait):
+            return error_reply("busy", cmd.name + " cannot run while a job is running", cmd.reply)
+        try:
+            return cmd.func(obj, *args)
+        finally:
+            obj.state_lock.release()
+
+    def describe(self):
+        # all commands, separated by semicolons, see Command.describe
+        return ";".join(self.commands[name].describe() for name in sorted(self.commands))
@@ -2,6 +2,9 @@
 Template for writing a subclass for SLM hardware control in :mod:`slmsuite`.
 Outlines which SLM superclass functions must be implemented.
 """
+import hashlib
+import threading
+import numpy as np
 from slmsuite.hardware.slms.slm import SLM
 
 class CorrectedSLM(SLM):
@@ -13,6 +16,8 @@ class CorrectedSLM(SLM):
         self,
         slm,
         phase_mgr,
+        lut_size=4096,
+        phase_response=None,
         **kwargs
     ):
         r"""
@@ -30,6 +35,12 @@ class CorrectedSLM(SLM):
             Pitch of SLM pixels in microns.
         bitdepth : int
             Bits of phase resolution (e.g. 8 for 256 phase settings.)
+        lut_size : int
+            Number of phase bins over :math:`2\pi` in the phase to grayscale lookup table. Rounded up to a power of 2.
+        phase_response : numpy.ndarray or None
+            Measured phase (in radians, same convention as the phase written) realized by each of the
+            ``2**bitdepth`` grayscale levels. If ``None``, the ideal linear response scaled by
+            ``wav_um / wav_design_um`` is used.
         kwargs
             See :meth:`.SLM.__init__` for permissible options.
 
@@ -70,6 +81,25 @@ class CorrectedSLM(SLM):
         # Zero the display using the superclass `write()` function.
         # self.slm.write(None)
 
+        # Buffers for the projection stage, reused on every write.
+        if hasattr(self.slm, "display") and self.slm.display is not None:
+            display_dtype = self.slm.display.dtype
+        elif self.slm.bitdepth <= 8:
+            display_dtype = np.uint8
+        else:
+            display_dtype = np.uint16
+        self.display_buffer = np.zeros(self.slm.shape, dtype=display_dtype)
+        self._lut_phase = np.zeros(self.slm.shape, dtype=np.float32)
+        self._lut_index = np.zeros(self.slm.shape, dtype=np.int32)
+        self.set_phase_lut(lut_size, phase_response)
+
+        # Fingerprint of the frame on the hardware, used to skip writes (and settle waits) that would not change it.
+        self.n_writes = 0
+        self.n_skipped_writes = 0
+        # Background jobs and the server worker may both write, so writes are serialized.
+        self.write_lock = threading.RLock()
+        self.invalidate()
+
     @staticmethod
     def info(verbose=True):
         """
@@ -88,13 +118,199 @@ class CorrectedSLM(SLM):
         """
         return self.slm.info()
 
-    def write(self, base, name="from_function_call", **kwargs):
+    def set_phase_lut(self, lut_size=4096, phase_response=None):
+        r"""
+        Builds the lookup table used by :meth:`quantize` to go from phase to grayscale.
+
+        Parameters
+        ----------
+        lut_size : int
+            Number of phase bins over :math:`2\pi`. Rounded up to a power of 2 so that wrapping is a bitwise and,
+            and to at least twice the number of gray levels.
+        phase_response : numpy.ndarray or None
+            See :meth:`__init__`.
+        """
+        levels = 2**self.slm.bitdepth
+        lut_size = max(2**int(np.ceil(np.log2(lut_size))), 2 * levels)
+        # phase at the start of each bin, so that zero phase maps exactly
+        phase = np.arange(lut_size) * (2 * np.pi / lut_size)
+        if phase_response is None:
+            # Same wrapping and scaling as the generic slm write path, with phase_scaling = wav_um / wav_design_um.
+            wav_design_um = getattr(self.slm, "wav_design_um", None)
+            if wav_design_um is None:
+                wav_design_um = self.slm.wav_um
+            scaling = self.slm.wav_um / wav_design_um
+            if scaling == 1:
+                # Rounded to the nearest level, then shifted by one. The rounding boundaries fall on bin edges since
+                # lut_size is a multiple of 2 * levels, so the center of a bin rounds like every phase in it.
+                center = phase + np.pi / lut_size
+                gray = np.mod(np.rint(-center * (levels / 2 / np.pi)) - 1, levels)
+            else:
+                # truncated, as the slm write path does in this case
+                gray = np.mod(-phase * (levels * scaling / 2 / np.pi) - 1, levels * scaling) + levels * (1 - scaling)
+                if scaling > 1:
+                    gray[gray < 0] = levels - 1
+                gray = np.clip(np.floor(gray), 0, levels - 1)
+        else:
+            # Nonlinear response: pick the level whose realized phase is closest, wrapping around 2 pi.
+            phase_response = np.asarray(phase_response, dtype=np.float64)
+            if len(phase_response) != levels:
+                raise Exception("phase_response needs one entry for each of the " + str(levels) + " levels")
+            diff = np.angle(np.exp(1j * (phase[:, np.newaxis] - phase_response[np.newaxis, :])))
+            gray = np.argmin(np.abs(diff), axis=1)
+        self.lut_size = lut_size
+        self.phase_response = phase_response
+        self.phase_lut = gray.astype(self.display_buffer.dtype)
+        self._lut_scale = np.float32(lut_size / (2 * np.pi))
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Forgets what is displayed, so that the next :meth:`write` always goes to the hardware.
+        """
+        self._displayed_version = None
+        self._displayed_digest = None
+
+    def quantize(self, phase, out=None, scratch=None):
+        """
+        Wraps ``phase`` (in radians) and converts it to grayscale through the lookup table, without allocating
+        any full frame temporaries.
+
+        Parameters
+        ----------
+        phase : numpy.ndarray
+            Phase with the shape of the SLM.
+        out : numpy.ndarray or None
+            Integer array to write into. Defaults to :attr:`display_buffer`.
+        scratch : (numpy.ndarray, numpy.ndarray) or None
+            float32 and int32 temporaries with the shape of the SLM. Defaults to buffers shared with :meth:`write`,
+            so callers on other threads must pass their own, see :meth:`prepare`.
+
+        Returns
+        -------
+        out
+        """
+        if out is None:
+            out = self.display_buffer
+        lut_phase, lut_index = (self._lut_phase, self._lut_index) if scratch is None else scratch
+        np.multiply(phase, self._lut_scale, out=lut_phase)
+        np.floor(lut_phase, out=lut_phase)
+        np.copyto(lut_index, lut_phase, casting="unsafe")
+        np.bitwise_and(lut_index, self.lut_size - 1, out=lut_index)
+        np.take(self.phase_lut, lut_index, out=out)
+        return out
+
+    def correction_key(self):
+        """
+        Identifies the corrections currently applied on top of the base: the layers and aperture of the phase
+        manager and the phase correction of the wrapped SLM.
         """
+        return (self.phase_mgr.correction_version, id(getattr(self.slm, "phase_correction", None)))
 
+    def prepare(self, base, scratch=None):
+        """
+        Composes ``base`` with the current corrections and quantizes it into a new frame, without touching the
+        phase manager or the hardware. Meant to run ahead of time on another thread, the frame is then shown with
+        :meth:`write_prepared`.
+
+        Parameters
+        ----------
+        base : numpy.ndarray
+            Base phase, as passed to :meth:`write`.
+        scratch : (numpy.ndarray, numpy.ndarray) or None
+            float32 and int32 temporaries, see :meth:`quantize`. Allocated if ``None``.
+
+        Returns
+        -------
+        (numpy.ndarray, bytes, tuple)
+            The frame, its digest and the :meth:`correction_key` it was composed with. If the corrections changed
+            while composing, the key is ``None`` and :meth:`write_prepared` will refuse the frame.
+        """
+        if scratch is None:
+            scratch = (np.empty(self.slm.shape, dtype=np.float32), np.empty(self.slm.shape, dtype=np.int32))
+        key = self.correction_key()
+        phase = self.phase_mgr.compose(base, out=scratch[0])
+        phase_correction = getattr(self.slm, "phase_correction", None)
+        if phase_correction is not None:
+            np.add(phase, phase_correction, out=phase)
+        display = self.quantize(phase, out=np.empty_like(self.display_buffer), scratch=scratch)
+        digest = hashlib.blake2b(display, digest_size=16).digest()
+        if self.correction_key() != key:
+            key = None
+        return display, digest, key
+
+    def write_prepared(self, base, name, display, digest, key, force=False, **kwargs):
+        """
+        Shows a frame made by :meth:`prepare` from ``base``, with the same bookkeeping as :meth:`write` but only the
+        hardware write left to do.
+
+        Returns
+        -------
+        bool
+            ``False``, without writing anything, if the corrections changed since the frame was prepared.
+        """
+        with self.write_lock:
+            if key is None or key != self.correction_key():
+                return False
+            self.phase_mgr.set_base(base, name)
+            self.n_writes += 1
+            version = (self.phase_mgr.version, key[1])
+            if not force and digest == self._displayed_digest:
+                self._displayed_version = version
+                self.n_skipped_writes += 1
+                return True
+            self._write_display(display, version, digest, **kwargs)
+            return True
+
+    def write(self, base, name="from_function_call", force=False, **kwargs):
+        """
+        Sets ``base`` as the base of the phase manager and projects it with all corrections. The composed phase is
+        quantized with :meth:`quantize` and the integer frame is passed to the wrapped SLM, which sends integer
+        data to the hardware as is.
+
+        If the frame is identical to the one already displayed, the hardware write and the settle wait are
+        skipped, unless ``force`` is ``True``. This is checked first against the versions of the phase manager and
+        then against a hash of the quantized frame. Skipped writes are counted in :attr:`n_skipped_writes`.
         """
         print("Calling to write to hardware")
-        self.phase_mgr.set_base(base, name)
-        self.slm.write(self.phase_mgr.get(), **kwargs)
+        with self.write_lock:
+            self.phase_mgr.set_base(base, name)
+            self.n_writes += 1
+            phase_correct = kwargs.pop("phase_correct", True)
+            # The wrapped SLM only adds its own phase correction to floating point data, so do it here instead.
+            phase_correction = getattr(self.slm, "phase_correction", None)
+            if not phase_correct:
+                phase_correction = None
+            version = (self.phase_mgr.version, id(phase_correction))
+            if not force and version == self._displayed_version:
+                self.n_skipped_writes += 1
+                return
+            phase = self.phase_mgr.get()
+            if phase_correction is not None:
+                phase = np.add(phase, phase_correction, out=self._lut_phase)
+            display = self.quantize(phase)
+            digest = hashlib.blake2b(display, digest_size=16).digest()
+            if not force and digest == self._displayed_digest:
+                self._displayed_version = version
+                self.n_skipped_writes += 1
+                return
+            self._write_display(display, version, digest, **kwargs)
+
+    def _write_display(self, display, version, digest, **kwargs):
+        # What is displayed is only recorded once the hardware write went through. After a failed write it is unknown.
+        try:
+            self.slm.write(display, **kwargs)
+        except Exception:
+            self.invalidate()
+            raise
+        self._displayed_version = version
+        self._displayed_digest = digest
+
+    def get_write_stats(self):
+        """
+        Returns the number of calls to :meth:`write` and how many of them were skipped as identical frames.
+        """
+        return self.n_writes, self.n_skipped_writes
 
     def _write_hw(self, phase):
         """
@@ -0,0 +1,84 @@
+"""
+Saves diagnostics of a calculation (SLM phase, far field and optimization statistics) from a background thread, for
+servers running headless where figures would block requests without anyone looking at them.
+
+The caller takes a snapshot of the arrays on its own thread, which is cheap, and the writer does the rest:
+
+    writer = DiagnosticsWriter("diagnostics/", png=True)
+    writer.save("calculate", iface.get_diagnostics(), process=iface.farfield_diagnostics)
+"""
+
+import os
+import concurrent.futures
+from datetime import datetime
+import numpy as np
+
+class DiagnosticsWriter(object):
+    def __init__(self, path="", png=False):
+        self.path = path
+        self.png = png
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.last_path = None
+
+    def save(self, name, data, process=None):
+        """
+        Queue a snapshot for writing.
+
+        Args:
+            name: Name of the diagnostics, used in the file name together with a timestamp.
+            data: dict of numpy arrays. It must not be modified afterwards.
+            process: Optional function run on the writer thread with data, returning a dict of further arrays to
+                save, e.g. the far field.
+
+        Returns:
+            Future of the path of the npz file.
+
+        """
+        now = datetime.now()
+        base_path = os.path.join(self.path, now.strftime("%Y%m%d_%H%M%S_%f") + "_" + name)
+        return self.executor.submit(self._write, base_path, data, process)
+
+    def _write(self, base_path, data, process):
+        try:
+            os.makedirs(os.path.dirname(base_path) or ".", exist_ok=True)
+            if process is not None:
+                data = dict(data)
+                data.update(process(data))
+            np.savez_compressed(base_path + ".npz", **data)
+            if self.png:
+                self._write_png(base_path + ".png", data)
+            self.last_path = base_path + ".npz"
+            return self.last_path
+        except Exception as e:
+            print("Diagnostics not saved: " + str(e))
+            return None
+
+    def _write_png(self, path, data):
+        # pyplot is not thread safe, so draw on a bare figure with the Agg canvas
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        fig = Figure(figsize=(12, 4))
+        FigureCanvasAgg(fig)
+        axs = fig.subplots(1, 3)
+        if "slm_phase" in data:
+            axs[0].imshow(np.mod(data["slm_phase"], 2*np.pi) / np.pi, vmin=0, vmax=2, interpolation="none", cmap="twilight")
+        axs[0].set_title("SLM phase [$\\pi$]")
+        if "farfield_amp" in data:
+            axs[1].imshow(data["farfield_amp"], interpolation="none")
+        axs[1].set_title("Far field amplitude")
+        for key in data:
+            if key.startswith("stats_"):
+                axs[2].plot(data[key], label=key[len("stats_"):])
+        axs[2].set_xlabel("Iteration")
+        axs[2].set_title("Stats")
+        if axs[2].has_data():
+            axs[2].legend()
+        fig.tight_layout()
+        fig.savefig(path)
+
+    def flush(self):
+        # wait for the queued diagnostics to be written
+        self.executor.submit(lambda: None).result()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,128 @@
+"""
+Stops hologram optimizations once they have converged instead of always running the full number of iterations.
+
+A calculation stops at the first of:
+- uniformity: the spots are at least this uniform (slmsuite uniformity, 1 is perfectly uniform),
+- plateau: the efficiency changed by less than this over the last plateau_iterations iterations,
+- max_time: the optimization has run for this many seconds,
+- the maximum number of iterations.
+None of the criteria are checked before min_iterations iterations. The statistics are those slmsuite computes every
+iteration for the stat group of the optimization, so checking them costs nothing.
+"""
+
+import time
+import numpy as np
+
+class StoppingCriteria(object):
+    keys = ["uniformity", "plateau", "plateau_iterations", "max_time", "min_iterations", "max_iterations"]
+
+    def __init__(self, uniformity=None, plateau=None, plateau_iterations=3, max_time=None, min_iterations=1, max_iterations=None):
+        """
+        Args:
+            uniformity, plateau, plateau_iterations, max_time, min_iterations: See above. None disables a criterion.
+            max_iterations: Iterations of a calculation whose number of iterations is left to the server (0), when a
+                criterion is enabled. None keeps the default of the server.
+
+        """
+        self.uniformity = uniformity
+        self.plateau = plateau
+        self.plateau_iterations = max(1, int(plateau_iterations))
+        self.max_time = max_time
+        self.min_iterations = int(min_iterations)
+        self.max_iterations = max_iterations
+
+    @classmethod
+    def from_dict(cls, config):
+        """
+        Raises:
+            Exception for keys which are not criteria.
+
+        """
+        unknown = [key for key in config if key not in cls.keys]
+        if len(unknown) > 0:
+            raise Exception("unknown stopping criteria: " + ", ".join(str(key) for key in unknown))
+        return cls(**config)
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.keys}
+
+    def updated(self, config):
+        # copy with the criteria of config replacing these
+        criteria = self.to_dict()
+        criteria.update(config)
+        return StoppingCriteria.from_dict(criteria)
+
+    def enabled(self):
+        return self.uniformity is not None or self.plateau is not None or self.max_time is not None
+
+    def n_iters(self, n_iters, default):
+        # iterations to run when the client asked for n_iters, 0 meaning the default of the server
+        if n_iters == 0:
+            if self.enabled() and self.max_iterations is not None:
+                return int(self.max_iterations)
+            return default
+        return n_iters
+
+    def monitor(self, stat_group, callback=None):
+        return OptimizationMonitor(self, stat_group, callback)
+
+class OptimizationMonitor(object):
+    """
+    Optimization callback which applies StoppingCriteria to one optimization and records why it stopped. The callback
+    of the caller is still called every iteration, and the optimization stops when it returns True.
+    """
+    def __init__(self, criteria, stat_group, callback=None):
+        self.criteria = criteria
+        self.stat_group = stat_group
+        self.callback = callback
+        self.reason = "max_iterations"
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+
+    def last_stats(self, hologram, stat, n=1):
+        values = hologram.stats["stats"].get(self.stat_group, dict()).get(stat, [])
+        return np.array(values[-n:], dtype=float)
+
+    def check(self, hologram):
+        # name of the criterion met by the statistics so far, or None
+        c = self.criteria
+        if hologram.iter < c.min_iterations:
+            return None
+        if c.uniformity is not None:
+            uniformity = self.last_stats(hologram, "uniformity")
+            if len(uniformity) > 0 and uniformity[-1] >= c.uniformity:
+                return "uniformity"
+        if c.plateau is not None:
+            efficiency = self.last_stats(hologram, "efficiency", c.plateau_iterations + 1)
+            if len(efficiency) > c.plateau_iterations and np.all(np.isfinite(efficiency)) and \
+                    np.max(efficiency) - np.min(efficiency) < c.plateau:
+                return "plateau"
+        if c.max_time is not None and time.perf_counter() - self.start >= c.max_time:
+            return "max_time"
+        return None
+
+    def __call__(self, hologram):
+        self.elapsed = time.perf_counter() - self.start
+        if self.callback is not None and self.callback(hologram):
+            self.reason = "callback"
+            return True
+        reason = self.check(hologram)
+        if reason is not None:
+            self.reason = reason
+            return True
+        return False
+
+    def info(self, hologram):
+        """
+        Returns:
+            dict with the criterion which stopped the optimization, the number of iterations, the time in seconds and
+            the final efficiency and uniformity.
+
+        """
+        self.elapsed = time.perf_counter() - self.start
+        info = {"reason": self.reason, "iterations": int(hologram.iter), "time": round(self.elapsed, 4)}
+        for stat in ["efficiency", "uniformity"]:
+            values = self.last_stats(hologram, stat)
+            if len(values) > 0:
+                info[stat] = float(values[-1])
+        return info
@@ -0,0 +1,164 @@
+"""
+FFT backends for the hologram optimization. With the default numpy backend every FFT of a 2048 x 2048 computational
+space runs on a single core, which dominates the time of calculate.
+
+slmsuite's algorithms call cp.fft.fft2 and cp.fft.ifft2, where cp is numpy when cupy is not installed. install()
+replaces numpy.fft.fft2 and numpy.fft.ifft2 with the ones of a backend for the whole process, so that the
+optimization, get_farfield and any other caller use it. The server does nothing else with numpy's FFTs, so this is
+simpler and safer than patching slmsuite.
+
+Backends:
+    numpy: numpy.fft, single threaded.
+    scipy: scipy.fft with workers threads.
+    pyfftw: pyFFTW with threads. Plans are cached between calls and FFTW wisdom is loaded from and saved to
+        wisdom_path, so that the planning cost is paid once per machine.
+
+Run this file to benchmark the backends on the standard computational spaces.
+"""
+
+import os
+import pickle
+import time
+import numpy as np
+
+# the original numpy functions, which install replaces
+_numpy_fft2 = np.fft.fft2
+_numpy_ifft2 = np.fft.ifft2
+
+class NumpyFFT(object):
+    name = "numpy"
+
+    def fft2(self, a, s=None, axes=(-2, -1), norm=None):
+        return _numpy_fft2(a, s=s, axes=axes, norm=norm)
+
+    def ifft2(self, a, s=None, axes=(-2, -1), norm=None):
+        return _numpy_ifft2(a, s=s, axes=axes, norm=norm)
+
+    def save_wisdom(self):
+        return
+
+class ScipyFFT(NumpyFFT):
+    name = "scipy"
+
+    def __init__(self, workers=-1):
+        import scipy.fft
+        self.fft = scipy.fft
+        self.workers = workers # -1 uses all cores
+
+    def fft2(self, a, s=None, axes=(-2, -1), norm=None):
+        return self.fft.fft2(a, s=s, axes=axes, norm=norm, workers=self.workers)
+
+    def ifft2(self, a, s=None, axes=(-2, -1), norm=None):
+        return self.fft.ifft2(a, s=s, axes=axes, norm=norm, workers=self.workers)
+
+class PyFFTW(NumpyFFT):
+    name = "pyfftw"
+
+    def __init__(self, workers=-1, wisdom_path=None, planner_effort="FFTW_MEASURE"):
+        try:
+            import pyfftw
+            import pyfftw.interfaces.scipy_fft
+        except ImportError:
+            raise Exception("pyfftw is not installed, use the scipy fft backend instead")
+        self.pyfftw = pyfftw
+        self.fft = pyfftw.interfaces.scipy_fft
+        if workers == -1:
+            workers = os.cpu_count()
+        self.workers = workers
+        self.planner_effort = planner_effort
+        self.wisdom_path = wisdom_path
+        if wisdom_path is not None and os.path.exists(wisdom_path):
+            with open(wisdom_path, 'rb') as fhdl:
+                pyfftw.import_wisdom(pickle.load(fhdl))
+        # keep the plans of the interfaces alive between iterations
+        pyfftw.interfaces.cache.enable()
+        pyfftw.interfaces.cache.set_keepalive_time(60)
+
+    def fft2(self, a, s=None, axes=(-2, -1), norm=None):
+        return self.fft.fft2(a, s=s, axes=axes, norm=norm, workers=self.workers, planner_effort=self.planner_effort)
+
+    def ifft2(self, a, s=None, axes=(-2, -1), norm=None):
+        return self.fft.ifft2(a, s=s, axes=axes, norm=norm, workers=self.workers, planner_effort=self.planner_effort)
+
+    def save_wisdom(self):
+        # call after the first calculation, once the plans of the usual shapes exist
+        if self.wisdom_path is None:
+            return
+        with open(self.wisdom_path, 'wb') as fhdl:
+            pickle.dump(self.pyfftw.export_wisdom(), fhdl)
+
+def get_backend(name="numpy", workers=-1, wisdom_path=None, planner_effort="FFTW_MEASURE"):
+    if name == "numpy":
+        return NumpyFFT()
+    elif name == "scipy":
+        return ScipyFFT(workers)
+    elif name == "pyfftw":
+        return PyFFTW(workers, wisdom_path, planner_effort)
+    else:
+        raise Exception("FFT backend not recognized: " + str(name))
+
+def install(backend):
+    """
+    Make numpy.fft.fft2 and numpy.fft.ifft2 use backend, for the whole process. The numpy backend restores the
+    original functions.
+    """
+    np.fft.fft2 = backend.fft2
+    np.fft.ifft2 = backend.ifft2
+
+def benchmark(backends=["numpy", "scipy", "pyfftw"], shapes=[(1024, 1024), (2048, 2048), (4096, 4096)], n_iters=5, workers=-1, hologram=True):
+    """
+    Times the backends on each shape and prints the time per iteration.
+
+    Args:
+        backends: Names of the backends. Backends which cannot be created are skipped.
+        shapes: Computational spaces to time.
+        n_iters: Number of iterations to average over, after one warm up iteration.
+        workers: Threads of the multithreaded backends.
+        hologram: If True, time iterations of a WGS-Kim optimization of a 10 x 10 spot array. Otherwise time a
+            forward and backward FFT, the FFT part of one iteration.
+
+    Returns:
+        dict from (backend, shape) to the time per iteration in seconds.
+
+    """
+    results = dict()
+    for name in backends:
+        try:
+            backend = get_backend(name, workers)
+        except Exception as e:
+            print("Skipping " + name + ": " + str(e))
+            continue
+        install(backend)
+        try:
+            for shape in shapes:
+                if hologram:
+                    t = _time_hologram(shape, n_iters)
+                else:
+                    t = _time_fft(shape, n_iters)
+                results[(name, shape)] = t
+                print(name + " " + str(shape) + ": " + str(round(t * 1000, 1)) + " ms per iteration")
+        finally:
+            install(NumpyFFT())
+    return results
+
+def _time_fft(shape, n_iters):
+    field = np.exp(1j * np.random.uniform(0, 2*np.pi, shape)).astype(np.complex64)
+    np.fft.ifft2(np.fft.fft2(field, norm="ortho"), norm="ortho")
+    start = time.perf_counter()
+    for i in range(n_iters):
+        np.fft.ifft2(np.fft.fft2(field, norm="ortho"), norm="ortho")
+    return (time.perf_counter() - start) / n_iters
+
+def _time_hologram(shape, n_iters):
+    import slmsuite.holography.algorithms
+    x, y = np.meshgrid(np.arange(10) * 20, np.arange(10) * 20)
+    spots = np.vstack((x.ravel(), y.ravel())) + np.array([[shape[1] // 8], [shape[0] // 8]])
+    slm_shape = (shape[0] // 2, shape[1] // 2)
+    hologram = slmsuite.holography.algorithms.SpotHologram(shape, spots, basis='knm', slm_shape=slm_shape)
+    hologram.optimize(method="WGS-Kim", maxiter=1, feedback='computational_spot', stat_groups=[])
+    start = time.perf_counter()
+    hologram.optimize(method="WGS-Kim", maxiter=n_iters, feedback='computational_spot', stat_groups=[])
+    return (time.perf_counter() - start) / n_iters
+
+if __name__ == "__main__":
+    benchmark()
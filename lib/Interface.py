@@ -1,12 +1,13 @@
 import numpy as np
 import utils
+import SpotExtractor
+import EarlyStopping
 import slmsuite.hardware.slms.slm
 import slmsuite.hardware.cameras.camera
 import slmsuite.hardware.cameraslms
 import slmsuite.holography.algorithms
 import slmsuite.holography.toolbox
 import slmsuite.holography.toolbox.phase
-import matplotlib.pyplot as plt
 
 # This class acts as an interface between the server and the slmsuite library
 
@@ -28,6 +29,13 @@ class SLMSuiteInterface:
         self.cameraslm = None
         self.hologram = None
         self.fourier_calibration_source = ''
+        self.warm_start = None
+        """ WarmStartIndex of saved calculations to seed calculate with, or None """
+        self.warm_start_iters = None
+        """ Number of iterations when calculate is warm started, or None to keep n_iters """
+        self.warm_start_source = ''
+        self.calculation_info = dict()
+        """ How the last calculate stopped, see EarlyStopping.OptimizationMonitor.info """
 
     def set_SLM(self, slm=None):
         """
@@ -98,7 +106,7 @@ class SLMSuiteInterface:
         """
         return slmsuite.holography.toolbox.phase.lens(self.slm, focal_length), 1
 
-    def calculate(self, computational_shape, target_spot_array, target_amps=None, n_iters=20, save_options=None, extra_info = None, phase = None):
+    def calculate(self, computational_shape, target_spot_array, target_amps=None, n_iters=20, save_options=None, extra_info = None, phase = None, callback = None, stopping = None):
         """
             Calculates the required phase pattern
 
@@ -108,6 +116,8 @@ class SLMSuiteInterface:
                 computational_shape: Shape of computational space for the SLM plane (size 2 tuple). Needs to be bigger than the SLM itself.
                 save_options: dict with a set of attributes describing how to save the file. TODO: Describe these. 
                 extra_info: TODO
+                callback: Called with the hologram after every iteration. Returning True stops the optimization.
+                stopping: EarlyStopping.StoppingCriteria ending the optimization before n_iters iterations, or None.
             Returns:
                 0 upon success and -1 upon failure
             Raises:
@@ -115,27 +125,71 @@ class SLMSuiteInterface:
         """
         if self.cameraslm is None:
             return None, None, -1
-        if self.cameraslm.fourier_calibration is None:
-            self.hologram = slmsuite.holography.algorithms.SpotHologram(computational_shape, target_spot_array, phase = phase, spot_amp=target_amps, basis='knm', cameraslm=self.cameraslm)
-            no_calib = 1
-        else:
-            self.hologram = slmsuite.holography.algorithms.SpotHologram(computational_shape, target_spot_array, phase = phase, spot_amp=target_amps, basis='ij', cameraslm=self.cameraslm)
-            no_calib = 0
+        self.hologram, no_calib = self._make_hologram(computational_shape, target_spot_array, target_amps, phase)
+        self.warm_start_source = ''
+        if phase is None and self.warm_start is not None:
+            # seed the phase from the nearest saved calculation
+            phase, source = self.warm_start.seed_phase(self.hologram.spot_knm, computational_shape, self.fourier_calibration_source)
+            if phase is not None:
+                print("Warm start from " + source)
+                self.warm_start_source = source
+                self.hologram, no_calib = self._make_hologram(computational_shape, target_spot_array, target_amps, phase)
+                if self.warm_start_iters is not None:
+                    n_iters = min(n_iters, self.warm_start_iters)
         ntargets = target_spot_array.shape[1]
+        if stopping is None:
+            stopping = EarlyStopping.StoppingCriteria()
         if ntargets == 1:
-            self.hologram.optimize(method="GS", maxiter=n_iters, feedback='computational_spot', stat_groups=['computational'])
+            # a single spot is always uniform
+            monitor = stopping.updated({"uniformity": None}).monitor('computational', callback)
+            self.hologram.optimize(method="GS", maxiter=n_iters, feedback='computational_spot', stat_groups=['computational'], callback=monitor)
         else:
-            self.hologram.optimize(method="WGS-Kim", maxiter=n_iters, feedback='computational_spot', stat_groups=['computational_spot'])
+            monitor = stopping.monitor('computational_spot', callback)
+            self.hologram.optimize(method="WGS-Kim", maxiter=n_iters, feedback='computational_spot', stat_groups=['computational_spot'], callback=monitor)
+        self.calculation_info = monitor.info(self.hologram)
+        if self.warm_start_source != '':
+            self.calculation_info["warm_start"] = self.warm_start_source
 
         full_path = None
         full_path2 = None
         if save_options is not None:
-            full_path, full_path2 = utils.save_slm_calculation(self.hologram, save_options, extra_info)
+            full_path, full_path2, _ = self.save_calculation(save_options, extra_info)
         if no_calib:
             return full_path, full_path2, 1
         else:
             return full_path, full_path2, 0
 
+    def _make_hologram(self, computational_shape, target_spot_array, target_amps, phase):
+        # targets are in camera pixels once there is a fourier calibration, and in computational space pixels otherwise
+        if self.cameraslm.fourier_calibration is None:
+            hologram = slmsuite.holography.algorithms.SpotHologram(computational_shape, target_spot_array, phase = phase, spot_amp=target_amps, basis='knm', cameraslm=self.cameraslm)
+            return hologram, 1
+        else:
+            hologram = slmsuite.holography.algorithms.SpotHologram(computational_shape, target_spot_array, phase = phase, spot_amp=target_amps, basis='ij', cameraslm=self.cameraslm)
+            return hologram, 0
+
+    def batch_tasks(self, computational_shape, targets_list, amps_list, n_iters, save_options):
+        """
+            Prepares the tasks of BatchCalculate.calculate_batch. The worker processes have no camera or SLM, so the
+            targets are converted to computational space pixels and the SLM amplitude is copied here.
+
+            Args:
+                targets_list, amps_list: Lists of targets and amps, as for calculate.
+                save_options: Save options of every pattern. The index of the pattern is appended to the name.
+            Returns:
+                List of tasks
+        """
+        tasks = []
+        for idx, (targets, amps) in enumerate(zip(targets_list, amps_list)):
+            hologram, _ = self._make_hologram(computational_shape, targets, amps, None)
+            slm_amp = hologram.amp
+            if hasattr(slm_amp, "get"):
+                slm_amp = slm_amp.get()
+            options = dict(save_options)
+            options["name"] = save_options["name"] + "_" + str(idx)
+            tasks.append((idx, computational_shape, hologram.slm_shape, np.array(hologram.spot_knm), amps, slm_amp, n_iters, options))
+        return tasks
+
     def init_hologram(self, path, computational_shape):
         _,data = utils.load_slm_calculation(path, 1, 1)
         slm_amp = None
@@ -160,14 +214,22 @@ class SLMSuiteInterface:
         self.hologram = slmsuite.holography.algorithms.SpotHologram(computational_shape, target, phase=slm_phase, spot_amp=amps, basis='knm', cameraslm=self.cameraslm)
         return "ok"
 
-    def save_calculation(self, save_options, extra_info=None):
+    def save_calculation(self, save_options, extra_info=None, saver=None):
         """
-
+            Saves the hologram with utils.save_slm_calculation. If saver (a SaveQueue) is given, the hologram is only
+            copied here and the files are written in the background.
         """
         if self.hologram is None:
             return None, None, -1
         else:
-            full_path, full_path2 = utils.save_slm_calculation(self.hologram, save_options, extra_info)
+            if saver is None:
+                full_path, full_path2 = utils.save_slm_calculation(self.hologram, save_options, extra_info)
+            else:
+                snapshot, full_path, full_path2 = utils.snapshot_slm_calculation(self.hologram, save_options, extra_info)
+                saver.submit(snapshot)
+            if self.warm_start is not None and full_path2 is not None and save_options["slm_pattern"] is True:
+                base_path = utils.calculation_base_path(full_path2)
+                self.warm_start.add(base_path, self.hologram.spot_knm, self.hologram.spot_amp, self.hologram.shape, self.fourier_calibration_source)
             return full_path, full_path2, 0
 
     def get_amp(self):
@@ -206,12 +268,39 @@ class SLMSuiteInterface:
                 amp = self.hologram.amp
             elif (amp is not None) and (phase is None):
                 phase = self.hologram.phase
-            nearfield = slmsuite.holography.toolbox.pad(amp * np.exp(1j * phase), self.hologram.shape)
-            farfield = np.fft.fftshift(np.fft.fft2(np.fft.fftshift(nearfield), norm="ortho"))
-            return farfield, 0
+            return utils.farfield(amp, phase, self.hologram.shape), 0
         else:
             return None, -1
 
+    def get_diagnostics(self):
+        """
+            Copies the SLM phase and amplitude and the optimization statistics of the hologram, for saving them from
+            another thread with a DiagnosticsWriter.
+
+            Returns:
+                dict of numpy arrays, empty if there is no hologram. Statistics are saved as stats_<group>_<stat>.
+        """
+        data = dict()
+        if self.hologram is None:
+            return data
+        data["slm_phase"] = np.array(self.get_phase(), copy=True)
+        data["slm_amp"] = np.array(self.get_amp(), copy=True)
+        data["shape"] = np.array(self.hologram.shape)
+        for group, stats in self.hologram.stats["stats"].items():
+            for stat, values in stats.items():
+                data["stats_" + group + "_" + stat] = np.array(values, dtype=float)
+        return data
+
+    def farfield_diagnostics(self, data):
+        """
+            Computes the far field amplitude of a snapshot from get_diagnostics. Only uses the snapshot, so it can run
+            on another thread while the hologram changes.
+        """
+        if "slm_phase" not in data:
+            return dict()
+        farfield = utils.farfield(data["slm_amp"], data["slm_phase"], tuple(data["shape"]))
+        return {"farfield_amp": np.abs(farfield).astype(np.float32)}
+
     def plot_slmplane(self, amp=None, phase=None):
         """
 
@@ -224,6 +313,7 @@ class SLMSuiteInterface:
                 amp = self.hologram.amp
             elif (amp is not None) and (phase is None):
                 phase = self.hologram.phase
+            import matplotlib.pyplot as plt # only loaded when plotting, so headless servers do not need it
             fig, axs = plt.subplots(1, 2, figsize=(8,4))
 
             if isinstance(amp, float):
@@ -296,8 +386,8 @@ class SLMSuiteInterface:
         else:
             self.cameraslm.slm.write(base, name, settle=True)
 
-    def perform_fourier_calibration(self, shape=[5,5], pitch=[30,40]):
-        self.cameraslm.fourier_calibrate(array_shape=shape, array_pitch=pitch, plot=True)
+    def perform_fourier_calibration(self, shape=[5,5], pitch=[30,40], plot=True):
+        self.cameraslm.fourier_calibrate(array_shape=shape, array_pitch=pitch, plot=plot)
         self.fourier_calibration_source = 'unsaved'
         return 0
 
@@ -328,19 +418,34 @@ class SLMSuiteInterface:
     
     
 
-    def perform_camera_feedback(self, niters):
+    def perform_camera_feedback(self, niters, callback=None, plot=True):
         if self.hologram is None:
             return -1, "no hologram exists to continue camera feedback"
         else:
-            self.hologram.optimize(method='WGS-Kim', maxiter=niters, feedback='experimental_spot', fixed_phase=False, stat_groups=['experimental_spot'])
-            self.hologram.plot_stats()
+            # The spots are extracted from the frames with precomputed pixel indices (SpotExtractor) and handed to the
+            # optimization as external feedback. The current phase is measured first, as experimental_spot would.
+            extractor = SpotExtractor.SpotExtractor.from_hologram(self.hologram, self.cameraslm.cam.shape)
+            self.hologram.external_spot_amp = utils.measure_spot_amps(self.cameraslm, extractor, self.hologram.extract_phase())
+            cb_fn = utils.camera_feedback_callback(self.cameraslm, extractor, callback)
+            self.hologram.optimize(method='WGS-Kim', maxiter=niters, feedback='external_spot', fixed_phase=False, stat_groups=['external_spot'], callback=cb_fn)
+            if plot:
+                self.hologram.plot_stats()
             return 0, "ok"
 
-    def perform_scan_feedback(self, niters, client):
+    def perform_scan_feedback(self, niters, client, callback=None, plot=True, pipeline=0):
+        # pipeline > 0 overlaps the optimization with the scans, see utils.ScanFeedbackPipeline
         if self.hologram is None:
             return -1, "no hologram exists to continue camera feedback"
         else:
-            cb_fn = utils.feedback_client_callback(client)
-            self.hologram.optimize(method='WGS-Kim', maxiter=niters, feedback='external_spot', callback=cb_fn, fixed_phase=False, stat_groups=['external_spot'])
-            self.hologram.plot_stats()
+            if pipeline > 0:
+                cb_fn = utils.ScanFeedbackPipeline(client, pipeline, callback)
+            else:
+                cb_fn = utils.feedback_client_callback(client, callback)
+            try:
+                self.hologram.optimize(method='WGS-Kim', maxiter=niters, feedback='external_spot', callback=cb_fn, fixed_phase=False, stat_groups=['external_spot'])
+            finally:
+                if pipeline > 0:
+                    cb_fn.finish()
+            if plot:
+                self.hologram.plot_stats()
             return 0, "ok"
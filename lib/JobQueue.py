@@ -0,0 +1,137 @@
+"""
+Runs long server commands (calculate, feedback, calibrations) in the background so that the server worker keeps
+answering requests. Each submitted command becomes a Job with an id that clients use to query its status, progress and
+result, or to cancel it.
+"""
+
+import threading
+import concurrent.futures
+from collections import OrderedDict
+import CommandRegistry
+
+class Job(object):
+    def __init__(self, job_id, name, reply):
+        self.job_id = job_id
+        self.name = name
+        self.reply = reply # frame types of the result, see CommandRegistry
+        self.future = None
+        self.cancel_event = threading.Event()
+        self.__lock = threading.Lock()
+        self.__progress = dict()
+
+    def set_progress(self, **kwargs):
+        with self.__lock:
+            self.__progress.update(kwargs)
+
+    def get_progress(self):
+        with self.__lock:
+            return dict(self.__progress)
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def status(self):
+        if self.future.cancelled():
+            return "cancelled"
+        if not self.future.done():
+            if self.future.running():
+                return "running"
+            return "queued"
+        msg_type, rep = self.future.result()
+        if self.cancelled():
+            return "cancelled"
+        if len(rep) > 0 and isinstance(rep[0], str) and rep[0].startswith("error"):
+            return "error"
+        return "done"
+
+    def result(self):
+        # (msg_type, rep) of the command, or None if it has not finished
+        if self.future.cancelled() or not self.future.done():
+            return None
+        return self.future.result()
+
+    def progress_callback(self, stat_group=None):
+        """
+        Returns a hologram optimization callback which records the iteration and the latest efficiency and uniformity
+        as progress, and stops the optimization when the job is cancelled. The statistics are taken from stat_group,
+        or from the first stat group of the hologram if it is None.
+        """
+        def func(hologram):
+            progress = dict()
+            progress["iteration"] = int(hologram.iter)
+            groups = hologram.stats["stats"]
+            group = stat_group
+            if group is None and len(groups) > 0:
+                group = next(iter(groups))
+            stats = groups.get(group, dict())
+            for stat in ["efficiency", "uniformity"]:
+                if stat in stats and len(stats[stat]) > 0:
+                    progress[stat] = float(stats[stat][-1])
+            self.set_progress(**progress)
+            return self.cancelled()
+        return func
+
+class JobQueue(object):
+    def __init__(self, max_workers=1, max_finished=100):
+        # A single worker by default: jobs share the SLM, camera and hologram, so they run one after the other.
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.max_finished = max_finished
+        self.jobs = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__n_jobs = 0
+
+    def submit(self, name, reply, func, *args):
+        """
+        Submit func(*args) as a job. func returns (msg_type, rep) like a command handler.
+
+        Returns:
+            The Job.
+
+        """
+        with self.__lock:
+            self.__n_jobs += 1
+            job = Job(str(self.__n_jobs), name, reply)
+            self.jobs[job.job_id] = job
+            self._prune()
+        job.future = self.executor.submit(self._run, job, func, *args)
+        return job
+
+    def _run(self, job, func, *args):
+        self.__local.job = job
+        try:
+            return func(*args)
+        except Exception as e:
+            return CommandRegistry.error_reply("exception", str(e), job.reply)
+        finally:
+            self.__local.job = None
+
+    def _prune(self):
+        # forget the oldest finished jobs
+        finished = [job_id for job_id, job in self.jobs.items() if job.future is not None and job.future.done()]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        with self.__lock:
+            return self.jobs.get(job_id)
+
+    def current_job(self):
+        # The job running on the calling thread, or None when called outside of a job.
+        return getattr(self.__local, "job", None)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return "unknown job"
+        if job.future.done():
+            return "already finished"
+        job.cancel_event.set()
+        if job.future.cancel():
+            return "cancelled"
+        return "cancelling"
+
+    def shutdown(self):
+        for job in list(self.jobs.values()):
+            job.cancel_event.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,75 @@
+"""
+Size bounded LRU cache of the slm_phase of saved calculations, so that switching between the same few patterns does
+not read and decompress them from disk every time.
+
+Entries are keyed by the path of the file holding the phase and checked against its modification time and size, so
+a pattern saved again under the same name is reloaded. Cached phases are float32, the type the PhaseManager keeps,
+and read only: the same array is handed out on every hit, which also lets the PhaseManager and CorrectedSLM notice
+that the pattern did not change.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import utils
+
+class PatternCache(object):
+    def __init__(self, max_bytes=512 * 2**20):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # data path -> (stamp, phase), least recently used first
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def data_path(base_path):
+        # file holding slm_phase, in either save format, see utils.load_slm_calculation
+        if os.path.isdir(base_path + "_data"):
+            return os.path.abspath(os.path.join(base_path + "_data", "slm_phase.npy"))
+        return os.path.abspath(base_path + "_data.npz")
+
+    def get(self, base_path):
+        """
+        Returns the slm_phase of the calculation saved at base_path, from the cache if the file has not changed.
+        """
+        path = self.data_path(base_path)
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self.__lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == stamp:
+                self.hits += 1
+                self.entries.move_to_end(path)
+                return entry[1]
+            self.misses += 1
+        _, data = utils.load_slm_calculation(base_path, 0, 1)
+        phase = np.array(data["slm_phase"], dtype=np.float32)
+        phase.flags.writeable = False
+        with self.__lock:
+            self._remove(path)
+            if phase.nbytes <= self.max_bytes:
+                self.entries[path] = (stamp, phase)
+                self.n_bytes += phase.nbytes
+                while self.n_bytes > self.max_bytes:
+                    self._remove(next(iter(self.entries)))
+                    self.evictions += 1
+        return phase
+
+    def _remove(self, path):
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            self.n_bytes -= entry[1].nbytes
+
+    def clear(self):
+        with self.__lock:
+            self.entries.clear()
+            self.n_bytes = 0
+
+    def stats(self):
+        with self.__lock:
+            return "hits: " + str(self.hits) + " misses: " + str(self.misses) + " evictions: " + str(self.evictions) + \
+                " entries: " + str(len(self.entries)) + " MB: " + str(round(self.n_bytes / 2**20, 1)) + \
+                " max MB: " + str(round(self.max_bytes / 2**20, 1))
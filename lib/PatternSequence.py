@@ -0,0 +1,98 @@
+"""
+Ordered list of patterns stepped through with next / goto, for experiments that switch patterns quickly.
+
+While a pattern is displayed, a background thread loads the next few patterns (through the server's pattern loading,
+so the pattern cache is used) and composes and quantizes them with the current corrections (CorrectedSLM.prepare).
+Switching then only does the hardware write. A prepared frame is dropped and the pattern composed on the spot if the
+corrections changed since it was prepared, so the displayed phase is always the same as use_pattern followed by
+project.
+"""
+
+import concurrent.futures
+import numpy as np
+
+class PatternSequence(object):
+    def __init__(self, slm, load_pattern, paths, n_prefetch=2):
+        """
+        Args:
+            slm: CorrectedSLM the patterns are written to.
+            load_pattern: Function returning the slm_phase of a pattern path.
+            paths: Ordered list of pattern paths.
+            n_prefetch: Number of patterns after the current one kept ready. The sequence wraps around.
+
+        """
+        if len(paths) == 0:
+            raise Exception("A sequence needs at least one pattern")
+        self.slm = slm
+        self.load_pattern = load_pattern
+        self.paths = list(paths)
+        self.n_prefetch = max(0, min(n_prefetch, len(self.paths) - 1))
+        self.index = -1
+        self.n_prepared = 0 # switches which only had to write to the hardware
+        self.n_composed = 0 # switches which composed the pattern on the spot
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        # temporaries of CorrectedSLM.prepare, only used by the executor thread
+        self.__scratch = (np.empty(slm.slm.shape, dtype=np.float32), np.empty(slm.slm.shape, dtype=np.int32))
+        self.frames = dict() # index -> future of (base, display, digest, key)
+        self._schedule(0)
+
+    def _prepare(self, idx):
+        base = self.load_pattern(self.paths[idx])
+        display, digest, key = self.slm.prepare(base, self.__scratch)
+        return base, display, digest, key
+
+    def _schedule(self, start):
+        # keeps the n_prefetch patterns from start on prepared, and drops the others
+        wanted = [(start + n) % len(self.paths) for n in range(self.n_prefetch)]
+        for idx in list(self.frames):
+            if idx not in wanted:
+                self.frames.pop(idx).cancel()
+        key = self.slm.correction_key()
+        for idx in wanted:
+            future = self.frames.get(idx)
+            if future is not None and future.done() and (future.exception() is not None or future.result()[3] != key):
+                future = None
+            if future is None:
+                self.frames[idx] = self.executor.submit(self._prepare, idx)
+
+    def goto(self, idx, **kwargs):
+        """
+        Displays pattern idx (modulo the length of the sequence) and starts preparing the ones after it.
+
+        Returns:
+            True if the prepared frame was used, False if the pattern had to be composed on the spot.
+
+        """
+        idx = idx % len(self.paths)
+        path = self.paths[idx]
+        frame = None
+        future = self.frames.pop(idx, None)
+        if future is not None and not future.cancel():
+            # waiting for a frame being prepared is still faster than starting over
+            try:
+                frame = future.result()
+            except Exception as e:
+                print("Preparing " + path + " failed: " + str(e))
+        if frame is not None and self.slm.write_prepared(frame[0], path, *frame[1:], **kwargs):
+            self.n_prepared += 1
+            prepared = True
+        else:
+            self.slm.write(self.load_pattern(path), path, **kwargs)
+            self.n_composed += 1
+            prepared = False
+        self.index = idx
+        self._schedule(idx + 1)
+        return prepared
+
+    def next(self, **kwargs):
+        return self.goto(self.index + 1, **kwargs)
+
+    def info(self):
+        return "index: " + str(self.index) + " length: " + str(len(self.paths)) + \
+            " prepared: " + str(self.n_prepared) + " composed: " + str(self.n_composed)
+
+    def close(self):
+        for future in self.frames.values():
+            future.cancel()
+        self.frames.clear()
+        self.executor.shutdown(wait=False)
@@ -1,68 +1,180 @@
 import numpy as np
+import functools
+from collections import OrderedDict
 import slmsuite.holography.toolbox.phase
 import utils
 from PIL import Image
 
+@functools.lru_cache(maxsize=4)
+def _pixel_grids(shape):
+    # Open grids of the squared pixel distance from the center of the SLM. These broadcast against each other
+    # to the full frame, so only shape[0] + shape[1] values are stored per SLM shape.
+    center = [(elem - 1)/2 for elem in shape]
+    y2 = np.square(np.arange(shape[0], dtype=np.float64) - center[0])[:, np.newaxis]
+    x2 = np.square(np.arange(shape[1], dtype=np.float64) - center[1])[np.newaxis, :]
+    return y2, x2
+
+@functools.lru_cache(maxsize=16)
+def _aperture_mask(shape, aperture, edge_width):
+    # aperture is (radius along axis 0, radius along axis 1) in pixels. edge_width is the width in pixels of a
+    # raised cosine taper on the inside of the aperture boundary. 0 gives the hard 0/1 mask.
+    y2, x2 = _pixel_grids(shape)
+    r2 = y2 / aperture[0]**2 + x2 / aperture[1]**2
+    if edge_width <= 0:
+        mask = (r2 < 1).astype(np.float32)
+    else:
+        # Distance to the boundary along the ray from the center, rho * (1/r - 1). Infinite at the center.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dist = np.sqrt(y2 + x2) * (1 / np.sqrt(r2) - 1)
+        dist[r2 == 0] = np.inf
+        ramp = np.clip(dist / edge_width, 0, 1)
+        mask = (0.5 - 0.5 * np.cos(np.pi * ramp)).astype(np.float32)
+    # Shared between every PhaseManager that asks for this aperture, so it must not be modified in place.
+    mask.flags.writeable = False
+    return mask
+
 class PhaseManager(object):
+    # The phase sent to the SLM is (base + additional) * mask. The additional phase is a stack of named layers (one per
+    # lens, zernike, offset or file correction that was added). self.additional holds the sum of the enabled layers,
+    # in layer order. A new layer is added to it in place; a layer toggled or replaced makes it be summed again, as
+    # subtracting in float32 is not exact and would drift over many toggles. The composite is cached until something
+    # changes.
     def __init__(self, slm):
         self.slm = slm
         self.shape = slm.shape
         self.base = np.zeros(self.shape,dtype=np.float32)
         self.base_source = ''
         self.additional = np.zeros(self.shape,dtype=np.float32)
-        self.add_log = [] # log for everything that has been added to this additional phase
+        self.layers = OrderedDict() # name -> [kind, description, phase, enabled]
+        self.n_layers_created = 0 # used to give every layer a unique name
         self.aperture = None
+        self.aperture_edge = 0
         self.mask = None
+        self._composite = np.zeros(self.shape,dtype=np.float32)
+        self._composite_valid = False
+        # bumped on every change to the base or to the layers/aperture respectively
+        self.base_version = 0
+        self.correction_version = 0
+
+    @property
+    def add_log(self):
+        # log for everything that has been added to this additional phase
+        return [[layer[0], layer[1]] for layer in self.layers.values() if layer[3]]
+
+    @property
+    def version(self):
+        return (self.base_version, self.correction_version)
+
+    def _base_changed(self):
+        self.base_version += 1
+        self._composite_valid = False
+
+    def _correction_changed(self):
+        self.correction_version += 1
+        self._composite_valid = False
 
     def set_base(self, base, source = ''):
-        self.base = base
+        # Setting the current base again only keeps the version if it is read only (e.g. from the PatternCache).
+        # A writable array may have been changed in place.
+        if base is not self.base or base.flags.writeable:
+            self.base = np.asarray(base, dtype=np.float32)
+            self._base_changed()
         self.base_source = source
 
     def get(self):
-        phase = self.base + self.additional
+        # The returned array is reused between calls and must not be modified.
+        if not self._composite_valid:
+            self.compose(self.base, self._composite)
+            self._composite_valid = True
+        return self._composite
+
+    def compose(self, base, out=None):
+        # Applies the current layers and aperture to an arbitrary base without changing the state of this object.
+        if out is None:
+            out = np.empty(self.shape, dtype=np.float32)
+        np.add(base, self.additional, out=out)
         if self.mask is not None:
-            phase = np.multiply(phase, self.mask)
-        return phase
+            np.multiply(out, self.mask, out=out)
+        return out
 
     def reset_base(self):
-        self.base = np.zeros(self.shape)
+        self.base = np.zeros(self.shape,dtype=np.float32)
         self.base_source = ''
+        self._base_changed()
 
     def reset_additional(self):
-        self.additional = np.zeros(self.shape)
-        self.add_log = []
-
-    def set_aperture(self, aperture_size):
+        self.additional.fill(0)
+        self.layers = OrderedDict()
+        self._correction_changed()
+
+    def add_layer(self, kind, phase, description):
+        name = kind + str(self.n_layers_created)
+        self.n_layers_created += 1
+        phase = np.asarray(phase, dtype=np.float32)
+        self.layers[name] = [kind, description, phase, True]
+        np.add(self.additional, phase, out=self.additional)
+        self._correction_changed()
+        return name
+
+    def update_layer(self, name, phase, description=None):
+        layer = self.layers[name]
+        phase = np.asarray(phase, dtype=np.float32)
+        layer[2] = phase
+        if description is not None:
+            layer[1] = description
+        if layer[3]:
+            self._sum_layers()
+        self._correction_changed()
+
+    def set_layer_enabled(self, name, enabled):
+        layer = self.layers[name]
+        if layer[3] == enabled:
+            return
+        layer[3] = enabled
+        self._sum_layers()
+        self._correction_changed()
+
+    def _sum_layers(self):
+        # same order as the in place adds of add_layer, so a toggle off and on restores the sum exactly
+        self.additional.fill(0)
+        for layer in self.layers.values():
+            if layer[3]:
+                np.add(self.additional, layer[2], out=self.additional)
+
+    def remove_layer(self, name):
+        self.set_layer_enabled(name, False)
+        del self.layers[name]
+
+    def get_layers(self):
+        return [[name, layer[0], layer[1], layer[3]] for name, layer in self.layers.items()]
+
+    def set_aperture(self, aperture_size, edge_width=0):
         self.aperture = aperture_size
-        # calculate mask
-        center = [(elem - 1)/2 for elem in self.shape]
-        mask = np.zeros(self.shape,dtype=np.float32)
-        for i in range(self.shape[0]):
-            for j in range(self.shape[1]):
-                if (i - center[0])**2 / (self.aperture[0]**2) + (j - center[1])**2 / (self.aperture[1]**2) < 1:
-                    mask[i,j] = 1
-        self.mask = mask
+        self.aperture_edge = edge_width
+        # masks are cached, so switching between apertures that have been used before is instant
+        self.mask = _aperture_mask(tuple(self.shape), (float(aperture_size[0]), float(aperture_size[1])), float(edge_width))
+        self._correction_changed()
 
     def get_aperture(self):
         return self.aperture, self.mask
 
     def reset_aperture(self):
         self.aperture = None
+        self.aperture_edge = 0
         self.mask = None
+        self._correction_changed()
 
     def add_fresnel_lens(self, focal_length):
         phase= slmsuite.holography.toolbox.phase.lens(self.slm, focal_length)
-        self.additional = self.additional + phase
-        self.add_log.append(["fresnel_lens", np.array2string(focal_length, separator=',')])
+        return self.add_layer("fresnel_lens", phase, np.array2string(focal_length, separator=','))
     
     def add_zernike_poly(self, zernike_list):
         phase = slmsuite.holography.toolbox.phase.zernike_sum(self.slm, zernike_list, aperture="cropped")
-        self.additional = self.additional + phase
-        self.add_log.append(["zernike", str(zernike_list)])
+        return self.add_layer("zernike", phase, str(zernike_list))
+
     def add_offset(self, offset_data):
         phase = slmsuite.holography.toolbox.phase.blaze(self.slm, vector = offset_data)
-        self.additional = self.additional + phase
-        self.add_log.append(["offset", str(offset_data)])
+        return self.add_layer("offset", phase, str(offset_data))
 
     def save_to_file(self, save_options, extra_info=None):
         full_path, full_path2 = utils.save_add_phase(self, save_options, extra_info)
@@ -72,13 +184,12 @@ class PhaseManager(object):
         #with Image.open(fname) as image:
         #    image_array = np.array(image)
         _,data = utils.load_add_phase(fname, 0, 1)
-        self.additional = self.additional + data["phase"]
-        self.add_log.append(["file", fname])
+        return self.add_layer("file", data["phase"], fname)
 
     def add_pattern_to_additional(self, fname):
         _,data = utils.load_slm_calculation(fname, 0, 1)
-        self.additional = self.additional + data["slm_phase"]
-        self.add_log.append(["file", fname])
+        # copied, so that the layer does not keep the file memory mapped
+        return self.add_layer("file", np.array(data["slm_phase"], dtype=np.float32), fname)
 
     def add_correction(self, fname, bitdepth, scale):
         with Image.open(fname) as image:
@@ -86,8 +197,7 @@ class PhaseManager(object):
         image_array = image_array / (2**bitdepth - 1) * 2 * np.pi * scale
         act_image_array = np.zeros((1024,1280))
         act_image_array[:,4:1276] = image_array 
-        self.additional = self.additional + act_image_array
-        self.add_log.append(["file_correction", fname])
+        return self.add_layer("file_correction", act_image_array, fname)
 
 
 
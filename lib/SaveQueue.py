@@ -0,0 +1,100 @@
+"""
+Writes saved calculations and additional phases from a background thread. The server copies the arrays into a
+snapshot (utils.snapshot_slm_calculation, utils.snapshot_add_phase), replies with the paths right away and the writer
+computes the far field, compresses and writes the files.
+
+Loading a file that is still being written waits for it, see wait_for.
+"""
+
+import threading
+import concurrent.futures
+import utils
+
+class SaveQueue(object):
+    def __init__(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.__lock = threading.Lock()
+        self.pending = dict() # base path -> future of the save
+        self.n_saved = 0
+        self.errors = [] # (paths, error) of failed saves
+
+    def submit(self, snapshot):
+        paths = [path for path in [snapshot["config_path"], snapshot["data_path"]] if path is not None]
+        base_path = self.base_path(paths)
+        future = self.executor.submit(self._write, paths, snapshot)
+        with self.__lock:
+            self.pending[base_path] = future
+        future.add_done_callback(lambda _: self._done(base_path, future))
+        return future
+
+    @staticmethod
+    def base_path(paths):
+        # the path without the _config.yml, _data.npz, _add_phase_data.npz... suffix
+        if len(paths) == 0:
+            return ""
+        path = paths[-1]
+        for suffix in ["_add_phase_data.npz", "_add_phase_config.yml", "_data.npz", "_data", "_config.yml"]:
+            if path.endswith(suffix):
+                return path[:-len(suffix)]
+        return path
+
+    def _write(self, paths, snapshot):
+        try:
+            utils.write_snapshot(snapshot)
+        except Exception as e:
+            print("Saving " + str(paths) + " failed: " + str(e))
+            with self.__lock:
+                self.errors.append((paths, str(e)))
+            raise
+
+    def _done(self, base_path, future):
+        with self.__lock:
+            if self.pending.get(base_path) is future:
+                del self.pending[base_path]
+            if future.exception() is None:
+                self.n_saved += 1
+
+    def wait_for(self, path, timeout=None):
+        """
+        Waits until the file with base path (or full path) path has been written, if it is being saved.
+
+        Returns:
+            False if the save is still running after timeout seconds, True otherwise.
+
+        """
+        with self.__lock:
+            future = self.pending.get(self.base_path([path]))
+        if future is None:
+            return True
+        try:
+            future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            return False
+        except Exception:
+            pass
+        return True
+
+    def flush(self, timeout=None):
+        """
+        Waits until every queued save has been written.
+
+        Returns:
+            The number of saves still pending after timeout seconds.
+
+        """
+        with self.__lock:
+            futures = list(self.pending.values())
+        concurrent.futures.wait(futures, timeout)
+        with self.__lock:
+            return len(self.pending)
+
+    def status(self):
+        with self.__lock:
+            rep = "pending: " + str(len(self.pending)) + " saved: " + str(self.n_saved) + " errors: " + str(len(self.errors))
+            if len(self.errors) > 0:
+                paths, error = self.errors[-1]
+                rep = rep + " last error: " + str(paths) + " " + error
+        return rep
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
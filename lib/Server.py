@@ -8,12 +8,26 @@ import PhaseManager
 import re
 import CorrectedSLM
 import Client
+import CommandRegistry
+import JobQueue
+import Diagnostics
+import FFTBackend
+import WarmStart
+import BatchCalculate
+import SaveQueue
+import PatternCache
+import PatternSequence
+import ArrayFrames
+import EarlyStopping
+from datetime import datetime
 from enum import Enum
 
 bDebugMode = 1
 
 class Server(object):
 
+    registry = CommandRegistry.CommandRegistry()
+
     class WorkerRequest(Enum):
         NoRequest = 0
         Stop = 1
@@ -32,6 +46,15 @@ class Server(object):
         self.__worker_lock = threading.Lock()
 
         self.feedback_client = None
+        self.fft = FFTBackend.NumpyFFT()
+        self.warm_start = None
+        self.warm_start_iters = None
+        self.batch_workers = None
+        self.stopping = EarlyStopping.StoppingCriteria()
+        # long commands submitted with submit_job run here, one at a time
+        self.jobs = JobQueue.JobQueue()
+        # held by handlers of commands using the hologram or the phase manager, see CommandRegistry
+        self.state_lock = threading.RLock()
 
         if "url" in config:
             url = config["url"]
@@ -41,6 +64,27 @@ class Server(object):
             self.pattern_path = config["pattern_path"]
         else:
             self.pattern_path = ""
+        if "save_format" in config:
+            # npz (compressed archive) or npy (directory of uncompressed arrays, memory mapped on load)
+            self.save_format = config["save_format"]
+        else:
+            self.save_format = "npz"
+        # saves are written by a background thread unless async_save is False
+        self.saves = SaveQueue.SaveQueue()
+        if "async_save" in config and not config["async_save"]:
+            self.saves = None
+        # decoded patterns kept in memory for use_pattern, 0 MB disables the cache
+        pattern_cache_mb = 512
+        if "pattern_cache_mb" in config:
+            pattern_cache_mb = config["pattern_cache_mb"]
+        self.pattern_cache = None
+        if pattern_cache_mb > 0:
+            self.pattern_cache = PatternCache.PatternCache(int(pattern_cache_mb * 2**20))
+        # pattern sequence stepped through with sequence_next / sequence_goto, with the next patterns prepared ahead
+        self.sequence = None
+        self.sequence_prefetch = 2
+        if "sequence_prefetch" in config:
+            self.sequence_prefetch = config["sequence_prefetch"]
         if "alg" in config:
             alg_dict = config["alg"]
             if "computational_space" in alg_dict:
@@ -51,6 +95,47 @@ class Server(object):
                 self.n_iterations = alg_dict["n_iterations"]
             else:
                 self.n_iterations = 20
+            if "fft" in alg_dict:
+                fft_workers = -1
+                if "fft_workers" in alg_dict:
+                    fft_workers = alg_dict["fft_workers"]
+                fft_wisdom = None
+                if "fft_wisdom" in alg_dict:
+                    fft_wisdom = alg_dict["fft_wisdom"]
+                self.fft = FFTBackend.get_backend(alg_dict["fft"], fft_workers, fft_wisdom)
+                FFTBackend.install(self.fft)
+            if "batch_workers" in alg_dict:
+                self.batch_workers = alg_dict["batch_workers"]
+            if "warm_start" in alg_dict and alg_dict["warm_start"]:
+                # seed calculations from saved ones with the same geometry, see WarmStart.py
+                max_residual = 0.5
+                if "warm_start_max_residual" in alg_dict:
+                    max_residual = alg_dict["warm_start_max_residual"]
+                self.warm_start = WarmStart.WarmStartIndex(self.pattern_path + "warm_start_index.yml", max_residual, self.wait_for_save)
+                if "warm_start_iterations" in alg_dict:
+                    self.warm_start_iters = alg_dict["warm_start_iterations"]
+            if "stopping" in alg_dict:
+                # criteria ending calculate before its number of iterations, see EarlyStopping.py
+                self.stopping = EarlyStopping.StoppingCriteria.from_dict(alg_dict["stopping"])
+        # In headless mode no figures are shown. Diagnostics are saved by a background thread if configured.
+        self.headless = False
+        if "headless" in config:
+            self.headless = config["headless"]
+        if self.headless:
+            import matplotlib
+            matplotlib.use("Agg")
+        self.diagnostics = None
+        if "diagnostics" in config:
+            diagnostics_config = config["diagnostics"]
+            if "path" in diagnostics_config:
+                diagnostics_path = diagnostics_config["path"]
+            else:
+                diagnostics_path = self.pattern_path
+            if "png" in diagnostics_config:
+                png = diagnostics_config["png"]
+            else:
+                png = False
+            self.diagnostics = Diagnostics.DiagnosticsWriter(diagnostics_path, png)
         if "feedback" in config:
             feedback_config = config["feedback"]
             if "url" in feedback_config:
@@ -85,6 +170,13 @@ class Server(object):
         self.__worker.start()
 
     def __del__(self):
+        self.jobs.shutdown()
+        if self.sequence is not None:
+            self.sequence.close()
+        if self.saves is not None:
+            self.saves.shutdown()
+        if self.diagnostics is not None:
+            self.diagnostics.shutdown()
         self.stop_worker()
         self.__sock.close()
         self.__ctx.destroy
@@ -106,76 +198,12 @@ class Server(object):
         self.__worker = threading.Thread(target = self.__worker_func)
         self.__worker.start()
 
-    def handle_msg(self, addr,  msg_str: str) -> bool:
-        # Method to handle different requests from external clients
-        if msg_str == "id":
-            msg_type, rep = self.reply_id()
-        elif msg_str == "use_pattern":
-            msg_type, rep = self.use_pattern()
-        elif msg_str == "calculate":
-            msg_type, rep = self.calculate()
-        elif msg_str == "init_hologram":
-            msg_type, rep = self.init_hologram()
-        elif msg_str == "save_calculation":
-            msg_type, rep = self.save_calculation()
-        elif msg_str == "add_fresnel_lens":
-            msg_type, rep = self.add_fresnel_lens()
-        elif msg_str == "add_offset":
-            msg_type, rep = self.add_offset()
-        elif msg_str == "add_zernike_poly":
-            msg_type, rep = self.add_zernike_poly()
-        elif msg_str == "reset_additional_phase":
-            msg_type, rep = self.reset_additional_phase()
-        elif msg_str == "reset_pattern":
-            msg_type, rep = self.reset_pattern()
-        elif msg_str == "save_additional_phase":
-            msg_type, rep = self.save_add_phase()
-        elif msg_str == "use_additional_phase":
-            msg_type, rep = self.use_add_phase()
-        elif msg_str == "use_correction":
-            msg_type, rep = self.use_correction()
-        elif msg_str == "add_pattern_to_add_phase":
-            msg_type, rep = self.add_pattern_to_add_phase()
-        elif msg_str == "use_slm_amp":
-            msg_type, rep = self.use_slm_amp()
-        elif msg_str == "use_aperture":
-            msg_type, rep = self.use_aperture()
-        elif msg_str == "reset_aperture":
-            msg_type, rep = self.reset_aperture()
-        elif msg_str == "project":
-            msg_type, rep = self.project()
-        elif msg_str == "get_current_phase_info":
-            msg_type, rep = self.get_current_phase_info()
-        elif msg_str == "perform_fourier_calibration":
-            msg_type, rep = self.perform_fourier_calibration()
-        elif msg_str == "save_fourier_calibration":
-            msg_type, rep = self.save_fourier_calibration()
-        elif msg_str == "load_fourier_calibration":
-            msg_type, rep = self.load_fourier_calibration()
-        elif msg_str == "get_fourier_calibration":
-            msg_type, rep = self.get_fourier_calibration()
-        elif msg_str == "perform_wavefront_calibration":
-            msg_type, rep = self.perform_wavefront_calibration()
-        elif msg_str == "save_wavefront_calibration":
-            msg_type, rep = self.save_wavefront_calibration()
-        elif msg_str == "load_wavefront_calibration":
-            msg_type, rep = self.load_wavefront_calibration()
-        elif msg_str == "get_wavefront_calibration":
-            msg_type, rep = self.get_wavefront_calibration()
-        elif msg_str == "perform_camera_feedback":
-            msg_type, rep = self.perform_camera_feedback()
-        elif msg_str == "perform_scan_feedback":
-            msg_type, rep = self.perform_scan_feedback()
-        elif msg_str == "get_base":
-            msg_type, rep = self.get_base()
-        elif msg_str == "get_additional_phase":
-            msg_type, rep = self.get_additional_phase()
-        else:
-            self.safe_send(addr, [1], [f''])
-            print("Unknown request " + msg_str)
-            return False
-        self.safe_send(addr, msg_type, rep)
-        return True
+    def handle_msg(self, addr, msg_str: str, frames) -> bool:
+        # Method to handle different requests from external clients. See the handlers registered below.
+        msg_type, rep = self.registry.dispatch(self, msg_str, frames)
+        if msg_type is not None:
+            self.safe_send(addr, msg_type, rep)
+        return msg_str in self.registry.commands
 
     def safe_receive(func):
         def f(self):
@@ -186,16 +214,6 @@ class Server(object):
             return  msg
         return f
 
-    def safe_process(func):
-        def f(self):
-            try:
-                msg_type, data = func(self)
-            except Exception as e:
-                msg_type = [1]
-                data = ['error: ' + str(e)]
-            return msg_type, data
-        return f
-
     @safe_receive
     def safe_recv(self):
         return self.__sock.recv(zmq.NOBLOCK)
@@ -204,12 +222,18 @@ class Server(object):
     def safe_recv_string(self):
         return self.__sock.recv_string(zmq.NOBLOCK)
 
+    def recv_frames(self):
+        # receive the remaining frames of the current message. Frames are not copied out of zmq, so that arrays sent
+        # with ArrayFrames are used in place.
+        frames = []
+        while self.__sock.getsockopt(zmq.RCVMORE):
+            frames.append(self.__sock.recv(zmq.NOBLOCK, copy=False))
+        return frames
+
     def finish_recv(func):
         def f(self, *args, **kwargs):
             # finish receiving messages
-            msg = self.safe_recv()
-            while msg is not None:
-                msg = self.safe_recv()
+            self.recv_frames()
             func(self, *args, **kwargs)
         return f
 
@@ -245,6 +269,8 @@ class Server(object):
             # worker function
             config = self.config
             iface = Interface.SLMSuiteInterface()
+            iface.warm_start = self.warm_start
+            iface.warm_start_iters = self.warm_start_iters
             if "slm" in config:
                 slm_dict = config["slm"]
                 slm_type = slm_dict["type"]
@@ -262,7 +288,18 @@ class Server(object):
             else:
                 raise Exception("Please specify an SLM with the slm field")
             self.phase_mgr = PhaseManager.PhaseManager(slm)
-            wrapped_slm = CorrectedSLM.CorrectedSLM(slm, self.phase_mgr)
+            lut_size = 4096
+            phase_response = None
+            if "lut_size" in slm_dict:
+                lut_size = slm_dict["lut_size"]
+            if "phase_response" in slm_dict:
+                # measured phase in radians of every grayscale level, as .npy or text
+                if slm_dict["phase_response"].endswith(".npy"):
+                    phase_response = np.load(slm_dict["phase_response"])
+                else:
+                    phase_response = np.loadtxt(slm_dict["phase_response"])
+            wrapped_slm = CorrectedSLM.CorrectedSLM(slm, self.phase_mgr, lut_size=lut_size, phase_response=phase_response)
+            self.wrapped_slm = wrapped_slm
             iface.set_SLM(wrapped_slm)
             if "camera" in config:
                 camera_dict = config["camera"]
@@ -297,14 +334,62 @@ class Server(object):
                 msg_str = self.safe_recv_string()
                 if msg_str is None:
                     self.safe_send(addr, [1], ["Send more"])
-                self.handle_msg(addr, msg_str)
+                    continue
+                self.handle_msg(addr, msg_str, self.recv_frames())
             print("Worker finishing")
         except Exception as e:
             print("Worker errored: " + str(e))
             if bDebugMode:
                 raise
 
-    @safe_process
+    @registry.command("list_commands")
+    def list_commands(self):
+        return [1], [self.registry.describe()]
+
+    @registry.command("submit_job", args=[1], varargs=True)
+    def submit_job(self, msg_str, *frames):
+        # runs the command msg_str with the remaining frames in the background and replies with a job id
+        cmd, args, error = self.registry.parse(msg_str, frames)
+        if error is not None:
+            return error
+        if not cmd.job:
+            return CommandRegistry.error_reply("not_a_job", msg_str + " cannot be run as a job")
+        job = self.jobs.submit(cmd.name, cmd.reply, self.registry.run, self, cmd, args, True)
+        return [1], [job.job_id]
+
+    @registry.command("job_status", args=[1], reply=[1, 1])
+    def job_status(self, job_id):
+        # status (queued, running, done, error or cancelled) and progress as yaml
+        job = self.jobs.get(job_id)
+        if job is None:
+            return CommandRegistry.error_reply("unknown_job", job_id, [1, 1])
+        progress = yaml.dump(job.get_progress(), default_flow_style=True).strip()
+        return [1, 1], [job.status(), progress]
+
+    @registry.command("job_result", args=[1])
+    def job_result(self, job_id):
+        # status followed by the reply of the command once the job has finished
+        job = self.jobs.get(job_id)
+        if job is None:
+            return CommandRegistry.error_reply("unknown_job", job_id)
+        result = job.result()
+        if result is None:
+            return [1], [job.status()]
+        msg_type, rep = result
+        return [1] + list(msg_type), [job.status()] + list(rep)
+
+    @registry.command("job_cancel", args=[1])
+    def job_cancel(self, job_id):
+        return [1], [self.jobs.cancel(job_id)]
+
+    def job_callback(self):
+        # optimization callback reporting progress to the job running this command, None outside of jobs
+        job = self.jobs.current_job()
+        if job is None:
+            return None
+        return job.progress_callback()
+
+    @registry.command("id")
     def reply_id(self):
         slm_config_str = "slm: " + self.config["slm"]["type"]
         camera_config_str = "camera: " + self.config["camera"]["type"]
@@ -312,27 +397,45 @@ class Server(object):
             slm_config_str = slm_config_str + " display " + str(self.config["slm"]["display_num"])
         return [1], [slm_config_str + " / " + camera_config_str]
 
-    @safe_process
-    def use_pattern(self):
-        fname = self.safe_recv_string()
+    @registry.command("use_pattern", args=[1], state=True)
+    def use_pattern(self, fname):
         print("Received " + fname)
         phase = self.load_pattern(fname)
         self.phase_mgr.set_base(phase, fname)
         return [1], ["ok"]
 
-    @safe_process
-    def use_add_phase(self):
-        fname = self.safe_recv_string()
+    @registry.command("use_pattern_data", args=[1, 0, 1], n_optional=1, state=True)
+    def use_pattern_data(self, header, data, name="from_data"):
+        # pattern sent as an array (see ArrayFrames) instead of a path
+        phase = self.phase_data(header, data)
+        self.phase_mgr.set_base(phase, name)
+        return [1], ["ok"]
+
+    @registry.command("add_phase_data", args=[1, 0, 1], n_optional=1, state=True)
+    def add_phase_data(self, header, data, description="from_data"):
+        phase = self.phase_data(header, data)
+        self.phase_mgr.add_layer("data", phase, description)
+        return [1], ["ok"]
+
+    def phase_data(self, header, data):
+        phase = ArrayFrames.from_frames(header, data)
+        if phase.shape != tuple(self.phase_mgr.shape):
+            raise Exception("phase has shape " + str(phase.shape) + ", the SLM is " + str(tuple(self.phase_mgr.shape)))
+        # float32 data is used as is, without copies, other types are converted once
+        return phase.astype(np.float32, copy=False)
+
+    @registry.command("use_additional_phase", args=[1], state=True)
+    def use_add_phase(self, fname):
         print("Received for add phase: " + fname)
         if re.match(r'[A-Z]:', fname) is None:
             # check to see if it's an absolute path
             fname = self.pattern_path + fname
+        self.wait_for_save(fname)
         self.phase_mgr.add_from_file(fname)
         return [1], ["ok"]
 
-    @safe_process
-    def use_correction(self):
-        fname = self.safe_recv_string()
+    @registry.command("use_correction", args=[1], state=True)
+    def use_correction(self, fname):
         print("Received correction pattern: " + fname)
         if self.config["slm"]["type"] == "hamamatsu":
             self.phase_mgr.add_correction(fname, self.config["slm"]["bitdepth"], 1)
@@ -340,23 +443,20 @@ class Server(object):
             self.phase_mgr.add_correction(fname, self.config["slm"]["bitdepth"], 1) #TODO, in case you need to scale.
         return [1], ["ok"]
 
-    @safe_process
-    def add_pattern_to_add_phase(self):
-        path = self.safe_recv_string()
-        print("Received " + fname)
+    @registry.command("add_pattern_to_add_phase", args=[1], state=True)
+    def add_pattern_to_add_phase(self, path):
+        print("Received " + path)
         if re.match(r'[A-Z]:', path) is None:
             # check to see if it's an absolute path
             path = self.pattern_path + path
+        self.wait_for_save(path)
         self.phase_mgr.add_pattern_to_additional(path)
         return [1], ["ok"]
 
-    @safe_process
-    def use_slm_amp(self):
-        func = self.safe_recv_string()
+    @registry.command("use_slm_amp", args=[1, 0, 0], n_optional=2, state=True)
+    def use_slm_amp(self, func, waist_x=None, waist_y=None):
         if func == "gaussian":
-            waist_x = self.safe_recv()
             waist_x = np.frombuffer(waist_x)
-            waist_y = self.safe_recv()
             waist_y = np.frombuffer(waist_y)
 
             shape = self.iface.slm.shape
@@ -372,77 +472,139 @@ class Server(object):
             print("Unknown amp type")
         return [1], ["ok"]
 
-    @safe_process
-    def use_aperture(self):
-        r = self.safe_recv()
+    @registry.command("use_aperture", args=[0], state=True)
+    def use_aperture(self, r):
         r = np.frombuffer(r)
-        self.phase_mgr.set_aperture(r)
+        # optional third element is the width of a soft edge in pixels
+        if len(r) > 2:
+            self.phase_mgr.set_aperture(r[:2], r[2])
+        else:
+            self.phase_mgr.set_aperture(r)
         return [1], ["ok"]
 
-    @safe_process
+    @registry.command("reset_aperture", state=True)
     def reset_aperture(self):
         self.phase_mgr.reset_aperture()
         return [1], ["ok"]
 
-    @safe_process
+    @registry.command("project", state=True)
     def project(self):
         self.iface.write_to_SLM(self.phase_mgr.base, self.phase_mgr.base_source)
         return [1], ["ok"]
 
-    @safe_process
-    def calculate(self):
-        target_data = self.safe_recv()
+    @registry.command("calculate", args=[0, 0, 0, 1, 1], n_optional=1, job=True, state=True)
+    def calculate(self, target_data, amp_data, iteration_data, phase_path, stopping_data=""):
         target_data = np.frombuffer(target_data)
         target_data = np.copy(target_data)
-        amp_data = self.safe_recv()
         amp_data = np.frombuffer(amp_data)
         amp_data = np.copy(amp_data)
-        iteration_data = self.safe_recv()
-        phase_path = self.safe_recv_string()
+        # optional yaml mapping of stopping criteria replacing those of the config for this calculation
+        stopping = self.stopping
+        if stopping_data != "":
+            try:
+                stopping = stopping.updated(yaml.safe_load(stopping_data))
+            except Exception as e:
+                return CommandRegistry.error_reply("bad_stopping", str(e), [1])
         #print(iteration_data)
-        iteration_number = int.from_bytes(iteration_data, 'little')
-        if iteration_number == 0:
-            iteration_number = self.n_iterations
+        iteration_number = stopping.n_iters(int.from_bytes(iteration_data, 'little'), self.n_iterations)
         ntargets = len(target_data) / 2
         if ntargets.is_integer():
             targets = np.reshape(target_data, (2, int(ntargets)))
             if phase_path == "":
-                self.iface.calculate(self.computational_space, targets, amp_data, n_iters=iteration_number)
+                self.iface.calculate(self.computational_space, targets, amp_data, n_iters=iteration_number, callback=self.job_callback(), stopping=stopping)
             else:
                 if re.match(r'[A-Z]:', phase_path) is None:
                     # check to see if it's an absolute path
                     phase_path = self.pattern_path + phase_path
+                self.wait_for_save(phase_path)
                 _,data = utils.load_slm_calculation(phase_path, 1, 1)
                 slm_phase = None
                 if "raw_slm_phase" in data:
                     slm_phase = data["raw_slm_phase"]
                 else:
-                    return "Cannot initiate the phase, since it was not saved"
-                self.iface.calculate(self.computational_space, targets, amp_data, n_iters=iteration_number, phase=slm_phase)
+                    return [1], ["error: cannot initiate the phase, since it was not saved"]
+                self.iface.calculate(self.computational_space, targets, amp_data, n_iters=iteration_number, phase=slm_phase, callback=self.job_callback(), stopping=stopping)
 
             #self.iface.calculate(self.computational_space, targets, amp_data, n_iters=self.n_iterations)
             # for debug
-            self.iface.plot_slmplane()
-            self.iface.plot_farfield()
-            self.iface.plot_stats()
+            if not self.headless:
+                self.iface.plot_slmplane()
+                self.iface.plot_farfield()
+                self.iface.plot_stats()
+            self.save_diagnostics("calculate")
+            self.fft.save_wisdom()
             return [1], ["ok"]
         else:
             print("Not integer number of targets")
             return [1], ["error: not integer number of targets"]
 
-    @safe_process
-    def init_hologram(self):
-        path = self.safe_recv_string()
+    @registry.command("get_calculation_info")
+    def get_calculation_info(self):
+        # how the last calculate stopped, as yaml
+        return [1], [yaml.dump(self.iface.calculation_info, default_flow_style=True).strip()]
+
+    @registry.command("calculate_batch", args=[0, 0, 0, 0, 1, 1], job=True)
+    def calculate_batch(self, count_data, target_data, amp_data, iteration_data, save_path, save_name):
+        # count_data holds the number of targets of each pattern. The targets of all patterns are concatenated, as
+        # 2 x total, and so are the amps. Patterns are saved as save_name_<index>.
+        counts = np.frombuffer(count_data).astype(int)
+        target_data = np.frombuffer(target_data)
+        amp_data = np.frombuffer(amp_data)
+        iteration_number = int.from_bytes(iteration_data, 'little')
+        if iteration_number == 0:
+            iteration_number = self.n_iterations
+        total = int(np.sum(counts))
+        if len(target_data) != 2 * total or len(amp_data) != total:
+            return [1], ["error: " + str(total) + " targets in the counts, got " + str(len(target_data) / 2) + " targets and " + str(len(amp_data)) + " amps"]
+        targets = np.reshape(target_data, (2, total))
+        splits = np.cumsum(counts)[:-1]
+        targets_list = np.split(targets, splits, axis=1)
+        amps_list = np.split(np.copy(amp_data), splits)
+        if re.match(r'[A-Z]:', save_path) is None:
+            # check to see if it's an absolute path
+            save_path = self.pattern_path + save_path
+        save_options = dict()
+        save_options["config"] = True
+        save_options["slm_pattern"] = True
+        save_options["ff_pattern"] = True
+        save_options["target"] = True
+        save_options["path"] = save_path
+        save_options["name"] = save_name
+        save_options["crop"] = True
+        save_options["format"] = self.save_format
+        save_options["prefix"] = datetime.now().strftime("%Y%m%d_%H%M%S") # same prefix for the whole batch
+        tasks = self.iface.batch_tasks(self.computational_space, targets_list, amps_list, iteration_number, save_options)
+
+        job = self.jobs.current_job()
+        finished = []
+        def on_result(result):
+            finished.append(result)
+            if job is not None:
+                job.set_progress(finished=len(finished), n=len(tasks), results=list(finished))
+        cancelled = job.cancelled if job is not None else None
+        results = BatchCalculate.calculate_batch(tasks, self.batch_workers, self.fft.name, on_result, cancelled)
+        for result in results:
+            if result is not None and "data" in result and self.warm_start is not None:
+                task = tasks[result["index"]]
+                self.warm_start.add(utils.calculation_base_path(result["data"]), task[3], task[4], self.computational_space, self.iface.fourier_calibration_source)
+        return [1], [yaml.dump([result for result in results if result is not None], default_flow_style=None)]
+
+    def save_diagnostics(self, name):
+        # queues the current hologram for the diagnostics writer, which computes the far field and saves it in the background
+        if self.diagnostics is not None:
+            self.diagnostics.save(name, self.iface.get_diagnostics(), process=self.iface.farfield_diagnostics)
+
+    @registry.command("init_hologram", args=[1], state=True)
+    def init_hologram(self, path):
         if re.match(r'[A-Z]:', path) is None:
             # check to see if it's an absolute path
             path = self.pattern_path + path
+        self.wait_for_save(path)
         msg = self.iface.init_hologram(path, self.computational_space)
         return [1], [msg]
 
-    @safe_process
-    def save_calculation(self):
-        save_path = self.safe_recv_string()
-        save_name = self.safe_recv_string()
+    @registry.command("save_calculation", args=[1, 1, 1], reply=[1, 1], n_optional=1, state=True)
+    def save_calculation(self, save_path, save_name, save_format=""):
         if re.match(r'[A-Z]:', save_path) is None:
             # check to see if it's an absolute path
             save_path = self.pattern_path + save_path
@@ -454,13 +616,12 @@ class Server(object):
         save_options["path"] = save_path # Enable this to save to a desired path. By default it is the current working directory
         save_options["name"] = save_name # This name will be used in the path.
         save_options["crop"] = True # This option crops the slm pattern to the slm, instead of an array the shape of the computational space size.
-        config_path, pattern_path, err = self.iface.save_calculation(save_options)
+        save_options["format"] = save_format if save_format != "" else self.save_format # npz or npy, see utils.save_slm_calculation
+        config_path, pattern_path, err = self.iface.save_calculation(save_options, saver=self.saves)
         return [1,1], [config_path, pattern_path]
 
-    @safe_process
-    def save_add_phase(self):
-        save_path = self.safe_recv_string()
-        save_name = self.safe_recv_string()
+    @registry.command("save_additional_phase", args=[1, 1], reply=[1, 1], state=True)
+    def save_add_phase(self, save_path, save_name):
         if re.match(r'[A-Z]:', save_path) is None:
             # check to see if it's an absolute path
             save_path = self.pattern_path + save_path
@@ -469,19 +630,109 @@ class Server(object):
         save_options["phase"] = True # saves the actual phase
         save_options["path"] = save_path # Enable this to save to a desired path. By default it is the current working directory
         save_options["name"] = save_name # This name will be used in the path.
-        config_path, pattern_path = self.phase_mgr.save_to_file(save_options)
+        if self.saves is None:
+            config_path, pattern_path = self.phase_mgr.save_to_file(save_options)
+        else:
+            snapshot, config_path, pattern_path = utils.snapshot_add_phase(self.phase_mgr, save_options)
+            self.saves.submit(snapshot)
         return [1,1], [config_path, pattern_path]
 
+    @registry.command("flush_saves", args=[0], n_optional=1)
+    def flush_saves(self, timeout=None):
+        # waits for the background saves, at most timeout seconds if given
+        if self.saves is None:
+            return [1], ["ok"]
+        if timeout is not None:
+            timeout = np.frombuffer(timeout)[0]
+        n_pending = self.saves.flush(timeout)
+        if n_pending > 0:
+            return [1], ["pending: " + str(n_pending)]
+        return [1], ["ok"]
+
+    @registry.command("save_status")
+    def save_status(self):
+        if self.saves is None:
+            return [1], ["pending: 0 (saves are synchronous)"]
+        return [1], [self.saves.status()]
+
+    def wait_for_save(self, path):
+        # files still being written in the background are waited for before loading them
+        if self.saves is not None:
+            self.saves.wait_for(path)
+
     def load_pattern(self, path):
         if re.match(r'[A-Z]:', path) is None:
             # check to see if it's an absolute path
             path = self.pattern_path + path
+        self.wait_for_save(path)
+        if self.pattern_cache is not None:
+            return self.pattern_cache.get(path)
         _,data = utils.load_slm_calculation(path, 0, 1)
-        return data["slm_phase"]
+        # a copy, so that the file is not kept memory mapped (and locked on Windows) while the pattern is in use
+        return np.array(data["slm_phase"], dtype=np.float32)
+
+    @registry.command("preload_patterns", args=[1])
+    def preload_patterns(self, paths):
+        # loads patterns (paths separated by semicolons) into the pattern cache before they are used
+        if self.pattern_cache is None:
+            return [1], ["error: the pattern cache is disabled"]
+        failed = []
+        for path in paths.split(';'):
+            if path == "":
+                continue
+            try:
+                self.load_pattern(path)
+            except Exception as e:
+                failed.append(path + ": " + str(e))
+        if len(failed) > 0:
+            return [1], ["error: could not load " + "; ".join(failed)]
+        return [1], ["ok"]
+
+    @registry.command("get_pattern_cache_stats")
+    def get_pattern_cache_stats(self):
+        if self.pattern_cache is None:
+            return [1], ["disabled"]
+        return [1], [self.pattern_cache.stats()]
+
+    @registry.command("clear_pattern_cache")
+    def clear_pattern_cache(self):
+        if self.pattern_cache is not None:
+            self.pattern_cache.clear()
+        return [1], ["ok"]
 
-    @safe_process
-    def add_fresnel_lens(self):
-        focal_length = self.safe_recv()
+    @registry.command("set_sequence", args=[1], state=True)
+    def set_sequence(self, paths):
+        # ordered pattern paths separated by semicolons. Nothing is displayed until sequence_next or sequence_goto.
+        paths = [path for path in paths.split(';') if path != ""]
+        if len(paths) == 0:
+            return [1], ["error: empty sequence"]
+        if self.sequence is not None:
+            self.sequence.close()
+        self.sequence = PatternSequence.PatternSequence(self.wrapped_slm, self.load_pattern, paths, self.sequence_prefetch)
+        return [1], ["ok"]
+
+    @registry.command("sequence_next", state=True)
+    def sequence_next(self):
+        if self.sequence is None:
+            return [1], ["error: no sequence"]
+        self.sequence.next(settle=True)
+        return [1], [str(self.sequence.index)]
+
+    @registry.command("sequence_goto", args=[0], state=True)
+    def sequence_goto(self, index_data):
+        if self.sequence is None:
+            return [1], ["error: no sequence"]
+        self.sequence.goto(int.from_bytes(index_data, 'little', signed=True), settle=True)
+        return [1], [str(self.sequence.index)]
+
+    @registry.command("get_sequence_info")
+    def get_sequence_info(self):
+        if self.sequence is None:
+            return [1], ["no sequence"]
+        return [1], [self.sequence.info()]
+
+    @registry.command("add_fresnel_lens", args=[0], state=True)
+    def add_fresnel_lens(self, focal_length):
         focal_length = np.frombuffer(focal_length)
         #phase, _ = self.iface.get_lens_phase(focal_length[0])
         #if self.additional_phase is None:
@@ -495,18 +746,16 @@ class Server(object):
         return [1], ["ok"]
     
     
-    @safe_process
-    def add_offset(self):
-        offset = self.safe_recv()
+    @registry.command("add_offset", args=[0], state=True)
+    def add_offset(self, offset):
         offset_data = np.frombuffer(offset)
         offset_data = np.copy(offset_data)
         self.phase_mgr.add_offset(offset_data)
         return [1], ["ok"]
 
 
-    @safe_process
-    def add_zernike_poly(self):
-        poly_arr = self.safe_recv()
+    @registry.command("add_zernike_poly", args=[0], state=True)
+    def add_zernike_poly(self, poly_arr):
         poly_arr = np.frombuffer(poly_arr)
         npolys = len(poly_arr) / 3
         poly_arr = np.reshape(poly_arr, (int(npolys), 3))
@@ -521,17 +770,17 @@ class Server(object):
         #    self.additional_phase = self.additional_phase + phase
         return [1], ["ok"]
 
-    @safe_process
+    @registry.command("reset_additional_phase", state=True)
     def reset_additional_phase(self):
         self.phase_mgr.reset_additional()
         return [1], ["ok"]
 
-    @safe_process
+    @registry.command("reset_pattern", state=True)
     def reset_pattern(self):
         self.phase_mgr.reset_base()
         return [1], ["ok"]
 
-    @safe_process
+    @registry.command("get_current_phase_info")
     def get_current_phase_info(self):
         base_str = "base: " + self.phase_mgr.base_source
         add_str = " additional: "
@@ -540,99 +789,113 @@ class Server(object):
             add_str = add_str + str(item[0]) + ":" + str(item[1]) + ","
         aperture = self.phase_mgr.aperture
         aperture_str = " aperture: " + str(aperture)
+        if self.phase_mgr.aperture_edge > 0:
+            aperture_str = aperture_str + " edge: " + str(self.phase_mgr.aperture_edge)
         return [1], [base_str + add_str + aperture_str]
 
-    @safe_process
+    @registry.command("get_base")
     def get_base(self):
         return [1], [self.phase_mgr.base_source]
 
-    @safe_process
+    @registry.command("get_additional_phase")
     def get_additional_phase(self):
         rep = ""
         log = self.phase_mgr.add_log
         for item in log:
             rep = rep + str(item[0]) + ";" + str(item[1]) + ";"
         return [1], [rep]
+
+    @registry.command("get_write_stats")
+    def get_write_stats(self):
+        n_writes, n_skipped = self.wrapped_slm.get_write_stats()
+        return [1], ["writes: " + str(n_writes) + " skipped: " + str(n_skipped)]
+
+    @registry.command("get_layers")
+    def get_layers(self):
+        rep = ""
+        for name, kind, description, enabled in self.phase_mgr.get_layers():
+            rep = rep + name + ";" + kind + ";" + description + ";" + str(int(enabled)) + ";"
+        return [1], [rep]
+
+    @registry.command("set_layer_enabled", args=[1, 0], state=True)
+    def set_layer_enabled(self, name, enabled):
+        enabled = bool(int.from_bytes(enabled, 'little'))
+        self.phase_mgr.set_layer_enabled(name, enabled)
+        return [1], ["ok"]
+
+    @registry.command("remove_layer", args=[1], state=True)
+    def remove_layer(self, name):
+        self.phase_mgr.remove_layer(name)
+        return [1], ["ok"]
         
-    @safe_process
-    def perform_fourier_calibration(self):
-        shape = self.safe_recv()
+    @registry.command("perform_fourier_calibration", args=[0, 0], job=True, state=True)
+    def perform_fourier_calibration(self, shape, pitch):
         shape_data = np.frombuffer(shape)
         shape_data= np.copy(shape_data)
-        pitch = self.safe_recv()
         pitch_data = np.frombuffer(pitch)
         pitch_data = np.copy(pitch_data)
-        self.iface.perform_fourier_calibration(shape_data, pitch_data)
+        self.iface.perform_fourier_calibration(shape_data, pitch_data, plot=not self.headless)
         return [1], ["ok"]
 
-    @safe_process
-    def save_fourier_calibration(self):
-        save_path = self.safe_recv_string()
-        save_name = self.safe_recv_string()
+    @registry.command("save_fourier_calibration", args=[1, 1])
+    def save_fourier_calibration(self, save_path, save_name):
         _, path = self.iface.save_fourier_calibration(save_path, save_name)
         return [1], [path]
 
-    @safe_process
-    def load_fourier_calibration(self):
-        path = self.safe_recv_string()
+    @registry.command("load_fourier_calibration", args=[1], state=True)
+    def load_fourier_calibration(self, path):
         self.iface.load_fourier_calibration(path)
         return [1], ["ok"]
 
-    @safe_process
+    @registry.command("get_fourier_calibration")
     def get_fourier_calibration(self):
         return [1], [self.iface.fourier_calibration_source]
 
-    @safe_process
-    def perform_wavefront_calibration(self):
-        interference_point = self.safe_recv()
+    @registry.command("perform_wavefront_calibration", args=[0, 0, 0], job=True, state=True)
+    def perform_wavefront_calibration(self, interference_point, field_point, test_super_pixel):
         interference_point_data = np.frombuffer(interference_point)
         interference_point_data= np.copy(interference_point_data)
-        field_point = self.safe_recv()
         field_point_data = np.frombuffer(field_point)
         field_point_data = np.copy(field_point_data)
-        test_super_pixel = self.safe_recv()
-        test_super_pixel_data = np.frombuffer(test_super_pixel_data)
+        test_super_pixel_data = np.frombuffer(test_super_pixel)
         test_super_pixel_data = np.copy(test_super_pixel_data)
         if test_super_pixel_data[0] == -1:
             test_super_pixel_data = None
         self.iface.perform_wavefront_calibration(interference_point_data, field_point_data,test_super_pixel_data)
         return [1], ["ok"]
 
-    @safe_process
-    def save_wavefront_calibration(self):
-        save_path = self.safe_recv_string()
-        save_name = self.safe_recv_string()
+    @registry.command("save_wavefront_calibration", args=[1, 1])
+    def save_wavefront_calibration(self, save_path, save_name):
         _, path = self.iface.save_wavefront_calibration(save_path, save_name)
         return [1], [path]
 
-    @safe_process
-    def load_wavefront_calibration(self):
-        path = self.safe_recv_string()
+    @registry.command("load_wavefront_calibration", args=[1], state=True)
+    def load_wavefront_calibration(self, path):
         self.iface.load_wavefront_calibration(path)
         return [1], ["ok"]
-    @safe_process
+    @registry.command("get_wavefront_calibration")
     def get_wavefront_calibration(self):
         return [1], [self.iface.wavefront_calibration_source]
 
 
-    @safe_process
-    def perform_camera_feedback(self):
-        niters = self.safe_recv()
+    @registry.command("perform_camera_feedback", args=[0], job=True, state=True)
+    def perform_camera_feedback(self, niters):
         niters = int.from_bytes(niters, 'little')
-        _, msg = self.iface.perform_camera_feedback(niters)
+        _, msg = self.iface.perform_camera_feedback(niters, callback=self.job_callback(), plot=not self.headless)
+        self.save_diagnostics("camera_feedback")
         return [1], [msg]
 
-    #@safe_process
-    def perform_scan_feedback(self):
+    @registry.command("perform_scan_feedback", args=[0, 0, 0], n_optional=1, job=True, state=True)
+    def perform_scan_feedback(self, niters, NumPerParamAvg, pipeline=b'\x00'):
         if self.feedback_client is None:
             return [1], ["No feedback client on server."]
         else:
-            niters = self.safe_recv()
             niters = int.from_bytes(niters, 'little')
-            NumPerParamAvg = self.safe_recv()
-            NumPerParamAvg = int.from_bytes(NumPerParamAvg, 'little')
+            NumPerParamAvg = int.from_bytes(NumPerParamAvg, 'little', signed=True)
             if NumPerParamAvg != -1:
                 self.feedback_client.NumPerParamAvg = NumPerParamAvg
-            _, msg = self.iface.perform_scan_feedback(niters, self.feedback_client)
+            pipeline = int.from_bytes(pipeline, 'little')
+            _, msg = self.iface.perform_scan_feedback(niters, self.feedback_client, callback=self.job_callback(), plot=not self.headless, pipeline=pipeline)
+            self.save_diagnostics("scan_feedback")
             return [1], [msg]
 
@@ -0,0 +1,126 @@
+"""
+Extracts the spots of camera frames for experimental feedback.
+
+The windows around all spots are turned once into a flat list of pixel indices, with a weight per pixel, stored spot
+after spot. A frame is then read with one gather (img.ravel()[index]) and the windows are summed with one
+np.add.reduceat, so the work per frame is proportional to the number of spots times the window size and has no loop
+over spots. Pixels of windows that stick out of the frame are clipped to the edge and given a weight of 0.
+"""
+
+import numpy as np
+
+class SpotExtractor(object):
+    default_width = 5 # pixels, for holograms without an integration width, see from_hologram
+    def __init__(self, centers, size, shape, background=None):
+        """
+        Args:
+            centers: 2 x N array of the x and y centers of the spots in camera pixels.
+            size: Width, or (width, height), of the windows in pixels.
+            shape: (height, width) of the frames.
+            background: See set_background.
+
+        """
+        centers = np.asarray(centers, dtype=float).reshape(2, -1)
+        size = np.broadcast_to(np.asarray(size, dtype=int), (2,))
+        self.shape = tuple(int(n) for n in shape)
+        self.size = (int(size[0]), int(size[1]))
+        self.n_spots = centers.shape[1]
+        self.centers = np.rint(centers).astype(int)
+        n_pixels = self.size[0] * self.size[1]
+        # offsets of the pixels of a window from its center, in row major order
+        dx = np.tile(np.arange(self.size[0]) - self.size[0] // 2, self.size[1])
+        dy = np.repeat(np.arange(self.size[1]) - self.size[1] // 2, self.size[0])
+        cols = self.centers[0][:, np.newaxis] + dx[np.newaxis, :]
+        rows = self.centers[1][:, np.newaxis] + dy[np.newaxis, :]
+        inside = (cols >= 0) & (cols < self.shape[1]) & (rows >= 0) & (rows < self.shape[0])
+        cols = np.clip(cols, 0, self.shape[1] - 1)
+        rows = np.clip(rows, 0, self.shape[0] - 1)
+        self.index = (rows * self.shape[1] + cols).ravel()
+        self.weights = inside.astype(np.float64).ravel()
+        self.dx = np.tile(dx, self.n_spots).astype(np.float64)
+        self.dy = np.tile(dy, self.n_spots).astype(np.float64)
+        self.offsets = np.arange(self.n_spots) * n_pixels
+        self.set_background(background)
+
+    @classmethod
+    def from_hologram(cls, hologram, shape):
+        """
+        Windows of the experimental feedback of a SpotHologram, at its spots in camera pixels. Without an
+        integration width, the windows are default_width wide, or narrower if the spots are closer, as slmsuite
+        limits its own width to the spot spacing over 1.5 (and at least 3 pixels).
+
+        Raises:
+            Exception if the spots of the hologram are not located on the camera.
+
+        """
+        spot_ij = getattr(hologram, "spot_ij", None)
+        if spot_ij is None:
+            raise Exception("The spots of the hologram are not located on the camera, is the Fourier calibration loaded?")
+        spot_ij = np.asarray(spot_ij, dtype=float).reshape(2, -1)
+        width = getattr(hologram, "spot_integration_width_ij", None)
+        if width is None:
+            width = cls.default_width
+            if spot_ij.shape[1] > 1:
+                dist = np.sqrt(np.sum(np.square(spot_ij[:, :, np.newaxis] - spot_ij[:, np.newaxis, :]), axis=0))
+                dist[np.diag_indices_from(dist)] = np.inf
+                width = min(width, max(np.min(dist) / 1.5, 3))
+            width = int(2 * np.floor(width / 2) + 1)
+        return cls(spot_ij, width, shape)
+
+    def set_background(self, background):
+        """
+        Sets what is subtracted from every pixel before summing: None, a number, or a frame (e.g. taken with the
+        SLM off). Only the pixels in the windows of a background frame are kept.
+        """
+        if background is None or np.isscalar(background):
+            self.background = 0.0 if background is None else float(background)
+        else:
+            self.background = np.asarray(background, dtype=np.float64).ravel()[self.index]
+
+    def gather(self, img):
+        # weighted, background subtracted pixels of all windows, spot after spot
+        values = np.asarray(img).ravel()[self.index].astype(np.float64)
+        values -= self.background
+        values *= self.weights
+        return values
+
+    def windows(self, img):
+        """
+        Returns:
+            The windows of img, as is, stacked in an N x height x width array.
+
+        """
+        return np.asarray(img).ravel()[self.index].reshape(self.n_spots, self.size[1], self.size[0])
+
+    def sums(self, img):
+        """
+        Returns:
+            The integrated intensity in each window.
+
+        """
+        if self.n_spots == 0:
+            return np.zeros(0)
+        return np.add.reduceat(self.gather(img), self.offsets)
+
+    def amps(self, img):
+        """
+        Returns:
+            The amplitude of each spot, the square root of its integrated intensity.
+
+        """
+        return np.sqrt(np.maximum(self.sums(img), 0))
+
+    def centroids(self, img):
+        """
+        Returns:
+            2 x N array of the x and y centers of mass of the windows, in camera pixels.
+
+        """
+        if self.n_spots == 0:
+            return np.zeros((2, 0))
+        values = self.gather(img)
+        sums = np.add.reduceat(values, self.offsets)
+        sums[sums == 0] = np.nan
+        x = self.centers[0] + np.add.reduceat(values * self.dx, self.offsets) / sums
+        y = self.centers[1] + np.add.reduceat(values * self.dy, self.offsets) / sums
+        return np.array([x, y])
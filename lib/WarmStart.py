@@ -0,0 +1,135 @@
+"""
+Index of saved calculations used to warm start new ones. Arrays we calculate are often the same geometry as a saved
+one, shifted by a few pixels. Starting from the saved phase instead of a random one, the optimization converges in a
+handful of iterations.
+
+The index is a yaml file next to the patterns. Each entry holds the base path of a saved calculation (as passed to
+utils.load_slm_calculation), the spots in computational space pixels (spot_knm, so that matching does not depend on
+the basis or on the camera calibration), the spot amplitudes, the computational shape and the fourier calibration
+source at the time of the calculation.
+
+A translation of all the spots by d pixels in the far field is a phase ramp 2 pi (d_x x / N_x + d_y y / N_y) on the
+near field, so the saved phase is seeded with that blaze added.
+"""
+
+import os
+import yaml
+import numpy as np
+import utils
+
+class WarmStartIndex(object):
+    def __init__(self, index_path, max_residual=0.5, wait_for_save=None):
+        """
+        Args:
+            index_path: Path of the yaml index. Created on the first add if it does not exist.
+            max_residual: Largest rms distance in pixels between the spots of a saved calculation, once translated,
+                and the new spots, for the saved phase to be used as a seed.
+            wait_for_save: Function called with the base path of a calculation before it is loaded, which returns
+                once the file is written. Calculations are added to the index when they are saved, which may still
+                be running in the background (see SaveQueue).
+
+        """
+        self.index_path = index_path
+        self.max_residual = max_residual
+        self.wait_for_save = wait_for_save
+        self.entries = []
+        self._mtime = None
+        self._load()
+
+    def _load(self):
+        # reload if another server wrote to the index since the last read
+        if not os.path.exists(self.index_path):
+            return
+        mtime = os.path.getmtime(self.index_path)
+        if mtime == self._mtime:
+            return
+        with open(self.index_path, 'r') as fhdl:
+            entries = yaml.load(fhdl, Loader=yaml.FullLoader)
+        self.entries = entries if entries is not None else []
+        self._mtime = mtime
+
+    def add(self, base_path, spot_knm, spot_amp, shape, calibration=""):
+        """
+        Adds a saved calculation to the index and writes the index. Replaces an existing entry with the same path.
+        """
+        self._load()
+        entry = dict()
+        entry["path"] = base_path
+        entry["spots"] = np.asarray(spot_knm, dtype=float).tolist()
+        entry["amps"] = np.asarray(spot_amp, dtype=float).ravel().tolist()
+        entry["shape"] = [int(n) for n in shape]
+        entry["calibration"] = calibration
+        self.entries = [e for e in self.entries if e["path"] != base_path]
+        self.entries.append(entry)
+        with open(self.index_path, 'w') as fhdl:
+            yaml.dump(self.entries, fhdl, default_flow_style=None)
+        self._mtime = os.path.getmtime(self.index_path)
+
+    def find(self, spot_knm, shape, calibration=""):
+        """
+        Finds the saved calculation with the same number of spots and computational shape whose spots are closest to
+        spot_knm up to a translation. Calculations with the same calibration are preferred on ties.
+
+        Returns:
+            (entry, shift, residual) with shift the translation in pixels from the saved spots to spot_knm, or
+            (None, None, None) if no calculation is within max_residual.
+
+        """
+        self._load()
+        spots = _sort_spots(np.asarray(spot_knm, dtype=float))
+        best = (None, None, None)
+        best_key = None
+        for entry in self.entries:
+            if list(entry["shape"]) != [int(n) for n in shape]:
+                continue
+            saved = np.asarray(entry["spots"], dtype=float)
+            if saved.shape != spots.shape:
+                continue
+            diff = spots - _sort_spots(saved)
+            shift = np.mean(diff, axis=1)
+            residual = np.sqrt(np.mean(np.sum(np.square(diff - shift[:, np.newaxis]), axis=0)))
+            if residual > self.max_residual:
+                continue
+            key = (round(residual, 6), entry["calibration"] != calibration)
+            if best_key is None or key < best_key:
+                best = (entry, shift, residual)
+                best_key = key
+        return best
+
+    def seed_phase(self, spot_knm, shape, calibration=""):
+        """
+        Returns:
+            (phase, path) with the phase of the nearest saved calculation translated onto spot_knm, or (None, None) if
+            there is none.
+
+        """
+        entry, shift, _ = self.find(spot_knm, shape, calibration)
+        if entry is None:
+            return None, None
+        try:
+            if self.wait_for_save is not None:
+                self.wait_for_save(entry["path"])
+            _, data = utils.load_slm_calculation(entry["path"], 0, 1)
+            if "raw_slm_phase" not in data:
+                return None, None
+            phase = np.array(data["raw_slm_phase"], dtype=float)
+        except Exception as e:
+            print("Warm start from " + entry["path"] + " failed: " + str(e))
+            return None, None
+        if np.any(shift != 0):
+            phase = phase + blaze(phase.shape, shift, shape)
+        return phase, entry["path"]
+
+def blaze(phase_shape, shift, shape):
+    """
+    Phase ramp over a near field of phase_shape which translates the far field of a computational space of shape by
+    shift = (x, y) pixels.
+    """
+    y = np.arange(phase_shape[0]) - phase_shape[0] / 2
+    x = np.arange(phase_shape[1]) - phase_shape[1] / 2
+    return 2 * np.pi * (shift[0] * x[np.newaxis, :] / shape[1] + shift[1] * y[:, np.newaxis] / shape[0])
+
+def _sort_spots(spots):
+    # order spots by y then x so that the same array matches regardless of the order it was given in. A translation
+    # keeps this order.
+    return spots[:, np.lexsort((spots[0], spots[1]))]
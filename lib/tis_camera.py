@@ -8,6 +8,8 @@ Please either install tisgrabber.py or have it in your current working directory
 """
 
 import ctypes
+import threading
+import time
 import tisgrabber as tis
 import numpy as np
 from slmsuite.hardware.cameras.camera import Camera
@@ -31,6 +33,8 @@ class TISCamera(Camera):
         The height of the current region of interest. Cached for convenience and also changes when roi changes.
     vid_format :
         Caches the video format currently set by the user if known.
+    frames :
+        Ring buffer of the last frames delivered by the camera, which is kept in live mode. See :meth:`get_image`.
     """
     sdk = None
 
@@ -89,6 +93,7 @@ class TISCamera(Camera):
         serial="",
         vid_format=None,
         verbose=True,
+        n_buffers=4,
         **kwargs
     ):
         """
@@ -102,6 +107,8 @@ class TISCamera(Camera):
             If None, no format is set and will default to whatever the camera is currently. See tisgrabber.h for more information. Example "Y800 (2592x1944)"
         verbose : bool
             Whether or not to print extra information.
+        n_buffers : int
+            Number of frames kept in the ring buffer.
         kwargs
             See :meth:`.Camera.__init__` for permissible options.
         """
@@ -156,11 +163,45 @@ class TISCamera(Camera):
             **kwargs
         )
 
-        # ... Other setup.
+        # The camera stays in live mode and every frame is copied into a ring buffer by _frame_ready.
+        self.n_buffers = n_buffers
+        self.frame_cond = threading.Condition()
+        self.frame_count = 0 # number of frames received
+        self.min_frame = 0 # frames before this one were discarded by flush
+        self._alloc_frames()
+        # keep a reference to the callback, ctypes does not
+        self._frame_ready_cb = tis.FRAMEREADYCALLBACK(self._frame_ready)
+        TISCamera.safe_call(TISCamera.sdk.IC_SetFrameReadyCallback, 1, self.cam, self._frame_ready_cb, None)
+        TISCamera.safe_call(TISCamera.sdk.IC_SetContinuousMode, 1, self.cam, 0)
+        self._start_live()
+
+    def _alloc_frames(self):
+        with self.frame_cond:
+            self.frames = np.zeros((self.n_buffers, self.height, self.width), dtype=np.uint8)
+            self.frame_times = np.zeros(self.n_buffers)
+            self.min_frame = self.frame_count
+
+    def _start_live(self):
+        TISCamera.safe_call(TISCamera.sdk.IC_StartLive, 1, self.cam, 0)
+
+    def _stop_live(self):
+        TISCamera.safe_call(TISCamera.sdk.IC_StopLive, 0, self.cam)
+
+    def _frame_ready(self, grabber, buffer, frame_number, data):
+        # Called by the SDK from its own thread for every frame.
+        img = np.ctypeslib.as_array(buffer, shape=(self.height, self.width, 3)) # 3 for RGB
+        with self.frame_cond:
+            idx = self.frame_count % self.n_buffers
+            # We take only the 1st component, assuming that the image is monochromatic.
+            np.copyto(self.frames[idx], img[:, :, 0])
+            self.frame_times[idx] = time.time()
+            self.frame_count += 1
+            self.frame_cond.notify_all()
 
     def close(self):
         """See :meth:`.Camera.close`."""
-        TISCamera.safe_call(TISCamera.sdk.IC_ReleaseGrabber, self.cam)
+        self._stop_live()
+        TISCamera.safe_call(TISCamera.sdk.IC_ReleaseGrabber, 0, self.cam)
         del self.cam
 
     @staticmethod
@@ -213,7 +254,7 @@ class TISCamera(Camera):
             bitsPerPixel=ctypes.c_int()
             COLORFORMAT=ctypes.c_int()
 
-            TISCamera.safe_call(TISCamera.sdk.IC_GetImageDescription, self.cam, width, height, bitsPerPixel, COLORFORMAT)
+            TISCamera.safe_call(TISCamera.sdk.IC_GetImageDescription, 1, self.cam, width, height, bitsPerPixel, COLORFORMAT)
 
             width = width.value
             height = height.value
@@ -224,6 +265,8 @@ class TISCamera(Camera):
             height = int(woi[3])
             xpos = int(woi[0])
             ypos = int(woi[2])
+            # The video format can only change out of live mode
+            self._stop_live()
             # This keeps the original format
             idx = self.vid_format.find("(")
             this_vid_format = self.vid_format[:idx]
@@ -233,29 +276,32 @@ class TISCamera(Camera):
             # Now offset
             TISCamera.safe_call(TISCamera.sdk.IC_SetPropertySwitch, 1, self.cam, tis.T("Partial scan"), tis.T("Auto-center"), 0)
             TISCamera.safe_call(TISCamera.sdk.IC_SetPropertyValue, 1, self.cam, tis.T("Partial scan"), tis.T("X Offset"), xpos)
-            TISCamera.safe_call(TISCamera.sdk.IC_SetPropertyValue, 1self.cam, tis.T("Partial scan"), tis.T("Y Offset"), ypos)
+            TISCamera.safe_call(TISCamera.sdk.IC_SetPropertyValue, 1, self.cam, tis.T("Partial scan"), tis.T("Y Offset"), ypos)
         self.width = width
         self.height = height
+        if woi is not None:
+            self._alloc_frames()
+            self._start_live()
 
-    def get_image(self, timeout_ms=2000):
-        """See :meth:`.Camera.get_image`."""
-        buffer_size = 3 * self.bitdepth * self.width * self.height # times 3 is because even Y800 is RGB
-        # Starts the image acquisition
-        TISCamera.safe_call(TISCamera.sdk.IC_StartLive, 0, self.cam, 0)
-        # Snap image 
-        ERR = TISCamera.safe_call(TISCamera.sdk.IC_SnapImage, 0, self.cam, timeout_ms)
-        # If there is an error, then snap image again
-        while ERR <= 0:
-            ERR = TISCamera.safe_call(TISCamera.sdk.IC_SnapImage, 0, self.cam, timeout_ms)
-        # Get image
-        ptr = TISCamera.safe_call(TISCamera.sdk.IC_GetImagePtr, 0, self.cam)
-        img_ptr = ctypes.cast(ptr, ctypes.POINTER(ctypes.c_ubyte * buffer_size))
-        # Reshape the image according to the width and height
-        img = np.ndarray(buffer = img_ptr.contents, dtype = np.uint8, shape = (self.height, self.width, 3)) # 3 for RGB
-        TISCamera.safe_call(TISCamera.sdk.IC_StopLive, 0, self.cam)
-        # We take only the 1st component, assuming that the image is monochromatic.
-        return self.transform(img[:,:,0]) 
+    def get_image(self, timeout_ms=2000, after=None):
+        """
+        See :meth:`.Camera.get_image`. Returns the newest frame received after the time ``after`` (from
+        :func:`time.time`, default is now), waiting up to ``timeout_ms`` for one. Returns ``None`` on timeout.
+        """
+        if after is None:
+            after = time.time()
+        def ready():
+            if self.frame_count <= self.min_frame:
+                return False
+            return self.frame_times[(self.frame_count - 1) % self.n_buffers] > after
+        with self.frame_cond:
+            if not self.frame_cond.wait_for(ready, timeout_ms / 1000):
+                print("No frame from the camera within " + str(timeout_ms) + " ms")
+                return None
+            img = self.frames[(self.frame_count - 1) % self.n_buffers].copy()
+        return self.transform(img)
 
     def flush(self):
-        """See :meth:`.Camera.flush`."""
-        # No flushing is required for TISCamera
+        """See :meth:`.Camera.flush`. Discards the buffered frames."""
+        with self.frame_cond:
+            self.min_frame = self.frame_count
@@ -1,6 +1,7 @@
 import yaml
 import os
 from datetime import datetime
+from collections import deque
 from slmsuite.holography import toolbox
 import numpy as np
 
@@ -9,6 +10,18 @@ import numpy as np
 def save_slm_calculation(hologram, save_options, extra_data = None):
     """
 
+    """
+    snapshot, full_path, full_path2 = snapshot_slm_calculation(hologram, save_options, extra_data)
+    write_snapshot(snapshot)
+    return full_path, full_path2
+
+def snapshot_slm_calculation(hologram, save_options, extra_data = None):
+    """
+    Copies everything save_slm_calculation writes, so that write_snapshot can write it from another thread while the
+    hologram keeps changing. The far field is only computed by write_snapshot.
+
+    Returns:
+        (snapshot, config path, data path), with the paths the files will have.
     """
     if not "config" in save_options:
         save_options["config"] = False
@@ -27,25 +40,27 @@ def save_slm_calculation(hologram, save_options, extra_data = None):
         save_options["prefix"] = now.strftime("%Y%m%d_%H%M%S")
     if not "crop" in save_options:
         save_options["crop"] = True
+    if not "format" in save_options:
+        save_options["format"] = "npz"
 
     full_path = None
     full_path2 = None
+    snapshot = {"config_path": None, "data_path": None, "format": save_options["format"], "farfield": None}
     # Now, we gather all the information to save in the config
     if save_options["config"] is True:
         config_info = dict()
         config_info["method"] = hologram.method
         config_info["iteration"] = hologram.iter
-        config_info["alg_settings"] = hologram.flags
+        config_info["alg_settings"] = dict(hologram.flags)
         config_info["computational_shape"] = str(list(hologram.shape))
         config_info["slm_shape"] = str(list(hologram.slm_shape))
-        config_info["save_options"] = save_options
+        config_info["save_options"] = dict(save_options)
         if extra_data is not None:
             config_info["extra_data"] = extra_data
-        # Now perform the actual save:
         full_path = save_options["path"] + os.sep + save_options["prefix"] + save_options["name"] + "_config.yml"
-        fhdl = open(full_path, 'w')
-        yaml.dump(config_info, fhdl)
-        
+        snapshot["config_path"] = full_path
+        snapshot["config"] = config_info
+
     npy_data = dict()
     if save_options["slm_pattern"] is True:
         # Here, we save the amplitude pattern that is assumed, and the phase pattern for the SLM
@@ -75,8 +90,8 @@ def save_slm_calculation(hologram, save_options, extra_data = None):
             
 
     if save_options["ff_pattern"] is True:
-        # Here, we save the farfield pattern. There is no cropping here.
-        npy_data["ff_amp"] = hologram.extract_farfield()
+        # Here, we save the farfield pattern. There is no cropping here. It is computed when writing.
+        snapshot["farfield"] = (_copy_array(hologram.amp), _copy_array(hologram.phase), tuple(hologram.shape))
 
     if save_options["target"] is True:
         # Here, we save the target. The target is in the computational space
@@ -85,12 +100,91 @@ def save_slm_calculation(hologram, save_options, extra_data = None):
 
     if (save_options["slm_pattern"] is True) or (save_options["ff_pattern"] is True) or (save_options["target"] is True):
         full_path2 = save_options["path"] + os.sep + save_options["prefix"] + save_options["name"] + "_data"
-        np.savez_compressed(full_path2, **npy_data)
-        full_path2 = full_path2 + ".npz" # Add file extension
+        if save_options["format"] != "npy":
+            full_path2 = full_path2 + ".npz" # Add file extension
+        snapshot["data_path"] = full_path2
+    snapshot["data"] = {key: _copy_array(npy_data[key]) for key in npy_data}
 
-    return full_path, full_path2
+    return snapshot, full_path, full_path2
+
+def write_snapshot(snapshot):
+    """
+    Writes a snapshot from snapshot_slm_calculation or snapshot_add_phase.
+    """
+    if snapshot["config_path"] is not None:
+        with open(snapshot["config_path"], 'w') as fhdl:
+            yaml.dump(snapshot["config"], fhdl)
+    if snapshot["data_path"] is None:
+        return
+    npy_data = snapshot["data"]
+    if snapshot["farfield"] is not None:
+        npy_data = dict(npy_data)
+        npy_data["ff_amp"] = farfield(*snapshot["farfield"])
+    if snapshot["format"] == "npy":
+        # a directory with one uncompressed .npy per array, fast to write and memory mapped on load
+        save_npy_dir(snapshot["data_path"], npy_data)
+    else:
+        np.savez_compressed(snapshot["data_path"], **npy_data)
+
+def farfield(amp, phase, shape):
+    # far field of the near field amp * exp(1j * phase) padded to the computational shape, like Hologram.extract_farfield
+    nearfield = toolbox.pad(amp * np.exp(1j * phase), shape)
+    return np.fft.fftshift(np.fft.fft2(np.fft.fftshift(nearfield), norm="ortho"))
 
-def load_slm_calculation(base_path, bConfig, bPhase):
+def _copy_array(data):
+    # copy to host memory, so the snapshot does not change with the hologram
+    if isinstance(data, float):
+        return data
+    if hasattr(data, "get"):
+        return data.get()
+    return np.array(data, copy=True)
+
+
+def save_npy_dir(path, npy_data):
+    os.makedirs(path, exist_ok=True)
+    for key in npy_data:
+        np.save(os.path.join(path, key + ".npy"), npy_data[key])
+
+class NpyDir(object):
+    """
+    The arrays of a calculation saved in the npy format, a directory with one .npy file per array. Like the NpzFile
+    returned by np.load for the npz format, arrays are only read when accessed, and they are memory mapped.
+    """
+    def __init__(self, path, mmap_mode='r'):
+        self.path = path
+        self.mmap_mode = mmap_mode
+        self.files = [fname[:-len(".npy")] for fname in os.listdir(path) if fname.endswith(".npy")]
+
+    def keys(self):
+        return list(self.files)
+
+    def __contains__(self, key):
+        return key in self.files
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __getitem__(self, key):
+        if key not in self.files:
+            raise KeyError(key + " is not a file in " + self.path)
+        data = np.load(os.path.join(self.path, key + ".npy"), mmap_mode=self.mmap_mode, allow_pickle=True)
+        if data.ndim == 0:
+            return data[()]
+        return data
+
+def calculation_base_path(data_path):
+    # base path of a calculation from the path of its data, in either format
+    end = data_path.rfind("_data")
+    if end < 0:
+        raise Exception(data_path + " is not the data of a saved calculation")
+    return data_path[:end]
+
+def load_slm_calculation(base_path, bConfig, bPhase, mmap_mode='r'):
+    """
+    Loads a calculation saved with save_slm_calculation. The format of the data is detected: a _data directory of
+    .npy files is memory mapped with mmap_mode (None reads the arrays into memory), and a _data.npz archive is
+    opened with np.load. In both cases only the arrays accessed are read.
+    """
     config = None
     data = None
     if bConfig:
@@ -98,13 +192,24 @@ def load_slm_calculation(base_path, bConfig, bPhase):
         with open(config_path, 'r') as fhdl:
             config = yaml.load(fhdl, Loader=yaml.FullLoader)
     if bPhase:
-        data_path = base_path + "_data.npz"
-        data = np.load(data_path)
+        if os.path.isdir(base_path + "_data"):
+            data = NpyDir(base_path + "_data", mmap_mode)
+        else:
+            data_path = base_path + "_data.npz"
+            data = np.load(data_path)
     return config,data
 
 def save_add_phase(phase_mgr, save_options, extra_data=None):
     """
 
+    """
+    snapshot, full_path, full_path2 = snapshot_add_phase(phase_mgr, save_options, extra_data)
+    write_snapshot(snapshot)
+    return full_path, full_path2
+
+def snapshot_add_phase(phase_mgr, save_options, extra_data=None):
+    """
+    Like snapshot_slm_calculation, for save_add_phase.
     """
     if not "config" in save_options:
         save_options["config"] = False
@@ -119,6 +224,7 @@ def save_add_phase(phase_mgr, save_options, extra_data=None):
         save_options["prefix"] = now.strftime("%Y%m%d_%H%M%S")
     full_path = None 
     full_path2 = None
+    snapshot = {"config_path": None, "data_path": None, "format": "npz", "farfield": None, "data": dict()}
     # Now, we gather all the information to save in the config
     if save_options["config"] is True:
         config_info = dict()
@@ -126,18 +232,15 @@ def save_add_phase(phase_mgr, save_options, extra_data=None):
         config_info["log"] = str(phase_mgr.add_log)
         if extra_data is not None:
             config_info["extra_data"] = extra_data
-        # Now perform the actual save:
         full_path = save_options["path"] + os.sep + save_options["prefix"] + save_options["name"] + "_add_phase_config.yml"
-        fhdl = open(full_path, 'w')
-        yaml.dump(config_info, fhdl)
+        snapshot["config_path"] = full_path
+        snapshot["config"] = config_info
 
-    npy_data = dict()
     if save_options["phase"] is True:
-        npy_data["phase"] = phase_mgr.additional
-        full_path2 = save_options["path"] + os.sep + save_options["prefix"] + save_options["name"] + "_add_phase_data"
-        np.savez_compressed(full_path2, **npy_data)
-        full_path2 = full_path2 + ".npz" # Add file extension
-    return full_path, full_path2
+        snapshot["data"]["phase"] = np.array(phase_mgr.additional, copy=True)
+        full_path2 = save_options["path"] + os.sep + save_options["prefix"] + save_options["name"] + "_add_phase_data.npz"
+        snapshot["data_path"] = full_path2
+    return snapshot, full_path, full_path2
 
 def load_add_phase(base_path, bConfig, bPhase):
     config = None
@@ -164,7 +267,8 @@ def get_target_from_file(path):
     return get_target(data_dict)
 
 # Callback for hologram feedback
-def feedback_client_callback(client):
+def feedback_client_callback(client, callback=None):
+    # callback is called after the spot amplitudes are updated. Its return value stops the optimization if True.
     def func(hologram):
         hologram.cameraslm.slm.write(hologram.extract_phase(), settle=True)
         spot_amps = client.get_spot_amps()
@@ -174,8 +278,72 @@ def feedback_client_callback(client):
         else:
             print("setting external_spot_amp to " + str(spot_amps))
             hologram.external_spot_amp = spot_amps
+        if callback is not None:
+            return callback(hologram)
     return func
 
+def measure_spot_amps(cameraslm, extractor, phase):
+    # writes phase, takes an image and returns the spot amplitudes found by extractor (a SpotExtractor)
+    cameraslm.slm.write(phase, settle=True)
+    cameraslm.cam.flush()
+    return extractor.amps(cameraslm.cam.get_image())
+
+def camera_feedback_callback(cameraslm, extractor, callback=None):
+    # As feedback_client_callback, with the spot amplitudes measured on the camera by extractor.
+    def func(hologram):
+        hologram.external_spot_amp = measure_spot_amps(cameraslm, extractor, hologram.extract_phase())
+        if callback is not None:
+            return callback(hologram)
+    return func
+
+class ScanFeedbackPipeline(object):
+    """
+    Callback for scan feedback which keeps the experiment busy: once the scan of the displayed phase is done, the next
+    phase, computed while the scan ran, is written and its scan started right away. The optimizer then computes the
+    following phase during that scan.
+
+    The feedback is therefore one iteration late: the phase written at iteration k was computed from the scans of
+    the phases up to k - 2. Only one scan is outstanding at a time, since a scan measures the phase on the SLM. Spot
+    amplitudes are normalized to a mean of 1 and averaged over the last n_average completed scans, which also averages
+    out shot noise. Failed scans and scans without signal (mean amplitude <= 0) are left out.
+    """
+    def __init__(self, client, n_average=1, callback=None):
+        self.client = client
+        self.callback = callback
+        self.history = deque(maxlen=max(1, n_average))
+        self.pending = False # a scan of the displayed phase is running
+
+    def __call__(self, hologram):
+        if self.pending:
+            self.collect()
+        hologram.cameraslm.slm.write(hologram.extract_phase(), settle=True)
+        self.client.request_spot_amps()
+        self.pending = True
+        nspots = len(hologram.spot_amp)
+        if len(self.history) == 0:
+            hologram.external_spot_amp = np.ones(nspots)
+        else:
+            hologram.external_spot_amp = np.mean(self.history, axis=0)
+            print("setting external_spot_amp to " + str(hologram.external_spot_amp))
+        if self.callback is not None:
+            return self.callback(hologram)
+
+    def collect(self):
+        spot_amps = self.client.collect_spot_amps()
+        self.pending = False
+        if np.array_equal(spot_amps, np.array([-1.0])):
+            return
+        mean = np.mean(spot_amps)
+        if not np.isfinite(mean) or mean <= 0:
+            print("Skipping a scan without signal")
+            return
+        self.history.append(spot_amps / mean)
+
+    def finish(self):
+        # waits for the last scan, so that the client can be used again
+        if self.pending:
+            self.collect()
+
 ## Pattern generation
 ## Return 2D target array 'targets' such that targets[0,:] = x coords and targets[1,:] = y coords
 ## Returns also target_amps which is a 1D array of ones the length of the array size
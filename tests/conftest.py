@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of lib import each other by name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+import zmq
+import ArrayFrames
+
+@pytest.fixture
+def pair():
+    ctx = zmq.Context()
+    a = ctx.socket(zmq.PAIR)
+    b = ctx.socket(zmq.PAIR)
+    a.bind("inproc://array_frames_test")
+    b.connect("inproc://array_frames_test")
+    yield a, b
+    a.close()
+    b.close()
+    ctx.term()
+
+@pytest.mark.parametrize("arr", [
+    np.arange(12, dtype=np.uint16).reshape(3, 4),
+    np.linspace(0, 1, 5, dtype=np.float32),
+    np.arange(24, dtype=">f8").reshape(2, 3, 4),
+    np.zeros((0, 3), dtype=np.int32),
+    np.array(7, dtype=np.int64),
+])
+def test_round_trip(pair, arr):
+    ArrayFrames.send(pair[0], arr)
+    out = ArrayFrames.recv(pair[1])
+    assert out.dtype == arr.dtype
+    assert out.shape == arr.shape
+    np.testing.assert_array_equal(out, arr)
+
+def test_non_contiguous_array(pair):
+    arr = np.arange(20, dtype=np.float64).reshape(4, 5)[:, ::2]
+    ArrayFrames.send(pair[0], arr)
+    np.testing.assert_array_equal(ArrayFrames.recv(pair[1]), arr)
+
+def test_header():
+    arr = np.zeros((1200, 1920), dtype="<f4")
+    assert ArrayFrames.header(arr) == "<f4;1200,1920"
+    assert ArrayFrames.parse_header("<f4;1200,1920") == (np.dtype("<f4"), (1200, 1920))
+
+def test_size_mismatch():
+    with pytest.raises(Exception):
+        ArrayFrames.from_frames("<u2;2,2", b"\x00" * 6)
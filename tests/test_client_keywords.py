@@ -0,0 +1,51 @@
+import types
+import numpy as np
+import Client
+
+class FakeSocket(object):
+    # records the frames sent, never answers
+    def __init__(self):
+        self.frames = []
+
+    def send_string(self, frame, flags=0):
+        self.frames.append(frame)
+
+    def send(self, frame, flags=0, copy=True):
+        self.frames.append(bytes(memoryview(frame).cast("B")))
+
+    def poll(self, timeout):
+        return 0
+
+    def close(self):
+        pass
+
+def make_client():
+    client = Client.Client.__new__(Client.Client)
+    client._Client__sock = FakeSocket()
+    client._Client__ctx = types.SimpleNamespace(destroy=None)
+    client.timeout = 0
+    return client
+
+def test_optional_arguments_by_keyword():
+    client = make_client()
+    client.send_use_aperture(10, edge_width=5)
+    assert client._Client__sock.frames[0] == "use_aperture"
+    client._Client__sock.frames.clear()
+    client.send_pattern_data(np.zeros((2, 2)), name="zeros")
+    assert client._Client__sock.frames[0] == "use_pattern_data"
+    assert client._Client__sock.frames[-1] == "zeros"
+    client._Client__sock.frames.clear()
+    client.send_add_phase_data(np.zeros((2, 2)), description="flat")
+    assert client._Client__sock.frames[-1] == "flat"
+    client._Client__sock.frames.clear()
+    client.send_perform_scan_feedback(2, 1, pipeline=3)
+    assert client._Client__sock.frames[-1] == (3).to_bytes(1, "little")
+    client._Client__sock.frames.clear()
+    client.send_calculate(np.zeros((2, 1)), np.ones(1), 0, stopping={"uniformity": 0.9})
+    assert client._Client__sock.frames[-1] == "{uniformity: 0.9}\n"
+    client._Client__sock.frames.clear()
+    client.send_save("path", "name", save_format="npy")
+    assert client._Client__sock.frames[-1] == "npy"
+    client._Client__sock.frames.clear()
+    client.send_flush_saves(timeout=5)
+    assert client._Client__sock.frames == ["flush_saves", np.array([5.0]).tobytes()]
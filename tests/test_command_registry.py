@@ -0,0 +1,51 @@
+import pytest
+import CommandRegistry
+
+registry = CommandRegistry.CommandRegistry()
+
+class Handler(object):
+    registry = registry
+
+    @registry.command("echo", args=[1, 0], reply=[1, 0])
+    def echo(self, text, data):
+        return [1, 0], [text, data]
+
+    @registry.command("optional", args=[1, 1], n_optional=1)
+    def optional(self, first, second="default"):
+        return [1], [first + " " + second]
+
+    @registry.command("many", args=[1], varargs=True)
+    def many(self, first, *rest):
+        return [1], [first + " " + str(len(rest))]
+
+    @registry.command("fail", reply=[1, 0, 1])
+    def fail(self):
+        raise ValueError("broken")
+
+def test_dispatch_decodes_string_frames():
+    assert registry.dispatch(Handler(), "echo", [b"hello", b"\x01\x02"]) == ([1, 0], ["hello", b"\x01\x02"])
+
+def test_unknown_command():
+    assert registry.dispatch(Handler(), "nope", []) == ([1], ["error: unknown_command: nope"])
+
+@pytest.mark.parametrize("frames", [[b"a"], [b"a", b"b", b"c"]])
+def test_bad_frames(frames):
+    msg_type, rep = registry.dispatch(Handler(), "echo", frames)
+    assert msg_type == [1, 1]
+    assert rep == ["error: bad_frames: echo expects 2 frames, got " + str(len(frames))] * 2
+
+def test_optional_frames():
+    h = Handler()
+    assert registry.dispatch(h, "optional", [b"a"]) == ([1], ["a default"])
+    assert registry.dispatch(h, "optional", [b"a", b"b"]) == ([1], ["a b"])
+    assert registry.dispatch(h, "optional", [])[1] == ["error: bad_frames: optional expects 1 to 2 frames, got 0"]
+
+def test_varargs():
+    assert registry.dispatch(Handler(), "many", [b"a", b"x", b"y"]) == ([1], ["a 2"])
+
+def test_exception_padded_to_reply():
+    assert registry.dispatch(Handler(), "fail", []) == ([1, 1, 1], ["error: exception: broken"] * 3)
+
+def test_describe():
+    assert "echo:10:10" in registry.describe().split(";")
+    assert "many:1*:1" in registry.describe().split(";")
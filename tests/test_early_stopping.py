@@ -0,0 +1,74 @@
+import pytest
+import EarlyStopping
+
+class Hologram(object):
+    # stats as slmsuite keeps them: one value per finished iteration
+    def __init__(self, efficiency, uniformity, group="computational_spot"):
+        self.efficiency = efficiency
+        self.uniformity = uniformity
+        self.group = group
+        self.iter = 0
+        self.stats = {"stats": {group: {"efficiency": [], "uniformity": []}}}
+
+    def optimize(self, maxiter, callback):
+        # same order as the slmsuite loop: callback, then the stats of the iteration
+        for _ in range(maxiter):
+            if callback(self):
+                break
+            stats = self.stats["stats"][self.group]
+            stats["efficiency"].append(self.efficiency[min(self.iter, len(self.efficiency) - 1)])
+            stats["uniformity"].append(self.uniformity[min(self.iter, len(self.uniformity) - 1)])
+            self.iter += 1
+
+def run(criteria, efficiency, uniformity, maxiter=20, callback=None):
+    hologram = Hologram(efficiency, uniformity)
+    monitor = criteria.monitor("computational_spot", callback)
+    hologram.optimize(maxiter, monitor)
+    return monitor.info(hologram)
+
+def test_no_criteria_runs_all_iterations():
+    info = run(EarlyStopping.StoppingCriteria(), [0.5], [0.5], maxiter=7)
+    assert info["reason"] == "max_iterations"
+    assert info["iterations"] == 7
+    assert info["efficiency"] == 0.5
+
+def test_uniformity():
+    info = run(EarlyStopping.StoppingCriteria(uniformity=0.9), [0.5], [0.1, 0.5, 0.95, 0.99])
+    assert info["reason"] == "uniformity"
+    assert info["iterations"] == 3
+    assert info["uniformity"] == 0.95
+
+def test_plateau():
+    efficiency = [0.1, 0.3, 0.5, 0.6, 0.6, 0.6, 0.6, 0.6]
+    info = run(EarlyStopping.StoppingCriteria(plateau=1e-3, plateau_iterations=2), efficiency, [0.5])
+    assert info["reason"] == "plateau"
+    assert info["iterations"] == 6
+
+def test_max_time():
+    info = run(EarlyStopping.StoppingCriteria(max_time=0), [0.5], [0.5])
+    assert info["reason"] == "max_time"
+    assert info["iterations"] == 1
+
+def test_min_iterations():
+    info = run(EarlyStopping.StoppingCriteria(uniformity=0.5, min_iterations=4), [0.5], [1.0])
+    assert info["iterations"] == 4
+
+def test_callback_stops_first():
+    info = run(EarlyStopping.StoppingCriteria(uniformity=0.5), [0.5], [1.0], callback=lambda h: h.iter == 1)
+    assert info["reason"] == "callback"
+    assert info["iterations"] == 1
+
+def test_n_iters():
+    assert EarlyStopping.StoppingCriteria().n_iters(0, 20) == 20
+    assert EarlyStopping.StoppingCriteria(max_iterations=80).n_iters(0, 20) == 20
+    assert EarlyStopping.StoppingCriteria(uniformity=0.9, max_iterations=80).n_iters(0, 20) == 80
+    assert EarlyStopping.StoppingCriteria(uniformity=0.9, max_iterations=80).n_iters(5, 20) == 5
+
+def test_from_dict_and_updated():
+    criteria = EarlyStopping.StoppingCriteria.from_dict({"uniformity": 0.9, "max_time": 5})
+    updated = criteria.updated({"uniformity": None, "plateau": 0.01})
+    assert updated.to_dict()["plateau"] == 0.01
+    assert updated.uniformity is None and updated.max_time == 5
+    assert criteria.uniformity == 0.9
+    with pytest.raises(Exception):
+        EarlyStopping.StoppingCriteria.from_dict({"uniformty": 0.9})
@@ -0,0 +1,127 @@
+import threading
+import types
+import CommandRegistry
+import JobQueue
+
+def wait_done(job):
+    job.future.exception(5)
+
+def test_status_and_result():
+    queue = JobQueue.JobQueue()
+    started = threading.Event()
+    release = threading.Event()
+    def work(value):
+        started.set()
+        release.wait(5)
+        return [1], ["ok " + value]
+    job = queue.submit("work", [1], work, "a")
+    started.wait(5)
+    queue_job = queue.submit("work", [1], work, "b")
+    assert job.status() == "running"
+    assert queue_job.status() == "queued"
+    assert job.result() is None
+    release.set()
+    wait_done(job)
+    wait_done(queue_job)
+    assert job.status() == "done"
+    assert job.result() == ([1], ["ok a"])
+    assert queue.get(queue_job.job_id).result() == ([1], ["ok b"])
+    queue.shutdown()
+
+def test_errors():
+    queue = JobQueue.JobQueue()
+    def fail():
+        raise ValueError("broken")
+    job = queue.submit("fail", [1, 0], fail)
+    wait_done(job)
+    assert job.status() == "error"
+    assert job.result() == ([1, 1], ["error: exception: broken"] * 2)
+    job = queue.submit("reply_error", [1], lambda: CommandRegistry.error_reply("bad", "input"))
+    wait_done(job)
+    assert job.status() == "error"
+    assert queue.cancel(job.job_id) == "already finished"
+    assert queue.cancel("nope") == "unknown job"
+    queue.shutdown()
+
+def test_cancel():
+    queue = JobQueue.JobQueue()
+    started = threading.Event()
+    def work():
+        started.set()
+        # a job stops itself by checking cancelled, as the optimization callbacks do
+        job = queue.current_job()
+        while not job.cancelled():
+            job.cancel_event.wait(0.01)
+        return [1], ["stopped"]
+    running = queue.submit("work", [1], work)
+    started.wait(5)
+    queued = queue.submit("work", [1], work)
+    assert queue.cancel(queued.job_id) == "cancelled"
+    assert queued.status() == "cancelled"
+    assert queue.cancel(running.job_id) == "cancelling"
+    wait_done(running)
+    assert running.status() == "cancelled"
+    assert queue.current_job() is None
+    queue.shutdown()
+
+def test_progress_callback():
+    queue = JobQueue.JobQueue()
+    hologram = types.SimpleNamespace(iter=3, stats={"stats": {"computational_spot": {"efficiency": [0.1, 0.5], "uniformity": [0.9]}}})
+    def work():
+        job = queue.current_job()
+        stop = job.progress_callback()(hologram)
+        return [1], [str(stop)]
+    job = queue.submit("work", [1], work)
+    wait_done(job)
+    assert job.result() == ([1], ["False"])
+    assert job.get_progress() == {"iteration": 3, "efficiency": 0.5, "uniformity": 0.9}
+    queue.shutdown()
+
+def test_prune_finished():
+    queue = JobQueue.JobQueue(max_finished=2)
+    jobs = [queue.submit("work", [1], lambda: ([1], ["ok"])) for _ in range(4)]
+    for job in jobs:
+        wait_done(job)
+    queue.submit("work", [1], lambda: ([1], ["ok"]))
+    assert queue.get(jobs[0].job_id) is None
+    assert queue.get(jobs[3].job_id) is not None
+    queue.shutdown()
+
+registry = CommandRegistry.CommandRegistry()
+
+class Handler(object):
+    registry = registry
+
+    def __init__(self):
+        self.state_lock = threading.RLock()
+
+    @registry.command("locked", state=True)
+    def locked(self):
+        return [1], ["ok"]
+
+def test_state_command_busy_while_a_job_holds_the_lock():
+    h = Handler()
+    queue = JobQueue.JobQueue()
+    held = threading.Event()
+    release = threading.Event()
+    def job():
+        with h.state_lock:
+            held.set()
+            release.wait(5)
+        return [1], ["done"]
+    running = queue.submit("job", [1], job)
+    held.wait(5)
+    try:
+        assert registry.dispatch(h, "locked", []) == ([1], ["error: busy: locked cannot run while a job is running"])
+    finally:
+        release.set()
+    wait_done(running)
+    assert registry.dispatch(h, "locked", []) == ([1], ["ok"])
+    # jobs wait for the lock instead
+    cmd = registry.commands["locked"]
+    with h.state_lock:
+        waiting = queue.submit("locked", cmd.reply, registry.run, h, cmd, [], True)
+        assert not waiting.future.done()
+    wait_done(waiting)
+    assert waiting.result() == ([1], ["ok"])
+    queue.shutdown()
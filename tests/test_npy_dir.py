@@ -0,0 +1,45 @@
+import os
+import numpy as np
+import pytest
+import utils
+
+DATA = {"raw_slm_phase": np.arange(12, dtype=np.float32).reshape(3, 4), "spot_ij": np.array([[1, 2], [3, 4]]),
+        "rot_angle": 0.25}
+
+def save(base_path, fmt):
+    ext = "_data" if fmt == "npy" else "_data.npz"
+    utils.write_snapshot({"config_path": base_path + "_config.yml", "config": {"n_iters": 3},
+                          "data_path": base_path + ext, "data": DATA, "farfield": None, "format": fmt})
+
+@pytest.mark.parametrize("fmt", ["npy", "npz"])
+def test_round_trip(tmp_path, fmt):
+    base_path = str(tmp_path / "calc")
+    save(base_path, fmt)
+    config, data = utils.load_slm_calculation(base_path, True, True)
+    assert config == {"n_iters": 3}
+    assert sorted(data.keys()) == sorted(DATA.keys())
+    assert "spot_ij" in data
+    np.testing.assert_array_equal(data["raw_slm_phase"], DATA["raw_slm_phase"])
+    assert data["raw_slm_phase"].dtype == np.float32
+    np.testing.assert_array_equal(data["spot_ij"], DATA["spot_ij"])
+    assert float(data["rot_angle"]) == 0.25
+
+def test_npy_dir_is_memory_mapped(tmp_path):
+    base_path = str(tmp_path / "calc")
+    save(base_path, "npy")
+    assert os.path.isdir(base_path + "_data")
+    _, data = utils.load_slm_calculation(base_path, False, True)
+    assert isinstance(data["raw_slm_phase"], np.memmap)
+    assert not data["raw_slm_phase"].flags.writeable
+    assert isinstance(data["rot_angle"], float)
+    assert sorted(data) == sorted(DATA)
+    with pytest.raises(KeyError):
+        data["missing"]
+    _, data = utils.load_slm_calculation(base_path, False, True, mmap_mode=None)
+    assert not isinstance(data["raw_slm_phase"], np.memmap)
+
+def test_calculation_base_path():
+    assert utils.calculation_base_path("/a/b/calc_data") == "/a/b/calc"
+    assert utils.calculation_base_path("/a/b/calc_data.npz") == "/a/b/calc"
+    with pytest.raises(Exception):
+        utils.calculation_base_path("/a/b/calc_config.yml")
@@ -0,0 +1,64 @@
+import os
+import numpy as np
+import pytest
+import utils
+import PatternCache
+
+def save(base_path, value, fmt="npz", shape=(16, 16)):
+    data_path = base_path + ("_data" if fmt == "npy" else "_data.npz")
+    utils.write_snapshot({"config_path": None, "data_path": data_path, "data": {"slm_phase": np.full(shape, value)},
+                          "farfield": None, "format": fmt})
+
+def test_hits_and_misses(tmp_path):
+    cache = PatternCache.PatternCache()
+    base_path = str(tmp_path / "a")
+    save(base_path, 1.0)
+    phase = cache.get(base_path)
+    assert phase.dtype == np.float32
+    assert not phase.flags.writeable
+    np.testing.assert_array_equal(phase, 1.0)
+    assert cache.get(base_path) is phase
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.stats().startswith("hits: 1 misses: 1 evictions: 0 entries: 1")
+
+@pytest.mark.parametrize("fmt", ["npy", "npz"])
+def test_reload_when_saved_again(tmp_path, fmt):
+    cache = PatternCache.PatternCache()
+    base_path = str(tmp_path / "a")
+    save(base_path, 1.0, fmt)
+    cache.get(base_path)
+    save(base_path, 2.0, fmt, shape=(16, 32))
+    path = cache.data_path(base_path)
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10**9))
+    np.testing.assert_array_equal(cache.get(base_path), np.full((16, 32), 2.0))
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert len(cache.entries) == 1
+    assert cache.n_bytes == 16 * 32 * 4
+
+def test_least_recently_used_is_evicted(tmp_path):
+    # room for two 16x16 float32 phases
+    cache = PatternCache.PatternCache(max_bytes=2 * 16 * 16 * 4)
+    paths = [str(tmp_path / name) for name in "abc"]
+    for i, path in enumerate(paths):
+        save(path, i)
+    cache.get(paths[0])
+    cache.get(paths[1])
+    cache.get(paths[0])
+    cache.get(paths[2])
+    assert cache.evictions == 1
+    assert list(cache.entries) == [cache.data_path(paths[0]), cache.data_path(paths[2])]
+    assert cache.n_bytes == cache.max_bytes
+    cache.get(paths[1])
+    assert cache.misses == 4
+
+def test_phase_larger_than_the_cache(tmp_path):
+    cache = PatternCache.PatternCache(max_bytes=100)
+    base_path = str(tmp_path / "a")
+    save(base_path, 1.0)
+    np.testing.assert_array_equal(cache.get(base_path), 1.0)
+    assert len(cache.entries) == 0
+    assert cache.n_bytes == 0
+    cache.get(base_path)
+    assert cache.misses == 2
+    cache.clear()
+    assert cache.n_bytes == 0
@@ -0,0 +1,84 @@
+import types
+import numpy as np
+import PhaseManager
+
+def make():
+    return PhaseManager.PhaseManager(types.SimpleNamespace(shape=(6, 8)))
+
+def phase(value):
+    return np.full((6, 8), value, dtype=np.float32)
+
+def test_layers_sum_into_composite():
+    pm = make()
+    pm.set_base(phase(1))
+    pm.add_layer("offset", phase(2), "two")
+    pm.add_layer("offset", phase(4), "four")
+    np.testing.assert_allclose(pm.get(), 7)
+
+def test_toggle_layer():
+    pm = make()
+    pm.add_layer("offset", phase(2), "two")
+    name = pm.add_layer("offset", phase(4), "four")
+    version = pm.version
+    pm.set_layer_enabled(name, False)
+    assert pm.version != version
+    np.testing.assert_allclose(pm.get(), 2)
+    assert pm.add_log == [["offset", "two"]]
+    version = pm.version
+    pm.set_layer_enabled(name, False)
+    assert pm.version == version
+    pm.set_layer_enabled(name, True)
+    np.testing.assert_allclose(pm.get(), 6)
+    assert pm.get_layers()[1] == [name, "offset", "four", True]
+
+def test_remove_and_update_layer():
+    pm = make()
+    first = pm.add_layer("offset", phase(2), "two")
+    second = pm.add_layer("offset", phase(4), "four")
+    pm.remove_layer(first)
+    np.testing.assert_allclose(pm.get(), 4)
+    pm.update_layer(second, phase(5), "five")
+    np.testing.assert_allclose(pm.get(), 5)
+    pm.set_layer_enabled(second, False)
+    pm.update_layer(second, phase(3))
+    np.testing.assert_allclose(pm.get(), 0)
+    pm.set_layer_enabled(second, True)
+    np.testing.assert_allclose(pm.get(), 3)
+
+def test_aperture():
+    pm = make()
+    pm.set_base(phase(1))
+    pm.set_aperture([2, 2])
+    composite = pm.get()
+    assert composite[0, 0] == 0
+    assert composite[3, 4] == 1
+    pm.reset_aperture()
+    np.testing.assert_allclose(pm.get(), 1)
+
+def test_base_version():
+    pm = make()
+    base = phase(1)
+    pm.set_base(base)
+    version = pm.version
+    base += 1
+    pm.set_base(base)
+    assert pm.version != version
+    np.testing.assert_allclose(pm.get(), 2)
+    cached = phase(3)
+    cached.flags.writeable = False
+    pm.set_base(cached)
+    version = pm.version
+    pm.set_base(cached)
+    assert pm.version == version
+
+def test_toggle_restores_exact_sum():
+    pm = make()
+    rng = np.random.default_rng(0)
+    names = [pm.add_layer("zernike", rng.normal(0, 10, (6, 8)), str(i)) for i in range(5)]
+    expected = pm.additional.copy()
+    for n in range(200):
+        pm.set_layer_enabled(names[n % 5], False)
+        pm.set_layer_enabled(names[n % 5], True)
+    np.testing.assert_array_equal(pm.additional, expected)
+    pm.remove_layer(names[0])
+    np.testing.assert_array_equal(pm.additional, sum(pm.layers[name][2] for name in names[1:]))
@@ -0,0 +1,60 @@
+import threading
+import time
+import pytest
+import utils
+import SaveQueue
+
+def snapshot(base_path):
+    return {"config_path": base_path + "_config.yml", "config": {}, "data_path": base_path + "_data.npz",
+            "data": {}, "farfield": None, "format": "npz"}
+
+def wait_until(condition, timeout=5):
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        time.sleep(0.01)
+    return condition()
+
+@pytest.fixture
+def queue():
+    queue = SaveQueue.SaveQueue()
+    yield queue
+    queue.shutdown()
+
+def test_wait_for_blocks_until_written(monkeypatch, queue):
+    release = threading.Event()
+    written = []
+    def write_snapshot(snapshot):
+        release.wait(5)
+        written.append(snapshot["data_path"])
+    monkeypatch.setattr(utils, "write_snapshot", write_snapshot)
+    queue.submit(snapshot("/tmp/calc"))
+    assert not queue.wait_for("/tmp/calc", timeout=0.05)
+    assert queue.wait_for("/tmp/other")
+    assert queue.status().startswith("pending: 1 saved: 0")
+    release.set()
+    assert queue.wait_for("/tmp/calc_data.npz", timeout=5)
+    assert written == ["/tmp/calc_data.npz"]
+    assert wait_until(lambda: queue.status() == "pending: 0 saved: 1 errors: 0")
+
+def test_failed_save_is_recorded(monkeypatch, queue):
+    def write_snapshot(snapshot):
+        raise IOError("disk full")
+    monkeypatch.setattr(utils, "write_snapshot", write_snapshot)
+    queue.submit(snapshot("/tmp/calc"))
+    # a failed save does not block loading, the load reports the missing file
+    assert queue.wait_for("/tmp/calc", timeout=5)
+    assert wait_until(lambda: len(queue.pending) == 0)
+    assert queue.errors == [(["/tmp/calc_config.yml", "/tmp/calc_data.npz"], "disk full")]
+    assert "errors: 1 last error" in queue.status()
+
+def test_flush_waits_for_every_save(monkeypatch, queue):
+    monkeypatch.setattr(utils, "write_snapshot", lambda snapshot: time.sleep(0.05))
+    for i in range(3):
+        queue.submit(snapshot("/tmp/calc" + str(i)))
+    queue.flush(5)
+    assert wait_until(lambda: queue.n_saved == 3)
+
+def test_base_path():
+    assert SaveQueue.SaveQueue.base_path(["/a/c_add_phase_config.yml", "/a/c_add_phase_data.npz"]) == "/a/c"
+    assert SaveQueue.SaveQueue.base_path(["/a/c_data"]) == "/a/c"
+    assert SaveQueue.SaveQueue.base_path([]) == ""
@@ -0,0 +1,117 @@
+import types
+import numpy as np
+import utils
+import Client
+
+class FakeClient(object):
+    def __init__(self, scans):
+        self.scans = list(scans)
+        self.log = []
+
+    def request_spot_amps(self):
+        self.log.append("request")
+
+    def collect_spot_amps(self):
+        self.log.append("collect")
+        return np.array(self.scans.pop(0), dtype=float)
+
+def fake_hologram(nspots=3):
+    hologram = types.SimpleNamespace(spot_amp=np.ones(nspots), external_spot_amp=None, written=[], iter=0)
+    hologram.extract_phase = lambda: hologram.iter
+    def write(phase, settle=False):
+        hologram.written.append(phase)
+    hologram.cameraslm = types.SimpleNamespace(slm=types.SimpleNamespace(write=write))
+    return hologram
+
+def step(pipeline, hologram):
+    pipeline(hologram)
+    hologram.iter += 1
+    return np.array(hologram.external_spot_amp)
+
+def test_one_scan_in_flight_and_one_iteration_late():
+    client = FakeClient([[1, 2, 3], [2, 2, 2], [5, 5, 5]])
+    pipeline = utils.ScanFeedbackPipeline(client)
+    hologram = fake_hologram()
+    np.testing.assert_array_equal(step(pipeline, hologram), np.ones(3))
+    assert client.log == ["request"]
+    # the scan of the first phase is used from the second iteration on
+    np.testing.assert_allclose(step(pipeline, hologram), [0.5, 1, 1.5])
+    assert client.log == ["request", "collect", "request"]
+    np.testing.assert_allclose(step(pipeline, hologram), [1, 1, 1])
+    assert hologram.written == [0, 1, 2]
+    pipeline.finish()
+    assert not pipeline.pending
+    pipeline.finish()
+    assert client.log.count("collect") == 3
+
+def test_failed_and_empty_scans_are_skipped():
+    client = FakeClient([[1, 2, 3], [-1], [0, 0, 0], [np.nan, 1, 1], [3, 3, 3]])
+    pipeline = utils.ScanFeedbackPipeline(client)
+    hologram = fake_hologram()
+    step(pipeline, hologram)
+    expected = np.array([0.5, 1, 1.5])
+    for i in range(4):
+        np.testing.assert_allclose(step(pipeline, hologram), expected)
+    np.testing.assert_allclose(step(pipeline, hologram), np.ones(3))
+
+def test_average_of_the_last_scans():
+    client = FakeClient([[1, 1, 4], [4, 1, 1], [1, 4, 1]])
+    pipeline = utils.ScanFeedbackPipeline(client, n_average=2)
+    hologram = fake_hologram()
+    step(pipeline, hologram)
+    step(pipeline, hologram)
+    np.testing.assert_allclose(step(pipeline, hologram), [1.25, 0.5, 1.25])
+    np.testing.assert_allclose(step(pipeline, hologram), [1.25, 1.25, 0.5])
+
+def test_callback_can_stop():
+    pipeline = utils.ScanFeedbackPipeline(FakeClient([]), callback=lambda hologram: True)
+    assert pipeline(fake_hologram()) is True
+
+class FakeSocket(object):
+    # records the frames sent and answers with reply
+    def __init__(self, reply=None):
+        self.frames = []
+        self.reply = reply
+
+    def connect(self, url):
+        pass
+
+    def send_string(self, frame, flags=0):
+        self.frames.append(frame)
+
+    def send(self, frame, flags=0):
+        self.frames.append(frame)
+
+    def poll(self, timeout):
+        return 0 if self.reply is None else 1
+
+    def recv(self):
+        return self.reply
+
+    def close(self, linger=None):
+        pass
+
+def make_feedback_client(sock, NumPerParamAvg=-1):
+    client = Client.FeedbackClient.__new__(Client.FeedbackClient)
+    client._FeedbackClient__url = "tcp://localhost:0"
+    client._FeedbackClient__ctx = types.SimpleNamespace(socket=lambda kind: sock)
+    client._FeedbackClient__async_sock = None
+    client.scan_fname = "scan.yml"
+    client.scan_name = "scan"
+    client.NumPerParamAvg = NumPerParamAvg
+    return client
+
+def test_feedback_client_request_and_collect():
+    sock = FakeSocket(np.array([1.0, 2.0]).tobytes())
+    client = make_feedback_client(sock)
+    assert np.array_equal(client.collect_spot_amps(), np.array([-1.0]))
+    client.request_spot_amps()
+    # the default of -1 is sent signed
+    assert sock.frames == ["get_spot_amps", "scan.yml", "scan", (-1).to_bytes(4, "little", signed=True)]
+    np.testing.assert_array_equal(client.collect_spot_amps(), [1.0, 2.0])
+
+def test_feedback_client_collect_timeout():
+    client = make_feedback_client(FakeSocket())
+    client.request_spot_amps()
+    assert np.array_equal(client.collect_spot_amps(0), np.array([-1.0]))
+    assert client._FeedbackClient__async_sock is None
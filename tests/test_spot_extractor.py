@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+import SpotExtractor
+
+def window_sum(img, x, y, w, h):
+    # pixels of the window of a spot inside the image
+    rows = [r for r in range(y - h // 2, y - h // 2 + h) if 0 <= r < img.shape[0]]
+    cols = [c for c in range(x - w // 2, x - w // 2 + w) if 0 <= c < img.shape[1]]
+    return img[np.ix_(rows, cols)].sum()
+
+@pytest.fixture
+def img():
+    return np.random.default_rng(0).integers(0, 1000, size=(40, 50)).astype(np.uint16)
+
+def test_sums_inside_and_at_edges(img):
+    centers = np.array([[25, 0, 49, 10, 60], [20, 0, 39, 38, 5]])
+    extractor = SpotExtractor.SpotExtractor(centers, (5, 3), img.shape)
+    expected = [window_sum(img.astype(float), x, y, 5, 3) for x, y in centers.T]
+    np.testing.assert_allclose(extractor.sums(img), expected)
+    np.testing.assert_allclose(extractor.amps(img), np.sqrt(expected))
+
+def test_windows_shape(img):
+    extractor = SpotExtractor.SpotExtractor([[10, 20], [10, 20]], 3, img.shape)
+    windows = extractor.windows(img)
+    assert windows.shape == (2, 3, 3)
+    assert windows.dtype == img.dtype
+    np.testing.assert_array_equal(windows[1], img[19:22, 19:22])
+
+def test_background(img):
+    extractor = SpotExtractor.SpotExtractor([[10, 0], [10, 0]], 3, img.shape, background=1)
+    # the corner window has 4 pixels in the image
+    np.testing.assert_allclose(extractor.sums(img), [window_sum(img.astype(float), 10, 10, 3, 3) - 9, img[:2, :2].sum() - 4])
+    extractor.set_background(img)
+    np.testing.assert_allclose(extractor.sums(img), 0)
+
+def test_centroids():
+    img = np.zeros((30, 30))
+    img[10, 11] = 3
+    img[11, 11] = 1
+    img[0, 0] = 2
+    img[0, 1] = 2
+    extractor = SpotExtractor.SpotExtractor([[10, 0], [10, 0]], 5, img.shape)
+    np.testing.assert_allclose(extractor.centroids(img), [[11, 0.5], [10.25, 0]])
+
+def test_centroid_of_empty_window():
+    extractor = SpotExtractor.SpotExtractor([[5], [5]], 3, (20, 20))
+    assert np.all(np.isnan(extractor.centroids(np.zeros((20, 20)))))
+
+def test_from_hologram():
+    class Hologram(object):
+        spot_ij = np.array([[4.4, 8.6], [2.0, 7.0]])
+        spot_integration_width_ij = 3
+    extractor = SpotExtractor.SpotExtractor.from_hologram(Hologram(), (10, 12))
+    np.testing.assert_array_equal(extractor.centers, [[4, 9], [2, 7]])
+    assert extractor.size == (3, 3)
+
+def test_from_hologram_without_width():
+    class Hologram(object):
+        spot_ij = np.array([[10.0, 14.0, 30.0], [10.0, 10.0, 20.0]])
+        spot_integration_width_ij = None
+    # the closest spots are 4 pixels apart, 4 / 1.5 is below the minimum of 3
+    assert SpotExtractor.SpotExtractor.from_hologram(Hologram(), (40, 40)).size == (3, 3)
+    Hologram.spot_ij = np.array([[10.0, 30.0], [10.0, 10.0]])
+    assert SpotExtractor.SpotExtractor.from_hologram(Hologram(), (40, 40)).size == (5, 5)
+    Hologram.spot_ij = np.array([[10.0], [10.0]])
+    assert SpotExtractor.SpotExtractor.from_hologram(Hologram(), (40, 40)).size == (5, 5)
+
+def test_from_hologram_without_spots():
+    class Hologram(object):
+        spot_ij = np.zeros((2, 0))
+        spot_integration_width_ij = None
+    extractor = SpotExtractor.SpotExtractor.from_hologram(Hologram(), (10, 12))
+    img = np.ones((10, 12))
+    assert extractor.sums(img).shape == (0,)
+    assert extractor.centroids(img).shape == (2, 0)
+    Hologram.spot_ij = None
+    with pytest.raises(Exception):
+        SpotExtractor.SpotExtractor.from_hologram(Hologram(), (10, 12))
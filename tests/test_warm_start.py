@@ -0,0 +1,59 @@
+import numpy as np
+import utils
+import WarmStart
+
+def save(path, phase):
+    utils.write_snapshot({"config_path": None, "data_path": str(path) + "_data.npz", "data": {"raw_slm_phase": phase},
+                          "farfield": None, "format": "npz"})
+
+SPOTS = np.array([[10.0, 20.0, 30.0], [5.0, 5.0, 12.0]])
+
+def test_find_translated_spots(tmp_path):
+    index = WarmStart.WarmStartIndex(str(tmp_path / "index.yml"), max_residual=0.5)
+    index.add("a", SPOTS, np.ones(3), (64, 64), "cal")
+    # same spots in another order, shifted by (2, -1) and slightly perturbed
+    spots = SPOTS[:, [2, 0, 1]] + np.array([[2.0], [-1.0]])
+    spots[0, 0] += 0.1
+    entry, shift, residual = index.find(spots, (64, 64), "cal")
+    assert entry["path"] == "a"
+    np.testing.assert_allclose(shift, [2 + 0.1 / 3, -1])
+    assert residual < 0.1
+    assert index.find(spots, (128, 128))[0] is None
+    assert index.find(spots[:, :2], (64, 64))[0] is None
+    spots[0, 0] += 2
+    assert index.find(spots, (64, 64))[0] is None
+
+def test_prefers_same_calibration_and_reloads(tmp_path):
+    index = WarmStart.WarmStartIndex(str(tmp_path / "index.yml"))
+    index.add("old", SPOTS, np.ones(3), (64, 64), "other")
+    index.add("new", SPOTS, np.ones(3), (64, 64), "cal")
+    assert index.find(SPOTS, (64, 64), "cal")[0]["path"] == "new"
+    assert index.find(SPOTS, (64, 64), "other")[0]["path"] == "old"
+    index.add("old", SPOTS + 100, np.ones(3), (64, 64), "other")
+    assert len(WarmStart.WarmStartIndex(str(tmp_path / "index.yml")).entries) == 2
+
+def test_blaze_translates_the_far_field():
+    shape = (64, 64)
+    phase = WarmStart.blaze((32, 32), (5, -3), shape)
+    farfield = np.abs(utils.farfield(np.ones((32, 32)), phase, shape))
+    assert np.unravel_index(np.argmax(farfield), shape) == (32 - 3, 32 + 5)
+
+def test_seed_phase_waits_for_the_save(tmp_path):
+    waited = []
+    base = str(tmp_path / "calc")
+    def wait_for_save(path):
+        # the calculation is only written once the server's save queue gets to it
+        waited.append(path)
+        save(path, np.full((32, 32), 0.5))
+    index = WarmStart.WarmStartIndex(str(tmp_path / "index.yml"), wait_for_save=wait_for_save)
+    index.add(base, SPOTS, np.ones(3), (64, 64))
+    phase, source = index.seed_phase(SPOTS + np.array([[1.0], [0.0]]), (64, 64))
+    assert waited == [base]
+    assert source == base
+    np.testing.assert_allclose(phase, 0.5 + WarmStart.blaze((32, 32), (1, 0), (64, 64)))
+
+def test_seed_phase_without_match_or_file(tmp_path):
+    index = WarmStart.WarmStartIndex(str(tmp_path / "index.yml"))
+    assert index.seed_phase(SPOTS, (64, 64)) == (None, None)
+    index.add(str(tmp_path / "missing"), SPOTS, np.ones(3), (64, 64))
+    assert index.seed_phase(SPOTS, (64, 64)) == (None, None)